@@ -0,0 +1,78 @@
+'''
+Benchmarks pangenome.consolidate_seqs() across worker counts on synthetic
+genome FAAs, and checks that every parallel run reproduces the serial outputs.
+
+Usage:
+    python benchmarks/consolidate_seqs_scaling.py --genomes 500 --proteins 3000 --jobs 1 2 4 8
+'''
+
+import os, argparse, tempfile, time, filecmp
+
+import numpy as np
+
+from pyphylon.pangenome import consolidate_seqs
+
+AMINO_ACIDS = np.array(list('ACDEFGHIKLMNPQRSTVWY'))
+
+
+def write_synthetic_genomes(output_dir, n_genomes, n_proteins, pool_size, mutation_rate, seed=42):
+    ''' Writes n_genomes FAAs sampling proteins from a shared pool, mutating a
+        fraction of them to create genome-specific alleles. Returns FAA paths. '''
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(100, 600, size=pool_size)
+    pool = [''.join(rng.choice(AMINO_ACIDS, size=l)) for l in lengths]
+    genome_paths = []
+    for g in range(n_genomes):
+        genome_path = os.path.join(output_dir, 'genome' + str(g) + '.faa')
+        protein_ids = rng.choice(pool_size, size=n_proteins, replace=False)
+        with open(genome_path, 'w') as f:
+            for p, protein_id in enumerate(protein_ids):
+                seq = pool[protein_id]
+                if rng.random() < mutation_rate: # genome-specific allele
+                    pos = rng.integers(len(seq))
+                    seq = seq[:pos] + rng.choice(AMINO_ACIDS) + seq[pos+1:]
+                f.write('>genome' + str(g) + '_' + str(p) + ' hypothetical protein\n')
+                f.write('\n'.join(seq[i:i+60] for i in range(0, len(seq), 60)) + '\n')
+        genome_paths.append(genome_path)
+    return genome_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--genomes', type=int, default=200, help='number of synthetic genomes')
+    parser.add_argument('--proteins', type=int, default=2000, help='proteins per genome')
+    parser.add_argument('--pool', type=int, default=6000, help='size of the shared protein pool')
+    parser.add_argument('--mutation-rate', type=float, default=0.2, help='fraction of mutated proteins')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, 8], help='worker counts to benchmark')
+    parser.add_argument('--repeats', type=int, default=1, help='timed runs per worker count')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print('Writing', args.genomes, 'synthetic genomes...')
+        genome_paths = write_synthetic_genomes(
+            tmp_dir, args.genomes, args.proteins, args.pool, args.mutation_rate)
+        input_mb = sum(os.path.getsize(x) for x in genome_paths) / 1e6
+        print('Input size: %.1f MB, available cores: %d' % (input_mb, os.cpu_count()))
+
+        timings = {}
+        for n_jobs in args.jobs:
+            outputs = [os.path.join(tmp_dir, 'nr_' + str(n_jobs) + x) for x in ['.faa', '_shared.tsv', '_missing.txt']]
+            runs = []
+            for r in range(args.repeats):
+                start = time.perf_counter()
+                consolidate_seqs(genome_paths, *outputs, n_jobs=n_jobs)
+                runs.append(time.perf_counter() - start)
+            timings[n_jobs] = min(runs)
+            if n_jobs != args.jobs[0]: # verify outputs match the first (reference) run
+                reference = [x.replace('nr_' + str(n_jobs), 'nr_' + str(args.jobs[0])) for x in outputs]
+                for output, ref in zip(outputs, reference):
+                    assert filecmp.cmp(output, ref, shallow=False), output + ' differs from ' + ref
+
+        print('\nn_jobs\tseconds\tMB/s\tspeedup')
+        base = timings[args.jobs[0]]
+        for n_jobs in args.jobs:
+            print('%d\t%.2f\t%.1f\t%.2fx' % (n_jobs, timings[n_jobs], input_mb / timings[n_jobs], base / timings[n_jobs]))
+
+
+if __name__ == '__main__':
+    main()
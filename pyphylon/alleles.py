@@ -0,0 +1,379 @@
+'''
+Compact, read-only mappings from sequence headers to allele names, used in place
+of dicts when building pan-genome tables (see pangenome.load_header_to_allele).
+'''
+
+import collections.abc, itertools
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 14 # headers packed, hashed and compared at a time
+HASH_BASE = 0x100000001B3 # odd multiplier of the polynomial header hash
+MASK_64 = (1 << 64) - 1
+WORD_SIZE = 8 # headers are hashed and compared as 64-bit words
+PADDING = bytes(WORD_SIZE) # appended to blobs so words never read past the end
+POWERS = [1] # HASH_BASE**i mod 2**64, extended as needed by __hash_one__
+
+
+def hash_headers(headers):
+    ''' Returns 64-bit hashes of headers (str or bytes) as a uint64 array, see HeaderAlleleMap '''
+    hashes = [__hash_packed__(*__pack_headers__(chunk)[1:]) for chunk in __iter_chunks__(headers)]
+    return np.concatenate(hashes) if hashes else np.zeros(0, dtype='uint64')
+
+
+class HeaderAlleleMap(collections.abc.Mapping):
+    '''
+    Read-only mapping from headers to allele names with the API of a dict,
+    storing each header once and each allele name once:
+
+    - hashes: sorted 64-bit hashes of all headers, with buckets holding the first
+      entry per leading bits of the hash
+    - blob, starts, lengths: encoded headers concatenated in input order, used
+      to verify that a matching hash belongs to the same header
+    - allele_ids: int32 position of each header's allele in alleles
+    - alleles: sorted unique allele names, UTF-8 encoded ('S' array)
+
+    Headers are packed, hashed and compared CHUNK_SIZE at a time as 64-bit words with
+    numpy, without per-header objects. This takes ~30 bytes + header length per header,
+    compared to several hundred for a dict of str. Later entries override earlier ones
+    for repeated headers. Single lookups are slower than a dict, so look up many headers
+    at once with get_ids() or get_many().
+
+    Parameters
+    ----------
+    headers : iterable
+        Headers (str or bytes), without line breaks
+    alleles : iterable
+        Allele name of each header (str), same length as headers
+    '''
+
+    def __init__(self, headers=(), alleles=()):
+        self.__build__(__iter_parts__(zip(__iter_chunks__(headers), __iter_chunks__(alleles))))
+
+    @classmethod
+    def from_items(cls, items):
+        ''' Builds a mapping from (header, allele) pairs, e.g. dict.items() or database rows '''
+        mapping = cls.__new__(cls)
+        mapping.__build__(__iter_parts__(zip(*chunk) for chunk in __iter_chunks__(items)))
+        return mapping
+
+    def __build__(self, parts):
+        '''
+        Concatenates packed parts of (blob, starts, lengths, hashes, allele_ids, allele_names),
+        sorts entries by hash keeping the last entry per header, and renumbers alleles in sorted order
+        '''
+        blobs = []; starts = []; lengths = []; hashes = []; allele_ids = []; allele_names = []
+        blob_size = 0; allele_count = 0
+        for blob, part_starts, part_lengths, part_hashes, part_ids, part_names in parts:
+            blobs.append(blob); starts.append(part_starts + blob_size); lengths.append(part_lengths)
+            hashes.append(part_hashes); allele_ids.append(part_ids + allele_count)
+            allele_names.append(part_names)
+            blob_size += len(blob); allele_count += len(part_names)
+        concat = lambda x, dtype: np.concatenate(x).astype(dtype, copy=False) if x else np.zeros(0, dtype=dtype)
+        self.blob = b''.join(blobs) or PADDING; del blobs # arrays are concatenated one at a time to limit peak memory
+        starts = concat(starts, 'int64'); lengths = concat(lengths, 'int32')
+        hashes = concat(hashes, 'uint64'); allele_ids = concat(allele_ids, 'int32')
+
+        ''' Merge allele names across parts '''
+        allele_names = concat(allele_names, 'S')
+        name_order = np.argsort(allele_names, kind='stable') # same as np.unique, with fewer temporaries
+        allele_names = allele_names[name_order]
+        is_first = np.ones(len(allele_names), dtype=bool)
+        is_first[1:] = allele_names[1:] != allele_names[:-1]
+        name_ids = np.empty(len(allele_names), dtype='int32')
+        name_ids[name_order] = np.cumsum(is_first, dtype='int32') - 1; del name_order
+        unique_names = allele_names[is_first]; del allele_names, is_first
+        allele_ids = name_ids[allele_ids]; del name_ids
+
+        ''' Sort by hash, dropping earlier entries of repeated headers '''
+        order = np.argsort(hashes, kind='stable') # keeps input order for equal hashes
+        hashes = hashes[order]
+        same_hash = np.flatnonzero(hashes[1:] == hashes[:-1])
+        is_kept = np.ones(len(order), dtype=bool)
+        if len(same_hash) > 0: # repeated headers (or rare hash collisions)
+            first = order[same_hash]; second = order[same_hash + 1]
+            same_header = __equal_slices__(self.buffer, starts[first], lengths[first],
+                                           starts[second], lengths[second])
+            is_kept[same_hash[same_header]] = False
+            for pos in same_hash[~same_header]: # hash collision, compare every header in the run
+                run_start = pos; run_stop = pos + 1
+                while run_start > 0 and hashes[run_start - 1] == hashes[pos]:
+                    run_start -= 1
+                while run_stop + 1 < len(order) and hashes[run_stop + 1] == hashes[pos]:
+                    run_stop += 1
+                seen = set()
+                for run_pos in range(run_stop, run_start - 1, -1): # last occurrence wins
+                    i = order[run_pos]
+                    header = self.blob[starts[i]:starts[i] + lengths[i]]
+                    is_kept[run_pos] = not header in seen
+                    seen.add(header)
+        order = order[is_kept]
+        self.hashes = hashes[is_kept]; del hashes, is_kept
+        self.starts = starts[order]; del starts
+        self.lengths = lengths[order]; del lengths
+        allele_ids = allele_ids[order]; del order
+
+        ''' Keep alleles with headers, in sorted order '''
+        used = np.unique(allele_ids)
+        renumber = np.zeros(len(unique_names), dtype='int32')
+        renumber[used] = np.arange(len(used), dtype='int32')
+        self.allele_ids = renumber[allele_ids]
+        self.alleles = unique_names if len(used) == len(unique_names) else unique_names[used]
+        self.buckets, self.bucket_shift = __bucket_offsets__(self.hashes)
+
+    @property
+    def buffer(self):
+        ''' Encoded headers as a uint8 array, without copying blob '''
+        return np.frombuffer(self.blob, dtype='uint8')
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __iter__(self):
+        for start, length in zip(self.starts.tolist(), self.lengths.tolist()):
+            yield self.blob[start:start + length].decode()
+
+    def __getitem__(self, header):
+        allele_id = self.__get_id__(header)
+        if allele_id < 0:
+            raise KeyError(header)
+        return self.alleles[allele_id].decode()
+
+    def __contains__(self, header):
+        return isinstance(header, (str, bytes)) and self.__get_id__(header) >= 0
+
+    def __repr__(self):
+        return 'HeaderAlleleMap(' + str(len(self)) + ' headers, ' + str(len(self.alleles)) + ' alleles)'
+
+    def __get_id__(self, header):
+        ''' Looks up a single header without numpy temporaries, -1 if not found '''
+        encoded = header if isinstance(header, bytes) else header.encode()
+        header_hash = __hash_one__(encoded)
+        bucket = header_hash >> self.bucket_shift
+        for pos in range(int(self.buckets[bucket]), int(self.buckets[bucket + 1])):
+            if int(self.hashes[pos]) == header_hash:
+                start = int(self.starts[pos])
+                if self.blob[start:start + int(self.lengths[pos])] == encoded:
+                    return int(self.allele_ids[pos])
+        return -1
+
+    def items(self):
+        return _HeaderAlleleItems(self)
+
+    def values(self):
+        return _HeaderAlleleValues(self)
+
+    def get_ids(self, headers):
+        '''
+        Looks up many headers at once.
+
+        Parameters
+        ----------
+        headers : list
+            Headers (str or bytes)
+
+        Returns
+        -------
+        allele_ids : np.ndarray
+            Position of each header's allele in self.alleles, -1 if not found
+        '''
+        allele_ids = [self.__get_chunk_ids__(*__pack_headers__(chunk)) for chunk in __iter_chunks__(headers)]
+        return np.concatenate(allele_ids) if allele_ids else np.zeros(0, dtype='int64')
+
+    def get_many(self, headers, default=None):
+        ''' Looks up many headers at once, returning allele names (str) or default if not found '''
+        allele_ids = self.get_ids(headers)
+        allele_names = self.alleles[np.maximum(allele_ids, 0)].tolist() if len(self.alleles) > 0 else []
+        return [x.decode() if i >= 0 else default for x, i in zip(allele_names, allele_ids.tolist())]
+
+    def __get_chunk_ids__(self, blob, buffer, starts, lengths):
+        ''' Looks up packed headers, comparing candidates with the same hash vectorized '''
+        allele_ids = np.full(len(starts), -1, dtype='int64')
+        if len(self.hashes) == 0:
+            return allele_ids
+        query_hashes = __hash_packed__(buffer, starts, lengths)
+        order = np.argsort(query_hashes) # sorted queries read stored entries in one sweep
+        query_hashes = query_hashes[order]
+        pos = self.__search__(query_hashes)
+        candidates = np.flatnonzero(self.hashes[pos] == query_hashes)
+        order = order[candidates]; pos = pos[candidates]
+        is_match = __equal_slices__(self.buffer, self.starts[pos], self.lengths[pos],
+                                    starts[order], lengths[order], buffer)
+        allele_ids[order[is_match]] = self.allele_ids[pos[is_match]]
+        for i in order[~is_match]: # rare hash collisions, check the rest of the run
+            start = int(starts[i])
+            allele_ids[i] = self.__get_id__(blob[start:start + int(lengths[i])])
+        return allele_ids
+
+    def __search__(self, query_hashes):
+        ''' Same as self.hashes.searchsorted(query_hashes), clipped to the last entry, within buckets '''
+        bucket = (query_hashes >> np.uint64(self.bucket_shift)).astype('int64')
+        pos = self.buckets[bucket].astype('int64')
+        stops = self.buckets[bucket + 1].astype('int64')
+        searching = np.flatnonzero(pos < stops)
+        while len(searching) > 0: # buckets hold ~1 entry on average
+            is_below = self.hashes[pos[searching]] < query_hashes[searching]
+            searching = searching[is_below]
+            pos[searching] += 1
+            searching = searching[pos[searching] < stops[searching]]
+        return np.minimum(pos, len(self.hashes) - 1)
+
+    def with_entries(self, headers, alleles):
+        ''' Returns a new mapping with additional headers, overriding existing headers '''
+        combined = HeaderAlleleMap.__new__(HeaderAlleleMap)
+        existing = (self.blob, self.starts, self.lengths, self.hashes, self.allele_ids, self.alleles)
+        new_parts = __iter_parts__(zip(__iter_chunks__(headers), __iter_chunks__(alleles)))
+        combined.__build__(itertools.chain([existing], new_parts))
+        return combined
+
+
+class _HeaderAlleleItems(collections.abc.ItemsView):
+    ''' Items view that decodes entries in storage order without hashing '''
+    def __iter__(self):
+        mapping = self._mapping
+        for header, allele_id in zip(mapping, mapping.allele_ids.tolist()):
+            yield header, mapping.alleles[allele_id].decode()
+
+
+class _HeaderAlleleValues(collections.abc.ValuesView):
+    ''' Values view that reads allele IDs in storage order without hashing '''
+    def __iter__(self):
+        mapping = self._mapping
+        for allele_id in mapping.allele_ids.tolist():
+            yield mapping.alleles[allele_id].decode()
+
+
+def __bucket_offsets__(hashes):
+    ''' Returns the first entry of sorted hashes per bucket of leading bits (1-2 entries per bucket) and the shift to get buckets '''
+    bits = max(len(hashes).bit_length() - 1, 1)
+    buckets = np.empty((1 << bits) + 1, dtype='int32' if len(hashes) < 2**31 else 'int64')
+    buckets[:-1] = hashes.searchsorted(np.arange(1 << bits, dtype='uint64') << np.uint64(64 - bits))
+    buckets[-1] = len(hashes)
+    return buckets, 64 - bits
+
+
+def __iter_chunks__(items, chunk_size=CHUNK_SIZE):
+    ''' Yields lists of up to chunk_size items from any iterable '''
+    items = iter(items)
+    chunk = list(itertools.islice(items, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(items, chunk_size))
+
+
+def __iter_parts__(chunks):
+    ''' Packs chunks of (headers, alleles) one at a time, see HeaderAlleleMap.__build__ '''
+    for headers, alleles in chunks:
+        blob, buffer, starts, lengths = __pack_headers__(headers)
+        allele_names = __encode_names__(alleles)
+        if len(allele_names) != len(starts):
+            raise ValueError('Headers and alleles must have the same length')
+        allele_ids = np.arange(len(allele_names), dtype='int32')
+        yield blob, starts, lengths, __hash_packed__(buffer, starts, lengths), allele_ids, allele_names
+
+
+def __encode_names__(names):
+    ''' Encodes names (str) as a UTF-8 'S' array '''
+    try:
+        return np.array(names, dtype='S')
+    except UnicodeEncodeError: # non-ASCII names
+        return np.array([x.encode() for x in names], dtype='S')
+
+
+def __pack_headers__(headers):
+    '''
+    Joins headers (str or bytes) with line breaks into one encoded blob, padded with
+    WORD_SIZE null bytes so that every header can be read as whole 64-bit words.
+    Returns the blob, a uint8 view of it, and the start and length of each header.
+    '''
+    if len(headers) == 0:
+        return PADDING, np.frombuffer(PADDING, dtype='uint8'), np.zeros(0, dtype='int64'), np.zeros(0, dtype='int32')
+    try:
+        blob = '\n'.join(headers).encode() if isinstance(headers[0], str) else b'\n'.join(headers)
+    except TypeError: # mixed str and bytes
+        blob = b'\n'.join(x if isinstance(x, bytes) else x.encode() for x in headers)
+    blob += PADDING
+    buffer = np.frombuffer(blob, dtype='uint8')
+    breaks = np.flatnonzero(buffer == 10)
+    if len(breaks) != len(headers) - 1:
+        raise ValueError('Headers cannot contain line breaks')
+    starts = np.zeros(len(headers), dtype='int64')
+    starts[1:] = breaks + 1
+    lengths = (np.append(breaks, len(buffer) - WORD_SIZE) - starts).astype('int32')
+    return blob, buffer, starts, lengths
+
+
+def __word_layout__(lengths):
+    '''
+    Splits headers of the given lengths into 64-bit words. Returns the position of each word
+    within its header, the first word of each header, and masks zeroing bytes past the end of each header.
+    '''
+    counts = (lengths.astype('int64') + WORD_SIZE - 1) // WORD_SIZE
+    first_word = np.zeros(len(counts) + 1, dtype='int64')
+    np.cumsum(counts, out=first_word[1:])
+    word_pos = np.arange(first_word[-1], dtype='int64') - np.repeat(first_word[:-1], counts)
+    remaining = np.minimum(np.repeat(lengths, counts) - word_pos * WORD_SIZE, WORD_SIZE) # header bytes per word
+    masks = np.uint64(MASK_64) >> ((WORD_SIZE - remaining) * 8).astype('uint64')
+    return word_pos, first_word, masks
+
+
+def __header_words__(buffer, starts, layout):
+    ''' Reads packed headers as little-endian 64-bit words, given their __word_layout__ '''
+    word_pos, first_word, masks = layout
+    windows = np.ndarray((len(buffer) - WORD_SIZE + 1,), dtype='<u8', buffer=buffer, strides=(1,)) # unaligned
+    words = windows[np.repeat(starts, np.diff(first_word)) + word_pos * WORD_SIZE]
+    words &= masks
+    return words
+
+
+def __hash_packed__(buffer, starts, lengths):
+    '''
+    Hashes headers packed by __pack_headers__ as sum(word * HASH_BASE**position) mod 2**64
+    over 64-bit words, followed by mixing in the length and a splitmix64 finalizer (see __hash_one__)
+    '''
+    word_pos, first_word, masks = layout = __word_layout__(lengths)
+    words = __header_words__(buffer, starts, layout)
+    powers = np.full(int(word_pos.max()) + 1 if len(word_pos) > 0 else 1, HASH_BASE, dtype='uint64')
+    powers[0] = 1
+    words *= np.cumprod(powers, out=powers)[word_pos] # wraps around mod 2**64
+    cumulative = np.zeros(len(words) + 1, dtype='uint64')
+    np.cumsum(words, out=cumulative[1:])
+    hashes = cumulative[first_word[1:]] - cumulative[first_word[:-1]]
+    hashes ^= lengths.astype('uint64') * np.uint64(0x9E3779B97F4A7C15)
+    hashes ^= hashes >> np.uint64(30)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94D049BB133111EB)
+    hashes ^= hashes >> np.uint64(31)
+    return hashes
+
+
+def __hash_one__(encoded):
+    ''' Same as __hash_packed__ for one encoded header, in pure Python '''
+    while len(encoded) > WORD_SIZE * len(POWERS): # extend table of HASH_BASE**i
+        POWERS.append((POWERS[-1] * HASH_BASE) & MASK_64)
+    value = 0
+    for i in range(0, len(encoded), WORD_SIZE):
+        value += int.from_bytes(encoded[i:i + WORD_SIZE], 'little') * POWERS[i // WORD_SIZE]
+    value &= MASK_64
+    value ^= (len(encoded) * 0x9E3779B97F4A7C15) & MASK_64
+    value ^= value >> 30
+    value = (value * 0xBF58476D1CE4E5B9) & MASK_64
+    value ^= value >> 27
+    value = (value * 0x94D049BB133111EB) & MASK_64
+    value ^= value >> 31
+    return value
+
+
+def __equal_slices__(buffer, starts, lengths, other_starts, other_lengths, other_buffer=None):
+    ''' Compares packed headers in buffer against headers in other_buffer (default buffer) element-wise '''
+    other_buffer = buffer if other_buffer is None else other_buffer
+    is_equal = lengths == other_lengths
+    compared = np.flatnonzero(is_equal & (lengths > 0))
+    if len(compared) == 0:
+        return is_equal
+    layout = __word_layout__(lengths[compared])
+    mismatches = __header_words__(buffer, starts[compared], layout) != \
+                 __header_words__(other_buffer, other_starts[compared], layout)
+    is_equal[compared] = np.logical_or.reduceat(mismatches, layout[1][:-1]) == 0
+    return is_equal
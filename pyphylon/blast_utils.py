@@ -2,10 +2,14 @@
 Functions for interacting with blast and blastDBs from pyphylon
 """
 
+import os
 import pandas as pd
 import subprocess
 from tqdm import tqdm
 
+from pyphylon.cdhit import read_clstr
+from pyphylon.fasta import fetch_sequences, is_fasta_index_current, read_fasta_index
+
 def make_blast_db(fasta_file, output_location, dbtype = 'prot'):
     """
     Calls makeblastdb from command line blast on a given fasta file
@@ -24,18 +28,6 @@ def make_blast_db(fasta_file, output_location, dbtype = 'prot'):
     print("Finished running, database created at " + output_location)
 
 
-def extract_reference_dna_sequences(cd_hit_results, species, outfile):
-    alleles_to_headers = {}
-    with open(cd_hit_results + '/' + species + '_allele_names.tsv', 'r') as f:
-        for line in f:
-            line = line.split()
-            allele = line[0]
-            for header in line[1:]:
-                alleles_to_headers[header] = allele
-            
-
-    
-
 def extract_reference_sequences(cd_hit_results, species, outfile):
     ''' 
     Extract a file of all of the sequences of representative alleles
@@ -54,21 +46,29 @@ def extract_reference_sequences(cd_hit_results, species, outfile):
             for header in line[1:]:
                 alleles_to_headers[header] = allele
 
-    representative_alleles = []
+    representative_alleles = set()
     skipped = 0
-    with open(cd_hit_results + '/' + species + '.clstr', 'r') as f:
-        for line in f:
-            if '*' in line:
-                seq = line.split()[2][1:-3]
-                if seq in alleles_to_headers:
-                    representative_alleles.append(alleles_to_headers[seq])
-                else:
-                    skipped += 1
+    clstr = read_clstr(cd_hit_results + '/' + species + '.clstr')
+    for seq in clstr['header'][clstr['is_representative']]:
+        if seq in alleles_to_headers:
+            representative_alleles.add(alleles_to_headers[seq])
+        else:
+            skipped += 1
     if skipped:
         print(f"Skipped {skipped} representative sequences from filtered-out genomes")
 
+    nr_fasta = cd_hit_results + '/' + species
+    if is_fasta_index_current(nr_fasta): # sorted and indexed, read only representatives
+        fasta_index = read_fasta_index(nr_fasta)
+        if all(allele in fasta_index for allele in representative_alleles):
+            with open(outfile, 'w') as out:
+                for allele, seq in fetch_sequences(nr_fasta, representative_alleles, fasta_index):
+                    out.write('>' + allele + '\n' + seq + '\n')
+            return
+        print('Index of', nr_fasta, 'is missing alleles, scanning the full file')
+
     active_allele = None
-    with open(cd_hit_results + '/' + species, 'r') as f:
+    with open(nr_fasta, 'r') as f:
         with open(outfile, 'w') as out:
             for line in f:
                 if '>' in line:
@@ -98,14 +98,12 @@ def extract_reference_dna_sequences(data_path, species, outfile):
     
     representative_headers = []
     skipped = 0
-    with open(data_path + 'processed/cd-hit-results' + '/' + species + '.clstr', 'r') as f:
-        for line in f:
-            if '*' in line:
-                seq = line.split()[2][1:-3]
-                if seq in alleles_to_headers:
-                    representative_headers.append(seq)
-                else:
-                    skipped += 1
+    clstr = read_clstr(data_path + 'processed/cd-hit-results' + '/' + species + '.clstr')
+    for seq in clstr['header'][clstr['is_representative']]:
+        if seq in alleles_to_headers:
+            representative_headers.append(seq)
+        else:
+            skipped += 1
     if skipped:
         print(f"Skipped {skipped} representative sequences from filtered-out genomes")
                 
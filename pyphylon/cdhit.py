@@ -0,0 +1,100 @@
+'''
+Fast parsing of CD-Hit CLSTR files into columnar arrays, shared by pangenome
+construction, BLAST utilities and workflows.
+'''
+
+import os, re
+
+import numpy as np
+
+CLSTR_LINE = re.compile(
+    rb'^(?:>Cluster (\d+)|(\d+)\t(\d+)[a-z]*, >(.*?)\.\.\. (?:(\*)|at (?:[^%\n]*/)?([\d.]+)%))\r?$',
+    re.MULTILINE)
+CLSTR_COLUMNS = ['cluster', 'member', 'header', 'length', 'identity', 'is_representative']
+
+
+def read_clstr(clstr_file, cache=False):
+    '''
+    Parses a CD-Hit/CD-HIT-EST/CD-HIT-2D CLSTR file into columnar arrays with
+    one entry per cluster member, in file order. The whole file is matched
+    with a single regular expression and converted column by column.
+
+    If a cache file <clstr_file>.npz exists and matches the size and modification
+    time of clstr_file, arrays are loaded from the cache instead.
+
+    Parameters
+    ----------
+    clstr_file : str
+        Path to CLSTR file
+    cache : bool
+        If True, saves the parsed arrays to <clstr_file>.npz for later calls,
+        if not already cached (default False)
+
+    Returns
+    -------
+    clstr : dict
+        Maps column names to arrays of equal length
+        - cluster : int64, cluster number of each member
+        - member : int64, index of each member within its cluster
+        - header : object, sequence header of each member (str)
+        - length : int64, sequence length of each member
+        - identity : float64, % identity to the representative, NaN for representatives
+        - is_representative : bool, True for cluster representatives ("*")
+    '''
+    stat = os.stat(clstr_file)
+    cache_file = clstr_file + '.npz'
+    if os.path.exists(cache_file):
+        clstr = __load_clstr_cache__(cache_file, stat)
+        if not clstr is None:
+            return clstr
+
+    with open(clstr_file, 'rb') as f:
+        matches = CLSTR_LINE.findall(f.read())
+    cluster_nums, members, lengths, headers, reps, identities = \
+        zip(*matches) if len(matches) > 0 else [()] * 6
+    del matches
+
+    ''' Assign members to clusters from the preceding ">Cluster #" lines '''
+    cluster_nums = np.array(cluster_nums, dtype='S')
+    is_cluster_line = cluster_nums != b''
+    cluster_ids = cluster_nums[is_cluster_line].astype('int64')
+    cluster = cluster_ids[np.cumsum(is_cluster_line) - 1][~is_cluster_line]
+    is_member_line = np.flatnonzero(~is_cluster_line)
+
+    ''' Convert member columns '''
+    take = lambda column: np.array(column, dtype='S')[is_member_line]
+    identity_text = take(identities)
+    identity = np.full(shape=len(identity_text), fill_value=np.nan)
+    is_aligned = identity_text != b'' # representatives have no identity
+    identity[is_aligned] = identity_text[is_aligned].astype('float64')
+    header = np.array(b'\n'.join(take(headers)).decode().split('\n'), dtype='object') \
+        if len(is_member_line) > 0 else np.zeros(0, dtype='object')
+    clstr = {'cluster': cluster,
+             'member': take(members).astype('int64'),
+             'header': header,
+             'length': take(lengths).astype('int64'),
+             'identity': identity,
+             'is_representative': take(reps) == b'*'}
+    if cache:
+        __save_clstr_cache__(cache_file, clstr, stat)
+    return clstr
+
+
+def __save_clstr_cache__(cache_file, clstr, stat):
+    ''' Saves parsed CLSTR arrays, storing headers as one newline-delimited blob '''
+    header_blob = np.frombuffer('\n'.join(clstr['header']).encode(), dtype='uint8')
+    arrays = {x:clstr[x] for x in CLSTR_COLUMNS if x != 'header'}
+    np.savez(cache_file, header_blob=header_blob, n_members=len(clstr['header']),
+             source_stat=np.array([stat.st_size, stat.st_mtime_ns], dtype='int64'), **arrays)
+
+
+def __load_clstr_cache__(cache_file, stat):
+    ''' Loads parsed CLSTR arrays if the cache matches the CLSTR file, otherwise None '''
+    with np.load(cache_file) as cached:
+        if list(cached['source_stat']) != [stat.st_size, stat.st_mtime_ns]:
+            return None
+        clstr = {x:cached[x] for x in CLSTR_COLUMNS if x != 'header'}
+        n_members = int(cached['n_members'])
+        headers = cached['header_blob'].tobytes().decode().split('\n') if n_members > 0 else []
+        clstr['header'] = np.array(headers, dtype='object')
+    return clstr
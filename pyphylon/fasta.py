@@ -0,0 +1,495 @@
+'''
+Fast, linear-time FASTA parsing shared by pangenome construction and validation.
+'''
+
+import os, mmap, re, heapq
+
+import numpy as np
+
+NON_WHITESPACE = re.compile(rb'\S')
+DNA_COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 
+                  'W': 'W', 'S': 'S', 'R': 'Y', 'Y': 'R', 
+                  'M': 'K', 'K': 'M', 'N': 'N', 'B': 'V', 
+                  'V': 'B', 'D': 'H', 'H': 'D'}
+for bp in list(DNA_COMPLEMENT.keys()):
+    DNA_COMPLEMENT[bp.lower()] = DNA_COMPLEMENT[bp].lower()
+DNA_COMPLEMENT_TABLE = str.maketrans(DNA_COMPLEMENT) # for str.translate
+DNA_COMPLEMENT_LUT = np.arange(256, dtype='uint8') # maps base byte to complement byte
+for bp in DNA_COMPLEMENT:
+    DNA_COMPLEMENT_LUT[ord(bp)] = ord(DNA_COMPLEMENT[bp])
+BASE_CODES = np.full(256, 4, dtype='uint8') # 2-bit codes for A/C/G/T, 4 for any other byte
+for code, bp in enumerate(b'ACGT'):
+    BASE_CODES[bp] = code
+KMER_WORD = 32 # bases per 64-bit k-mer word
+KMER_MIX = np.uint64(0x9E3779B97F4A7C15) # multiplier for combining words of longer k-mers
+
+
+def iter_fasta(fasta, headers_only=False, skip_empty=True, short_headers=False, decode=False,
+               keep_lines=False):
+    '''
+    Streams (header, seq) records from a FAA/FNA file. The file is memory-mapped
+    and scanned for record boundaries, so each record is located and joined in
+    time linear to its size without building sequences line by line.
+
+    Parameters
+    ----------
+    fasta : str
+        Path to FAA/FNA file
+    headers_only : bool
+        If True, yields (header, None) without materializing sequences (default False)
+    skip_empty : bool
+        If True, skips records without any sequence, i.e. header lines
+        followed by another header or the end of the file (default True)
+    short_headers : bool
+        If True, headers are trimmed to the first whitespace-delimited word,
+        otherwise the full header line is returned (default False)
+    decode : bool
+        If True, headers and sequences are decoded to str, otherwise
+        they are returned as bytes (default False)
+    keep_lines : bool
+        If True, yields each sequence as its list of non-blank lines, stripped of
+        surrounding whitespace, to preserve the original line wrapping (default False)
+
+    Yields
+    ------
+    header : bytes or str
+        Header without the leading ">" and surrounding whitespace
+    seq : bytes or str or list or None
+        Sequence with all line breaks and whitespace removed, the list of
+        sequence lines if keep_lines, or None if headers_only
+    '''
+    with open(fasta, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0: # empty files cannot be memory-mapped
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for header, seq in __iter_records__(buf, headers_only, skip_empty, keep_lines):
+                if short_headers:
+                    header = header.split(None, 1)[0] if header else header
+                if decode:
+                    header = header.decode()
+                    if keep_lines and not seq is None:
+                        seq = [x.decode() for x in seq]
+                    elif not seq is None:
+                        seq = seq.decode()
+                yield header, seq
+
+
+def __iter_records__(buf, headers_only, skip_empty, keep_lines=False):
+    ''' Yields (header, seq) bytes for each record in a bytes-like buffer, with 
+        seq as a list of lines if keep_lines. Any text before the first header 
+        line is ignored. '''
+    n = len(buf)
+    if buf[:1] == b'>':
+        pos = 0
+    else: # skip to first header line
+        pos = buf.find(b'\n>')
+        if pos < 0:
+            return
+        pos += 1
+    while pos < n: # pos is always at a ">"
+        eol = buf.find(b'\n', pos)
+        eol = n if eol < 0 else eol
+        header = buf[pos+1:eol].strip()
+        next_record = buf.find(b'\n>', eol) if eol < n else -1
+        end = n if next_record < 0 else next_record
+        if headers_only:
+            seq = None
+            if skip_empty and NON_WHITESPACE.search(buf, eol, end) is None:
+                header = None
+        elif keep_lines:
+            seq = [x for x in (line.strip() for line in buf[eol:end].split(b'\n')) if x]
+            if skip_empty and len(seq) == 0:
+                header = None
+        else:
+            seq = b''.join(buf[eol:end].split())
+            if skip_empty and len(seq) == 0:
+                header = None
+        if not header is None:
+            yield header, seq
+        pos = n if next_record < 0 else next_record + 1
+
+
+FEATURE_NAME = re.compile(rb'^(.*)_([A-Z])(\d+)(?:([A-Z])(\d+))?$')
+SORT_MEMORY = 256 * 1024 * 1024 # default memory budget for sort_fasta, in bytes
+
+
+def feature_sort_key(header):
+    '''
+    Sort key for FASTA headers named <name>_C#A# (or T#, U#, D# variants, see 
+    pangenome.create_feature_name), ordering records numerically by name, 
+    cluster type, cluster number, variant type and variant number. Headers 
+    not following this format are placed after named features, in byte order.
+
+    Parameters
+    ----------
+    header : bytes
+        FASTA header, without the leading ">"
+
+    Returns
+    -------
+    key : tuple
+        Sort key for header
+    '''
+    short_header = header.split(None, 1)[0] if header else header
+    match = FEATURE_NAME.match(short_header)
+    if match is None:
+        return (1, header, b'', -1, b'', -1)
+    name, cluster_type, cluster_num, variant_type, variant_num = match.groups()
+    return (0, name, cluster_type, int(cluster_num), variant_type or b'', 
+            -1 if variant_num is None else int(variant_num))
+
+
+def sort_fasta(fasta_in, fasta_out, key=feature_sort_key, max_memory=SORT_MEMORY, 
+               tmp_dir=None, index=True):
+    '''
+    Sorts FASTA records by header using an external merge sort with bounded memory.
+    Records are loaded in chunks of up to max_memory bytes, sorted, and written to 
+    temporary run files, which are then merged into fasta_out. Sequences are written 
+    on single lines. By default, records are ordered numerically by <name>_C#A# 
+    cluster and allele numbers (see feature_sort_key).
+
+    Also writes a samtools-style FASTA index <fasta_out>.fai listing the name, length, 
+    and byte offset of each sequence, for random access with read_fasta_index() and 
+    fetch_sequences().
+
+    Parameters
+    ----------
+    fasta_in : str
+        Path to FASTA file to sort
+    fasta_out : str
+        Output path for sorted FASTA file, will overwrite if equal to fasta_in
+    key : function
+        Maps header bytes (without ">") to a sort key (default feature_sort_key)
+    max_memory : int
+        Approximate number of header and sequence bytes held in memory at once,
+        determines the size of individual runs (default 256 MB)
+    tmp_dir : str
+        Directory for temporary run files. If None, uses the directory
+        of fasta_out (default None)
+    index : bool
+        If True, writes the index <fasta_out>.fai (default True)
+    '''
+    tmp_dir = tmp_dir or (os.path.dirname(fasta_out) or '.')
+    run_base = os.path.join(tmp_dir, os.path.basename(fasta_out) + '.run')
+
+    ''' Sort chunks of records that fit in memory into temporary runs '''
+    run_paths = []; chunk = []; chunk_size = 0
+    def write_run(chunk):
+        run_path = run_base + str(len(run_paths))
+        with open(run_path, 'wb') as f_run:
+            for header, seq in sorted(chunk, key=lambda x: key(x[0])):
+                f_run.write(b'>' + header + b'\n' + seq + b'\n')
+        run_paths.append(run_path)
+
+    for header, seq in iter_fasta(fasta_in, skip_empty=False):
+        chunk.append((header, seq))
+        chunk_size += len(header) + len(seq) + 64 # approximate per-record overhead
+        if chunk_size >= max_memory:
+            write_run(chunk)
+            chunk = []; chunk_size = 0
+    
+    ''' Merge runs into output, recording sequence offsets '''
+    if len(run_paths) == 0: # all records fit in memory
+        records = sorted(chunk, key=lambda x: key(x[0]))
+    else:
+        if len(chunk) > 0:
+            write_run(chunk)
+        runs = [iter_fasta(run_path, skip_empty=False) for run_path in run_paths]
+        records = heapq.merge(*runs, key=lambda x: key(x[0]))
+    del chunk
+
+    with open(fasta_out + '.tmp', 'wb') as f_out:
+        with open(fasta_out + '.fai.tmp', 'w') if index else open(os.devnull, 'w') as f_index:
+            offset = 0
+            for header, seq in records:
+                f_out.write(b'>' + header + b'\n' + seq + b'\n')
+                offset += len(header) + 2 # ">" + header + newline
+                name = header.split(None, 1)[0].decode() if header else ''
+                f_index.write('\t'.join(map(str, [name, len(seq), offset, len(seq), len(seq) + 1])) + '\n')
+                offset += len(seq) + 1
+    for run_path in run_paths:
+        os.remove(run_path)
+    os.replace(fasta_out + '.tmp', fasta_out)
+    if index:
+        os.replace(fasta_out + '.fai.tmp', fasta_out + '.fai')
+
+
+def read_fasta_index(fasta):
+    '''
+    Loads the index <fasta>.fai written by sort_fasta() (or samtools faidx).
+
+    Parameters
+    ----------
+    fasta : str
+        Path to indexed FASTA file
+
+    Returns
+    -------
+    fasta_index : dict
+        Maps sequence names to (offset, length, line_bases, line_width)
+    '''
+    fasta_index = {}
+    with open(fasta + '.fai', 'r') as f_index:
+        for line in f_index:
+            name, length, offset, line_bases, line_width = line.rstrip('\n').split('\t')[:5]
+            fasta_index[name] = (int(offset), int(length), int(line_bases), int(line_width))
+    return fasta_index
+
+
+def is_fasta_index_current(fasta):
+    '''
+    Checks that the index <fasta>.fai written by sort_fasta() still matches the FASTA file,
+    i.e. it was written after the last change to the FASTA file and the size of the FASTA
+    file equals the end of the last indexed sequence.
+
+    Parameters
+    ----------
+    fasta : str
+        Path to FASTA file
+
+    Returns
+    -------
+    is_current : bool
+        False if the index is missing or stale
+    '''
+    if not (os.path.exists(fasta) and os.path.exists(fasta + '.fai')):
+        return False
+    fasta_stat = os.stat(fasta)
+    if os.stat(fasta + '.fai').st_mtime_ns < fasta_stat.st_mtime_ns:
+        return False
+    fasta_end = 0
+    for name, (offset, length, line_bases, line_width) in read_fasta_index(fasta).items():
+        n_lines = (length + line_bases - 1) // line_bases if line_bases > 0 else 0
+        fasta_end = max(fasta_end, offset + length + max(n_lines, 1) * (line_width - line_bases))
+    return fasta_end == fasta_stat.st_size
+
+
+def fetch_sequences(fasta, names, fasta_index=None, decode=True):
+    '''
+    Retrieves sequences by name from an indexed FASTA file with random access,
+    without scanning the rest of the file. See sort_fasta() and read_fasta_index().
+
+    Parameters
+    ----------
+    fasta : str
+        Path to indexed FASTA file
+    names : list
+        Names of sequences to retrieve
+    fasta_index : dict
+        Pre-loaded index from read_fasta_index(). If None, loads <fasta>.fai (default None)
+    decode : bool
+        If True, returns sequences as str, otherwise bytes (default True)
+
+    Yields
+    ------
+    name : str
+        Name of the sequence
+    seq : str or bytes
+        Sequence without line breaks, in file order of names to minimize seeking
+    '''
+    fasta_index = read_fasta_index(fasta) if fasta_index is None else fasta_index
+    entries = sorted((fasta_index[name][0], name) for name in names)
+    with open(fasta, 'rb') as f:
+        for offset, name in entries:
+            _, length, line_bases, line_width = fasta_index[name]
+            n_lines = (length + line_bases - 1) // line_bases if line_bases > 0 else 0
+            span = length + max(n_lines - 1, 0) * (line_width - line_bases)
+            seq = os.pread(f.fileno(), span, offset)
+            seq = seq.replace(b'\n', b'').replace(b'\r', b'') # wrapped sequences
+            yield name, (seq.decode() if decode else seq)
+
+
+def __kmer_codes__(codes, k):
+    ''' Encodes the k-mer (k <= 32) starting at each position of an array of 2-bit base 
+        codes as uint64, building codes for k from codes for powers of 2 (binary doubling). 
+        K-mers running past the end of the array are padded with A (0) bits. '''
+    n = len(codes)
+    kmers = np.zeros(n, dtype='uint64'); kmer_length = 0
+    block = (codes & 3).astype('uint64'); block_length = 1
+    while k > 0:
+        if k & 1: # append block to k-mers
+            shifted = np.zeros(n, dtype='uint64')
+            shifted[:max(n - kmer_length, 0)] = block[kmer_length:]
+            kmers = (kmers << np.uint64(2 * block_length)) | shifted
+            kmer_length += block_length
+        k >>= 1
+        if k > 0: # double block length
+            shifted = np.zeros(n, dtype='uint64')
+            shifted[:max(n - block_length, 0)] = block[block_length:]
+            block = (block << np.uint64(2 * block_length)) | shifted
+            block_length *= 2
+    return kmers
+
+
+def __kmer_hashes__(codes, k):
+    ''' Hashes the k-mer starting at each position of an array of 2-bit base codes.
+        For k <= 32, hashes are the exact 2-bit encodings, otherwise k-mers are split 
+        into 32-base words, combined by multiplication and XOR. '''
+    n = len(codes)
+    word_codes = {} # word length: codes
+    kmer_hashes = None
+    for word_start in range(0, k, KMER_WORD):
+        word_length = min(KMER_WORD, k - word_start)
+        if not word_length in word_codes:
+            word_codes[word_length] = __kmer_codes__(codes, word_length)
+        word = np.zeros(n, dtype='uint64')
+        word[:max(n - word_start, 0)] = word_codes[word_length][word_start:]
+        kmer_hashes = word if kmer_hashes is None else (kmer_hashes * KMER_MIX) ^ word
+    return kmer_hashes
+
+
+class ContigStore(object):
+    '''
+    Contig sequences of a genome FNA held as a single uint8 array, for extracting
+    many intervals at once. Intervals are gathered and reverse complemented
+    with vectorized array operations rather than per-feature string slicing.
+    Contigs are named by the first whitespace-delimited word of their headers.
+
+    Parameters
+    ----------
+    fasta : str
+        Path to FNA file with contig nucleotides
+    '''
+
+    def __init__(self, fasta):
+        self.names = []; seqs = []
+        for header, seq in iter_fasta(fasta, short_headers=True, decode=False):
+            self.names.append(header.decode())
+            seqs.append(seq)
+        self.index = {name:i for i, name in enumerate(self.names)} # last contig wins if repeated
+        self.lengths = np.array([len(seq) for seq in seqs], dtype='int64')
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)]).astype('int64')
+        self.seqs = np.frombuffer(b''.join(seqs), dtype='uint8')
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def get(self, name):
+        ''' Returns the full sequence of a contig as str '''
+        i = self.index[name]
+        return self.seqs[self.offsets[i]:self.offsets[i+1]].tobytes().decode('latin-1')
+
+    def extract(self, contig_ids, starts, stops, reverse=None, decode=True):
+        '''
+        Extracts many intervals in one call. Intervals are truncated to 
+        contig boundaries, i.e. the same as slicing contig[max(0,start):stop].
+
+        Parameters
+        ----------
+        contig_ids : np.array
+            Index of each interval's contig in names
+        starts : np.array
+            0-indexed start of each interval, inclusive
+        stops : np.array
+            0-indexed stop of each interval, exclusive
+        reverse : np.array
+            If provided, boolean array marking intervals to reverse 
+            complement, i.e. features on the negative strand (default None)
+        decode : bool
+            If True, returns sequences as str, otherwise bytes (default True)
+
+        Returns
+        -------
+        seqs : list
+            Sequence of each interval, in input order
+        '''
+        contig_ids = np.asarray(contig_ids, dtype='int64')
+        contig_starts = self.offsets[contig_ids]
+        lengths = self.lengths[contig_ids]
+        starts = np.clip(np.asarray(starts, dtype='int64'), 0, lengths)
+        stops = np.clip(np.asarray(stops, dtype='int64'), starts, lengths)
+        seq_lengths = stops - starts
+        seq_ends = np.cumsum(seq_lengths)
+        seq_begins = seq_ends - seq_lengths
+
+        ''' Gather all bases into one buffer, reading negative strand intervals backwards '''
+        within = np.arange(seq_ends[-1] if len(seq_ends) > 0 else 0) - np.repeat(seq_begins, seq_lengths)
+        positions = np.repeat(contig_starts + starts, seq_lengths) + within
+        if not reverse is None:
+            is_reverse = np.repeat(np.asarray(reverse, dtype='bool'), seq_lengths)
+            reverse_positions = np.repeat(contig_starts + stops - 1, seq_lengths) - within
+            positions = np.where(is_reverse, reverse_positions, positions)
+        bases = self.seqs[positions]
+        if not reverse is None:
+            bases[is_reverse] = DNA_COMPLEMENT_LUT[bases[is_reverse]]
+
+        ''' Split buffer into sequences '''
+        buf = bases.tobytes()
+        buf = buf.decode('latin-1') if decode else buf # one character per byte
+        return [buf[b:e] for b, e in zip(seq_begins.tolist(), seq_ends.tolist())]
+
+    def contains(self, seqs, both_strands=True):
+        '''
+        Checks which of many sequences occur within any contig, in one pass over 
+        the contigs per distinct sequence length k. All k-mers of the contigs are 
+        encoded with 2 bits per base (in 64-bit words of up to 32 bases, combined by
+        hashing for k > 32) and looked up among the sorted encoded sequences, and 
+        hash matches for k > 32 are verified against the contig bases. Sequences
+        with bases other than uppercase A/C/G/T are searched for directly.
+
+        Parameters
+        ----------
+        seqs : list
+            Sequences to search for (str)
+        both_strands : bool
+            If True, also searches the reverse complement of each contig (default True)
+
+        Returns
+        -------
+        found : np.array
+            Boolean array, True for each sequence present in the contigs
+        '''
+        found = np.zeros(len(seqs), dtype='bool')
+        seqs_by_length = {}
+        for i, seq in enumerate(seqs):
+            seqs_by_length.setdefault(len(seq), []).append(i)
+        contig_texts = None # only decoded if needed for non-ACGT sequences
+
+        codes = BASE_CODES[self.seqs]
+        invalid_counts = np.concatenate([[0], np.cumsum(codes == 4)])
+        contig_ends = np.repeat(self.offsets[1:], self.lengths)
+        for k, seq_ids in seqs_by_length.items():
+            if k == 0: # empty sequences are trivially present
+                found[seq_ids] = True
+                continue
+
+            ''' Encode query sequences (and reverse complements) as k-mer hashes '''
+            query_ids = []; queries = []
+            for i in seq_ids:
+                query = seqs[i].encode('latin-1')
+                query_codes = BASE_CODES[np.frombuffer(query, dtype='uint8')]
+                if (query_codes == 4).any(): # search directly, cannot be 2-bit encoded
+                    if contig_texts is None:
+                        contig_texts = [self.get(name) for name in self.names]
+                        contig_texts += [x.translate(DNA_COMPLEMENT_TABLE)[::-1] for x in contig_texts] if both_strands else []
+                    found[i] = any(seqs[i] in x for x in contig_texts)
+                    continue
+                query_ids.append(i); queries.append(query_codes)
+                if both_strands:
+                    query_ids.append(i); queries.append((3 - query_codes)[::-1])
+            if len(queries) == 0:
+                continue
+            queries = np.array(queries, dtype='uint8')
+            query_hashes = __kmer_hashes__(queries.ravel(), k)[::k]
+
+            ''' Hash all contig k-mers, excluding those with non-ACGT bases or crossing contigs '''
+            n_kmers = max(len(codes) - k + 1, 0)
+            kmer_hashes = __kmer_hashes__(codes, k)[:n_kmers]
+            is_valid = (invalid_counts[k:] == invalid_counts[:n_kmers]) & \
+                (np.arange(n_kmers) + k <= contig_ends[:n_kmers])
+            sorted_hashes = np.unique(query_hashes) # search k-mers among the few query hashes
+            nearest = np.minimum(np.searchsorted(sorted_hashes, kmer_hashes), len(sorted_hashes) - 1)
+            hits = np.flatnonzero((sorted_hashes[nearest] == kmer_hashes) & is_valid)
+
+            ''' Resolve hits to queries, verifying bases for multi-word k-mers '''
+            hash_to_queries = {}
+            for q, query_hash in enumerate(query_hashes.tolist()):
+                hash_to_queries.setdefault(query_hash, []).append(q)
+            for hit, hit_hash in zip(hits.tolist(), kmer_hashes[hits].tolist()):
+                for q in hash_to_queries[hit_hash]:
+                    if k <= KMER_WORD or np.array_equal(codes[hit:hit+k], queries[q]):
+                        found[query_ids[q]] = True
+        return found
@@ -3,19 +3,22 @@ Functions for handling dimension-reduction models of pangenome data.
 """
 
 import logging
+import os
 from pyexpat import model
 import numpy as np
 import pandas as pd
+import scipy.sparse
 from typing import Iterable, Union, List, Tuple, Dict, Any, Optional
 from tqdm.notebook import tqdm, trange
+from joblib import Parallel, delayed, effective_n_jobs
 from sklearn.decomposition import NMF
-from sklearn.cluster import KMeans
+from sklearn.utils.extmath import randomized_svd
 from sklearn.metrics import confusion_matrix, silhouette_score
 from prince import MCA
 from umap import UMAP
 from hdbscan import HDBSCAN
 
-from pyphylon.util import _get_normalization_diagonals
+from pyphylon.util import _get_normalization_diagonals, _kmeans_1d_thresholds, _to_scipy_sparse, _to_solver_input, _fit_nmf_rank, _fit_minibatch_nmf_rank, _nndsvd_from_svd, _nmf_violation, _extend_nmf_factors
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -30,16 +33,25 @@ def run_mca(data):
     """
     Run Multiple Correspondence Analysis (MCA) on the dataset.
 
+    prince one-hot encodes and densifies the data as float64 internally, so a
+    sparse DataFrame is only densified in its own (compact) dtype beforehand.
+
     Parameters:
     - data: DataFrame containing the dataset to be analyzed.
 
     Returns:
     - MCA fitted model.
     """
+    if any(isinstance(x, pd.SparseDtype) for x in data.dtypes):
+        dtype = np.result_type(*[x.subtype if isinstance(x, pd.SparseDtype) else x for x in data.dtypes])
+        X, memory = _to_solver_input(data, dtype=dtype, accept_sparse=False)
+        _log_input_memory('MCA', memory, saved=False)
+        data = pd.DataFrame(X, index=data.index, columns=data.columns)
+
     mca = MCA(
         n_components=min(data.shape),
         n_iter=1,
-        copy=True,
+        copy=False,
         check_input=True,
         engine='sklearn',
         random_state=42
@@ -47,7 +59,9 @@ def run_mca(data):
     return mca.fit(data)
 
 # Non-negative Matrix Factorization (NMF)
-def run_nmf(data: Union[np.ndarray, pd.DataFrame], ranks: List[int], max_iter: int = 10_000):
+def run_nmf(data: Union[np.ndarray, pd.DataFrame, scipy.sparse.spmatrix, str], ranks: List[int], max_iter: Optional[int] = None,
+            n_jobs: int = 1, blas_threads: Optional[int] = None, warm_start: bool = False,
+            engine: str = 'cd', batch_size: int = 1024, dtype: Optional[str] = None):
     """
     Run NMF on the input data across multiple ranks.
     NMF decomposes a non-negative matrix D into two non-negative matrices W and H:
@@ -68,9 +82,31 @@ def run_nmf(data: Union[np.ndarray, pd.DataFrame], ranks: List[int], max_iter: i
     is as sparse as possible.
 
     Parameters:
-    - data: DataFrame containing the dataset to be analyzed.
+    - data: DataFrame containing the dataset to be analyzed. Sparse DataFrames and
+      scipy sparse matrices are fitted as CSR rather than densified.
     - ranks: List of ranks (components) to try.
-    - max_iter: Maximum number of iterations to try to reach convergence.
+    - max_iter: Maximum number of iterations to try to reach convergence. Defaults to 10_000
+      iterations for the 'cd' engine and 200 epochs for the 'minibatch' engine.
+    - n_jobs: Number of ranks fitted concurrently in worker processes (-1 for all cores).
+      The input is memory-mapped and shared by all workers rather than copied per rank.
+    - blas_threads: BLAS threads per fit. Defaults to the available cores divided
+      by the number of concurrent fits, so the machine is not oversubscribed.
+      Unlimited when n_jobs is 1.
+    - warm_start: If True, fits ranks in increasing order, starting each rank from the
+      previous rank's solution plus new NNDSVD components. The new components are
+      rescaled to fit the residual of the previous solution. A single truncated SVD
+      at the largest rank is computed and sliced for all ranks. Not compatible with n_jobs > 1.
+    - engine: 'cd' (default) fits each rank on the whole matrix with coordinate descent.
+      'minibatch' streams blocks of batch_size columns (genomes) through sklearn's MiniBatchNMF,
+      so memory is bounded by one dense float32 block (batch_size x n_rows) rather than by data.
+      data may then also be the path to a native table directory (see pangenome.save_feature_table),
+      which is read block by block from disk. Each epoch is one pass over all blocks, with at
+      most max_iter epochs. Not compatible with n_jobs > 1 or warm_start.
+    - batch_size: Number of columns (genomes) per block for the 'minibatch' engine.
+    - dtype: dtype of the input handed to the 'cd' engine. By default, sparse input is
+      fitted as float32 and dense input keeps its own dtype, so results for dense data
+      are unchanged. Use 'float32' to halve the memory of a dense float64 input.
+      The 'minibatch' engine always fits float32 blocks.
 
     Returns:
     - W_dict: A dictionary of transformed data at various ranks.
@@ -88,31 +124,91 @@ def run_nmf(data: Union[np.ndarray, pd.DataFrame], ranks: List[int], max_iter: i
     for nonnegative matrix factorization. Pattern Recognition, 41(4), 1350-1362.
     """
     # Data validation
-    if data.ndim != 2:
+    if not isinstance(data, str) and data.ndim != 2:
         raise ValueError("data must be a 2-dimensional array")
+    if not engine in ('cd', 'minibatch'):
+        raise ValueError("engine must be 'cd' or 'minibatch'")
+    if isinstance(data, str) and engine != 'minibatch':
+        raise ValueError("table paths are only supported by the 'minibatch' engine")
+    if engine == 'minibatch' and (warm_start or effective_n_jobs(n_jobs) > 1):
+        raise ValueError("the 'minibatch' engine cannot be combined with warm_start or n_jobs > 1")
+    if engine == 'minibatch' and len(ranks) > 0 and batch_size < max(ranks):
+        raise ValueError("batch_size must be at least the largest rank")
     if not all(r > 0 for r in ranks):
         raise ValueError("ranks must be a list of positive integers")
+    if max_iter is None:
+        max_iter = 10_000 if engine == 'cd' else 200 # epochs are full passes over data
     if max_iter <= 0:
         raise ValueError("max_iter must be a positive integer")
+    if warm_start and effective_n_jobs(n_jobs) > 1:
+        raise ValueError("warm_start fits ranks in sequence and cannot be combined with n_jobs > 1")
+
+    if engine == 'minibatch':
+        W_dict, H_dict = {}, {}
+        logger.info(f"Starting mini-batch NMF process for {len(ranks)} ranks")
+        if isinstance(data, pd.DataFrame): # compact CSC in the table's own dtype, sliced per block
+            dtypes = [x.subtype if isinstance(x, pd.SparseDtype) else x for x in data.dtypes]
+            data = _to_scipy_sparse(data, dtype=np.result_type(*dtypes))
+        iter_blocks = lambda: _iter_nmf_blocks(data, batch_size)
+        for rank in tqdm(ranks, desc='Running mini-batch NMF at varying ranks...'):
+            logger.debug(f"Fitting mini-batch NMF model for rank {rank}")
+            W_dict[rank], H_dict[rank] = _fit_minibatch_nmf_rank(iter_blocks, rank, max_iter)
+        logger.info("NMF process completed for given ranks")
+        return W_dict, H_dict
+
+    # Single copy of the input, float32 CSR if sparse
+    if dtype is None:
+        is_sparse = scipy.sparse.issparse(data) or \
+            (isinstance(data, pd.DataFrame) and any(isinstance(x, pd.SparseDtype) for x in data.dtypes))
+        dtype = 'float32' if is_sparse else None # None keeps the dtype of dense input
+    X, memory = _to_solver_input(data, dtype=dtype)
+    _log_input_memory('NMF', memory)
 
     # Initialize outputs
     W_dict, H_dict = {}, {}
 
     # Run NMF at varying ranks
     logger.info(f"Starting NMF process for {len(ranks)} ranks")
-    for rank in tqdm(ranks, desc='Running NMF at varying ranks...'):
-        model = NMF(
-            n_components=rank,
-            init='nndsvd',
-            max_iter=max_iter,
-            random_state=42
+    ranks = list(ranks)
+    n_jobs = min(effective_n_jobs(n_jobs), max(len(ranks), 1))
+    if warm_start and len(ranks) > 0:
+        # One SVD at the largest rank, sliced for the first rank and extended for the rest
+        U, S, V = randomized_svd(X, max(ranks), random_state=42)
+        W_svd, H_svd = _nndsvd_from_svd(U, S, V)
+        del U, S, V
+        W, H = None, None
+        for rank in tqdm(sorted(set(ranks)), desc='Running NMF at varying ranks (warm start)...'):
+            logger.debug(f"Fitting NMF model for rank {rank}")
+            if W is None:
+                W_init, H_init = W_svd[:, :rank], H_svd[:rank, :]
+            else:
+                prev_rank = W.shape[1]
+                W_init, H_init = _extend_nmf_factors(X, W, H, W_svd[:, prev_rank:rank], H_svd[prev_rank:rank, :])
+            # sklearn stops relative to the starting violation, so rescale tol to stop at
+            # the same absolute violation as a fit started from NNDSVD at this rank
+            cold_violation = _nmf_violation(X, W_svd[:, :rank], H_svd[:rank, :])
+            tol = 1e-4 * cold_violation / max(_nmf_violation(X, W_init, H_init), 1e-300)
+            W, H = _fit_nmf_rank(X, rank, max_iter, blas_threads, W_init=W_init, H_init=H_init, tol=tol)
+            W_dict[rank], H_dict[rank] = W, H
+        W_dict = {rank: W_dict[rank] for rank in ranks} # original rank order
+        H_dict = {rank: H_dict[rank] for rank in ranks}
+    elif n_jobs == 1:
+        for rank in tqdm(ranks, desc='Running NMF at varying ranks...'):
+            logger.debug(f"Fitting NMF model for rank {rank}")
+            W_dict[rank], H_dict[rank] = _fit_nmf_rank(X, rank, max_iter, blas_threads)
+    else:
+        # Fit ranks in worker processes, largest first, sharing the input through a memory map
+        if blas_threads is None:
+            blas_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+        logger.info(f"Fitting {n_jobs} ranks at a time with {blas_threads} BLAS threads each")
+        fits = Parallel(n_jobs=n_jobs, max_nbytes='1M', mmap_mode='r')(
+            delayed(_fit_nmf_rank)(X, rank, max_iter, blas_threads) 
+            for rank in sorted(ranks, reverse=True)
         )
-
-        logger.debug(f"Fitting NMF model for rank {rank}")
-        W = model.fit_transform(data)
-        H = model.components_
-        W_dict[rank] = W
-        H_dict[rank] = H
+        for rank, (W, H) in zip(sorted(ranks, reverse=True), fits):
+            W_dict[rank], H_dict[rank] = W, H
+        W_dict = {rank: W_dict[rank] for rank in ranks} # original rank order
+        H_dict = {rank: H_dict[rank] for rank in ranks}
 
     logger.info("NMF process completed for given ranks")
     return W_dict, H_dict
@@ -218,7 +314,8 @@ def run_densmap(
     This reduction can be run on `data` as well as its transpose `data.T`.
 
     Parameters:
-    - data (pd.DataFrame): Data to be embedded for dimension-reduction.
+    - data (pd.DataFrame): Data to be embedded for dimension-reduction. Sparse DataFrames
+      and scipy sparse matrices are embedded as float32 CSR, without densifying.
     - low_memory (bool): Passed onto UMAP to optimize memory usage.
     - n_neighbors (int): Passed onto UMAP to determine local/global dim. red.
 
@@ -231,10 +328,10 @@ def run_densmap(
     else:
         n_neighbors = 0.01 * min(data.shape)
     
-    if len(data) == 0:
+    if data.shape[0] == 0:
         raise ValueError("Empty data array provided")
 
-    if len(data) == 1:
+    if data.shape[0] == 1:
         logging.warning("Only one point provided. Returning single-cluster result.")
         return HDBSCAN(), np.array([0]), 1.0, pd.DataFrame()
     
@@ -248,7 +345,9 @@ def run_densmap(
         low_memory=low_memory
     )
 
-    embedding = densmap.fit_transform(data)
+    X, memory = _to_solver_input(data)
+    _log_input_memory('DensMAP', memory)
+    embedding = densmap.fit_transform(X)
     return densmap, embedding
 
 def run_hdbscan(
@@ -347,29 +446,50 @@ class NmfModel(object):
 
     def __init__(
             self,
-            data: pd.DataFrame,
+            data: Union[pd.DataFrame, scipy.sparse.spmatrix, str],
             ranks: Iterable,
-            max_iter: int = 10_000
+            max_iter: Optional[int] = None,
+            n_jobs: int = 1,
+            warm_start: bool = False,
+            engine: str = 'cd',
+            batch_size: int = 1024,
+            dtype: Optional[str] = None
         ) -> None:
         """
         Initialize the NmfModel object w/ required data matrix and rank list.
 
         Parameters:
-        - data: DataFrame on which NMF will be run
+        - data: DataFrame on which NMF will be run. Sparse matrices and paths to native
+          table directories (minibatch engine only) are validated block by block, and
+          only support W_dict and H_dict
         - ranks: Iterable of ranks on which to perform NMF
-        - max_iter: Integer, Max num of iters for convergence, default 10_000
+        - max_iter: Integer, Max num of iters (or epochs) for convergence, default
+          10_000 for the 'cd' engine and 200 for the 'minibatch' engine (see run_nmf)
+        - n_jobs: Integer, Num of ranks fitted concurrently (see run_nmf), default 1
+        - warm_start: Boolean, Start each rank from the previous rank (see run_nmf), default False
+        - engine: String, 'cd' or 'minibatch' (see run_nmf), default 'cd'
+        - batch_size: Integer, Num of genomes per block for the 'minibatch' engine, default 1024
+        - dtype: String, dtype of the 'cd' engine input (see run_nmf), default None
         """
-        # Check for NaN or infinite values in NMF input
-        if data.isna().any().any() or np.isinf(data).any().any():
-            raise ValueError("Input data contains NaN or infinite values")
-        
-        # Check for negative values in NMF input
-        if (data < 0).any().any():
-            raise ValueError("Input data contains negative values, which are not allowed in NMF")
+        if isinstance(data, pd.DataFrame) and not any(isinstance(x, pd.SparseDtype) for x in data.dtypes):
+            # Check for NaN or infinite values in NMF input
+            if data.isna().any().any() or np.isinf(data).any().any():
+                raise ValueError("Input data contains NaN or infinite values")
+            
+            # Check for negative values in NMF input
+            if (data < 0).any().any():
+                raise ValueError("Input data contains negative values, which are not allowed in NMF")
+        else: # sparse or on-disk input, checked without densifying it all at once
+            _check_nmf_blocks(data, batch_size)
 
         self._data = data
         self._ranks = ranks
         self._max_iter = max_iter
+        self._n_jobs = n_jobs
+        self._warm_start = warm_start
+        self._engine = engine
+        self._batch_size = batch_size
+        self._dtype = dtype
 
         # Initialize other properties to None
         self._W_dict = None
@@ -402,7 +522,12 @@ class NmfModel(object):
             W_dict, H_dict = run_nmf(
                 self._data,
                 self._ranks,
-                max_iter=self._max_iter
+                max_iter=self._max_iter,
+                n_jobs=self._n_jobs,
+                warm_start=self._warm_start,
+                engine=self._engine,
+                batch_size=self._batch_size,
+                dtype=self._dtype
             )
             self._W_dict = W_dict
             self._H_dict = H_dict
@@ -420,7 +545,12 @@ class NmfModel(object):
             W_dict, H_dict = run_nmf(
                 self._data,
                 self._ranks,
-                max_iter=self._max_iter
+                max_iter=self._max_iter,
+                n_jobs=self._n_jobs,
+                warm_start=self._warm_start,
+                engine=self._engine,
+                batch_size=self._batch_size,
+                dtype=self._dtype
             )
             self._W_dict = W_dict
             self._H_dict = H_dict
@@ -790,43 +920,56 @@ class PVGE(object):
 
 
 # Helper functions
+def _iter_nmf_blocks(data, batch_size):
+    # Yield blocks of batch_size columns (genomes) of data as dense float32 genome x feature
+    # arrays, the samples of the mini-batch NMF engine. Blocks are densified one at a time,
+    # as MiniBatchNMF is much faster on dense blocks of P than on sparse ones
+    if isinstance(data, str):
+        from pyphylon.pangenome import iter_feature_table_blocks # only needed for native tables
+        for _, csc in iter_feature_table_blocks(data, batch_size, dtype='float32'):
+            yield csc.T.toarray()
+    else:
+        X = data.tocsc() if scipy.sparse.issparse(data) else data
+        for i in range(0, X.shape[1], batch_size):
+            block = X[:, i:i+batch_size].T
+            yield block.toarray().astype('float32') if scipy.sparse.issparse(block) else np.asarray(block, dtype='float32')
+
+def _check_nmf_blocks(data, batch_size):
+    # Validate sparse NMF input (scipy sparse, sparse DataFrame, or native table path) one block
+    # of genomes at a time with _iter_nmf_blocks. Absent entries (NaN in sparse tables) are zeros
+    if isinstance(data, pd.DataFrame):
+        dtypes = [x.subtype if isinstance(x, pd.SparseDtype) else x for x in data.dtypes]
+        data = _to_scipy_sparse(data, dtype=np.result_type(*dtypes))
+    for block in _iter_nmf_blocks(data, batch_size):
+        if not np.isfinite(block).all():
+            raise ValueError("Input data contains NaN or infinite values")
+        if (block < 0).any():
+            raise ValueError("Input data contains negative values, which are not allowed in NMF")
+
+def _log_input_memory(name, memory, saved=True):
+    # Report the size of a solver input (see util._to_solver_input) against a dense float64 copy.
+    # If not saved, the solver makes its own dense float64 copy anyway (i.e. prince for MCA),
+    # so only the input size is reported rather than a saving that never materializes
+    if not saved:
+        logger.info(f"{name} input: {memory['format']} {memory['dtype']}, {memory['nbytes'] / 1e6:.1f} MB "
+                    f"(densified to float64 by the solver)")
+        return
+    logger.info(f"{name} input: {memory['format']} {memory['dtype']}, {memory['nbytes'] / 1e6:.1f} MB "
+                f"(dense float64: {memory['dense_float64_nbytes'] / 1e6:.1f} MB, "
+                f"saved {memory['saved_nbytes'] / 1e6:.1f} MB)")
+
 def _k_means_binarize_L(L_norm):
     """
     Use k-means clustering (k=3) to binarize L_norm matrix.
+    Each column is binarized to its highest-mean cluster, with all columns
+    solved at once by exact 1-D 3-means (see util._kmeans_1d_thresholds).
     """
-    
-    # Initialize an empty array to hold the binarized matrix
-    L_binarized = np.zeros_like(L_norm.values)
-    
-    # Loop through each column
-    for col_idx in trange(
-        L_norm.values.shape[1],
-        leave=False,
-        desc='binarizing column by column...'
-    ):
-        column_data = L_norm.values[:, col_idx]
-    
-        # Reshape the column data to fit the KMeans input shape
-        column_data_reshaped = column_data.reshape(-1, 1)
-    
-        # Apply 3-means clustering (gen better P-R tradeoff than 2-means)
-        kmeans = KMeans(n_clusters=3, random_state=0, n_init='auto')
-        kmeans.fit(column_data_reshaped)
-        labels = kmeans.labels_
-        centers = kmeans.cluster_centers_
-    
-        # Find the cluster with the highest mean
-        highest_mean_cluster = np.argmax(centers)
-    
-        # Binarize the column based on the cluster with the highest mean
-        binarized_column = (labels == highest_mean_cluster).astype(int)
-    
-        # Update the binarized matrix
-        L_binarized[:, col_idx] = binarized_column
+    # Minimum value of each column's highest-mean cluster
+    thresholds = _kmeans_1d_thresholds(L_norm.values, n_clusters=3)
     
     # Typecast to DataFrame
     L_binarized = pd.DataFrame(
-        L_binarized,
+        (L_norm.values >= thresholds[np.newaxis, :]).astype(L_norm.values.dtype),
         index=L_norm.index,
         columns=L_norm.columns
     )
@@ -835,39 +978,15 @@ def _k_means_binarize_L(L_norm):
 def _k_means_binarize_A(A_norm):
     """
     Use k-means clustering (k=3) to binarize A_norm matrix.
+    Each row is binarized to its highest-mean cluster, with all rows
+    solved at once by exact 1-D 3-means (see util._kmeans_1d_thresholds).
     """
-    # Initialize an empty array to hold the binarized matrix
-    A_binarized = np.zeros_like(A_norm.values)
-    
-    # Loop through each row
-    for row_idx in trange(
-        A_norm.values.shape[0],
-        leave=False,
-        desc='binarizing row by row...'
-    ):
-        row_data = A_norm.values[row_idx, :]
-    
-        # Reshape the row data to fit the KMeans input shape
-        row_data_reshaped = row_data.reshape(-1, 1)
-    
-        # Apply 3-means clustering (gen better P-R tradeoff than 2-means)
-        kmeans = KMeans(n_clusters=3, random_state=0, n_init='auto')
-        kmeans.fit(row_data_reshaped)
-        labels = kmeans.labels_
-        centers = kmeans.cluster_centers_
-    
-        # Find the cluster with the highest mean
-        highest_mean_cluster = np.argmax(centers)
-    
-        # Binarize the row based on the cluster with the highest mean
-        binarized_row = (labels == highest_mean_cluster).astype(int)
-    
-        # Update the binarized matrix
-        A_binarized[row_idx, :] = binarized_row
+    # Minimum value of each row's highest-mean cluster
+    thresholds = _kmeans_1d_thresholds(A_norm.values.T, n_clusters=3)
     
     # Typecast to DataFrame
     A_binarized = pd.DataFrame(
-        A_binarized,
+        (A_norm.values >= thresholds[:, np.newaxis]).astype(A_norm.values.dtype),
         index=A_norm.index,
         columns=A_norm.columns
     )
@@ -977,22 +1096,11 @@ def _check_n_neighbors(data, n_neighbors):
     return n_neighbors
 
 def recommended_threshold(A_norm, i):
-    column_data_reshaped = A_norm.loc[f'phylon{i}'].values.reshape(-1, 1)
-    
-    # 3-means clustering
-    kmeans = KMeans(n_clusters=3, random_state=0, n_init='auto')
-    kmeans.fit(column_data_reshaped)
-    labels = kmeans.labels_
-    centers = kmeans.cluster_centers_
-    
-    # Find the cluster with the highest mean
-    highest_mean_cluster = np.argmax(centers)
-    
-    # Binarize the row based on the cluster with the highest mean
-    binarized_row = (labels == highest_mean_cluster).astype(int)
-    
-    # Find k-means-recommended threshold using min value that still binarizes to 1
-    x = pd.Series(dict(zip(A_norm.columns, binarized_row)))
-    threshold = A_norm.loc[f'phylon{i}', x[x==1].index].min()
+    """
+    k-means-recommended threshold for binarizing row phylon{i} of A_norm: the
+    minimum value of the row's highest-mean cluster under exact 1-D 3-means.
+    """
+    row_data = A_norm.loc[f'phylon{i}'].values.reshape(-1, 1)
+    threshold = _kmeans_1d_thresholds(row_data, n_clusters=3)[0]
     
     return threshold
@@ -5,7 +5,8 @@ Functions for building a pangenome for phylon analysis.
 import os, shutil, urllib.request, urllib.parse, urllib.error
 import subprocess as sp
 import hashlib 
-import collections
+import collections, itertools
+import gzip, json
 
 import pandas as pd
 import numpy as np
@@ -13,15 +14,19 @@ import scipy.sparse
 
 from tqdm.notebook import tqdm
 
+from pyphylon.fasta import iter_fasta, sort_fasta, ContigStore, DNA_COMPLEMENT, DNA_COMPLEMENT_TABLE
+from pyphylon.cdhit import read_clstr
+from pyphylon.alleles import HeaderAlleleMap
+from pyphylon.util import _to_scipy_sparse, _get_row_sums
+
 CLUSTER_TYPES = {'cds':'C', 'noncoding':'T'}
 VARIANT_TYPES = {'allele':'A', 'upstream':'U', 'downstream':'D'}
 CLUSTER_TYPES_REV = {v:k for k,v in list(CLUSTER_TYPES.items())}
 VARIANT_TYPES_REV = {v:k for k,v in list(VARIANT_TYPES.items())}
-DNA_COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 
-              'W': 'W', 'S': 'S', 'R': 'Y', 'Y': 'R', 
-              'M': 'K', 'K': 'M', 'N': 'N'}
-for bp in list(DNA_COMPLEMENT.keys()):
-    DNA_COMPLEMENT[bp.lower()] = DNA_COMPLEMENT[bp].lower()
+FEATURE_TABLE_CSV_COLUMNS = ['feature', 'genome', 'value'] # long-format CSV from save_feature_table_csv
+NATIVE_TABLE_VERSION = 1 # version of the save_feature_table format
+DERIVED_SUFFIXES = {'coding':'_nuc_coding.fna', 'upstream':'_upstream.fna',
+                    'downstream':'_downstream.fna', 'noncoding':'_noncoding.fna'}
 
 ###################################
 #              CD-HIT             #
@@ -43,7 +48,8 @@ Pan-genome feature nomenclature:
     
 def build_cds_pangenome(genome_faa_paths, output_dir, name='Test', 
                         cdhit_args={'-n':5, '-c':0.8}, 
-                        fastasort_path=None, save_csv=True):
+                        fastasort_path=None, save_csv=True, n_jobs=1, seq_store=None,
+                        save_table=True):
     ''' 
     Constructs a pan-genome based on protein sequences with the following steps:
     1) Merge FAA files for genomes of interest into a non-redundant list
@@ -51,17 +57,19 @@ def build_cds_pangenome(genome_faa_paths, output_dir, name='Test',
     3) Rename non-redundant CDS as <name>_C#A#, referring to cluster and allele number
     4) Compile allele/gene membership into binary allele x genome and gene x genome tables
     
-    Generates eight files within output_dir:
+    Generates up to eleven files within output_dir:
     1) <name>_strain_by_allele.pickle.gz, binary allele x genome table with SparseArray structure
     2) <name>_strain_by_gene.pickle.gz, binary gene x genome table with SparseArray structure
-    1) <name>_strain_by_allele.csv.gz, binary allele x genome table as flat file (if save_csv)
-    2) <name>_strain_by_gene.csv.gz, binary gene x genome table as flat file (if save_csv)
-    3) <name>_nr.faa, all non-redundant CDSs observed, with headers <name>_C#A#
-    4) <name>_nr.faa.cdhit.clstr, CD-Hit output file from clustering
-    5) <name>_allele_names.tsv, mapping between <name>_C#A# to original CDS headers
-    6) <name>_redundant_headers.tsv, lists of headers sharing the same CDS, with the
-        representative header relevant to #5 listed first for each group.
-    7) <name>_missing_headers.txt, lists headers for original entries missing sequences
+    3) <name>_strain_by_allele.table, allele table in native format (see save_feature_table; if save_table)
+    4) <name>_strain_by_gene.table, gene table in native format (see save_feature_table; if save_table)
+    5) <name>_strain_by_allele.csv.gz, binary allele x genome table as long-format (feature, genome, value) CSV (if save_csv)
+    6) <name>_strain_by_gene.csv.gz, binary gene x genome table as long-format (feature, genome, value) CSV (if save_csv)
+    7) <name>_nr.faa, all non-redundant CDSs observed, with headers <name>_C#A#
+    8) <name>_nr.faa.cdhit.clstr, CD-Hit output file from clustering
+    9) <name>_allele_names.tsv, mapping between <name>_C#A# to original CDS headers
+    10) <name>_redundant_headers.tsv, lists of headers sharing the same CDS, with the
+        representative header relevant to #9 listed first for each group.
+    11) <name>_missing_headers.txt, lists headers for original entries missing sequences
     
     Parameters
     ----------
@@ -79,8 +87,17 @@ def build_cds_pangenome(genome_faa_paths, output_dir, name='Test',
         Path to Exonerate's fastasort binary, optionally for sorting
         final FAA files (default None)
     save_csv : bool
-        If true, saves allele and gene tables as csv.gz. May be limiting
+        If true, saves allele and gene tables as long-format csv.gz. May be limiting
         step for very large tables (default True)
+    save_table : bool
+        If true, also saves allele and gene tables in native format (.table directories,
+        see save_feature_table) for fast partial loading (default True)
+    n_jobs : int
+        Number of processes used to hash genome FAAs when identifying
+        non-redundant sequences, see consolidate_seqs() (default 1)
+    seq_store : pyphylon.seqstore.SequenceStore
+        Persistent sequence store to reuse hashes of unchanged genome FAAs across 
+        runs and record allele names, see consolidate_seqs() (default None)
         
     Returns 
     -------
@@ -99,7 +116,8 @@ def build_cds_pangenome(genome_faa_paths, output_dir, name='Test',
     output_shared_headers = output_shared_headers.replace('//','/')
     output_missing_headers = output_missing_headers.replace('//','/')
     non_redundant_seq_hashes, missing_headers = consolidate_seqs(
-        genome_faa_paths, output_nr_faa, output_shared_headers, output_missing_headers)
+        genome_faa_paths, output_nr_faa, output_shared_headers, output_missing_headers,
+        n_jobs=n_jobs, seq_store=seq_store)
     # maps sequence hash to headers of that sequence, in order observed
     
     ''' Apply CD-Hit to non-redundant CDS sequences '''
@@ -115,7 +133,7 @@ def build_cds_pangenome(genome_faa_paths, output_dir, name='Test',
         output_nr_clstr, output_nr_faa, output_nr_faa, 
         output_allele_names, name=name, cluster_type='cds',
         shared_headers_file=output_shared_headers,
-        fastasort_path=fastasort_path)
+        fastasort_path=fastasort_path, seq_store=seq_store, genome_paths=genome_faa_paths)
     # maps original headers to short names <name>_C#A#
     
     ''' Process gene/allele membership into binary tables '''    
@@ -123,63 +141,296 @@ def build_cds_pangenome(genome_faa_paths, output_dir, name='Test',
         output_nr_clstr, genome_faa_paths, name,
         cluster_type='cds', header_to_allele=header_to_allele)
     
-    ''' Save tables as PICKLE.GZ (preserve SparseArrays) and CSV.GZ (backup flat file) '''
+    ''' Save tables as PICKLE.GZ (preserve SparseArrays), native tables, and CSV.GZ (sparse long format) '''
     output_allele_table = output_dir + '/' + name + '_strain_by_allele'
     output_gene_table = output_dir + '/' + name + '_strain_by_gene'
     output_allele_table = output_allele_table.replace('//','/')
     output_gene_table = output_gene_table.replace('//','/')
-    output_allele_csv = output_allele_table + '.csv.gz'
-    output_gene_csv = output_gene_table + '.csv.gz'
-    output_allele_pickle = output_allele_table + '.pickle.gz'
-    output_gene_pickle = output_gene_table + '.pickle.gz'
-    print('Saving', output_allele_pickle, '...')
-    df_alleles.to_pickle(output_allele_pickle)
-    print('Saving', output_gene_pickle, '...')
-    df_genes.to_pickle(output_gene_pickle)
-    if save_csv:
-        print('Saving', output_allele_csv, '...')
-        df_alleles.to_csv(output_allele_csv)
-        print('Saving', output_gene_csv, '...')
-        df_genes.to_csv(output_gene_csv)
+    __save_feature_table__(df_alleles, output_allele_table, save_csv, save_table)
+    __save_feature_table__(df_genes, output_gene_table, save_csv, save_table)
 
     return df_alleles, df_genes, header_to_allele
 
 
+def update_cds_pangenome(existing_output_dir, new_faa_paths, name='Test',
+                         cdhit_args={'-n':5, '-c':0.8}, save_csv=True, n_jobs=1,
+                         save_table=True):
+    '''
+    Adds new genomes to a pan-genome previously constructed by build_cds_pangenome()
+    in existing_output_dir, without re-clustering the existing sequences:
+    1) Merge new FAA files into a non-redundant list, and match sequences already 
+       present in the pan-genome by hash to their existing <name>_C#A# alleles
+    2) Assign novel sequences to existing clusters with CD-HIT-2D against the
+       cluster representatives, as new alleles numbered after existing ones
+    3) Cluster remaining novel sequences with CD-Hit into new <name>_C# clusters,
+       numbered after the existing clusters
+    4) Append new genomes as columns to the allele x genome and gene x genome tables
+    
+    Updates the files generated by build_cds_pangenome() in place. Genomes 
+    already present in the saved tables are skipped.
+    
+    Parameters
+    ----------
+    existing_output_dir : str
+        Path to directory with outputs from build_cds_pangenome()
+    new_faa_paths : list 
+        FAA files containing CDSs for new genomes. Genome 
+        names are inferred from these FAA file paths.
+    name : str
+        Header used for output files and allele names of the 
+        existing pan-genome (default 'Test')
+    cdhit_args : dict
+        Alignment arguments to pass CD-HIT-2D and CD-Hit, other than -i, -i2, -o, 
+        and -d. Should match those used to build the pan-genome (default {'-n':5, '-c':0.8})
+    save_csv : bool
+        If true, saves allele and gene tables as long-format csv.gz. May be limiting
+        step for very large tables (default True)
+    save_table : bool
+        If true, also saves allele and gene tables in native format (.table directories,
+        see save_feature_table) for fast partial loading (default True)
+    n_jobs : int
+        Number of processes used to hash genome FAAs when identifying
+        non-redundant sequences, see consolidate_seqs() (default 1)
+        
+    Returns 
+    -------
+    df_alleles : pd.DataFrame
+        Binary allele x genome table, including new genomes
+    df_genes : pd.DataFrame
+        Binary gene x genome table, including new genomes
+    header_to_allele : dict
+        Maps original headers from new genomes to allele names
+    '''
+    
+    ''' Locate existing pan-genome files '''
+    output_base = (existing_output_dir + '/' + name).replace('//','/')
+    output_nr_faa = output_base # non-redundant FAA with <name>_C#A# headers
+    output_nr_clstr = output_nr_faa + '.cdhit.clstr'
+    output_allele_names = output_base + '_allele_names.tsv'
+    output_shared_headers = output_base + '_redundant_headers.tsv'
+    output_missing_headers = output_base + '_missing_headers.txt'
+    output_allele_table = output_base + '_strain_by_allele'
+    output_gene_table = output_base + '_strain_by_gene'
+    df_alleles = pd.read_pickle(output_allele_table + '.pickle.gz')
+    df_genes = pd.read_pickle(output_gene_table + '.pickle.gz')
+    
+    ''' Select genomes not already in the pan-genome '''
+    new_faa_paths = sorted(new_faa_paths)
+    existing_genomes = set(df_alleles.columns)
+    skipped = [x for x in new_faa_paths if __get_genome_from_filename__(x) in existing_genomes]
+    if len(skipped) > 0:
+        print('Skipping genomes already in pan-genome:', len(skipped))
+    new_faa_paths = [x for x in new_faa_paths if not x in skipped]
+    if len(new_faa_paths) == 0:
+        print('No new genomes to add')
+        return df_alleles, df_genes, {}
+    
+    ''' Merge new FAAs into one file with non-redundant sequences '''
+    print('Identifying non-redundant CDS sequences in new genomes...')
+    update_dir = output_base + '_update' # intermediate files for this update
+    if os.path.exists(update_dir): # left over from an interrupted update
+        shutil.rmtree(update_dir)
+    os.mkdir(update_dir)
+    try:
+        new_nr_faa = update_dir + '/new_nr.faa'
+        new_shared_headers = update_dir + '/new_redundant_headers.tsv'
+        new_missing_headers = update_dir + '/new_missing_headers.txt'
+        new_seq_hashes, new_missing = consolidate_seqs(
+            new_faa_paths, new_nr_faa, new_shared_headers, new_missing_headers, n_jobs=n_jobs)
+    
+        ''' Load existing allele names and alleles per cluster '''
+        print('Loading existing alleles...')
+        allele_to_headers = {} # maps <name>_C#A# to original headers, in file order
+        cluster_sizes = {} # maps <name>_C# to number of alleles
+        with open(output_allele_names, 'r') as f_names:
+            for line in f_names:
+                data = line.strip().split('\t')
+                allele_to_headers[data[0]] = data[1:]
+                gene = __get_gene_from_allele__(data[0])
+                cluster_sizes[gene] = cluster_sizes.get(gene, 0) + 1
+        max_cluster = max([breakdown_feature_name(x)[2] for x in cluster_sizes]) if cluster_sizes else -1
+    
+        ''' Load CLSTR representatives, then match new sequences to existing alleles by hash '''
+        header_to_allele = {headers[0]:allele for allele, headers in allele_to_headers.items()}
+        rep_header_to_gene = {} # maps original header of cluster representatives to <name>_C#
+        representatives = set() # alleles of cluster representatives
+        clstr = read_clstr(output_nr_clstr)
+        for rep_header in clstr['header'][clstr['is_representative']]:
+            representatives.add(header_to_allele[rep_header])
+            rep_header_to_gene[rep_header] = __get_gene_from_allele__(header_to_allele[rep_header])
+        del clstr
+        del header_to_allele
+    
+        new_header_to_allele = {} # maps headers from new genomes to allele names
+        output_reps = update_dir + '/representatives.faa' # cluster representatives, headers <name>_C#
+        with open(output_reps, 'w+') as f_reps:
+            for allele, seq in iter_fasta(output_nr_faa):
+                seqhash = __hash_sequence__(seq)
+                if seqhash in new_seq_hashes: # new genome sequence already in pan-genome
+                    for header in new_seq_hashes.pop(seqhash):
+                        new_header_to_allele[header] = allele.decode()
+                if allele.decode() in representatives:
+                    f_reps.write('>' + __get_gene_from_allele__(allele.decode()) + '\n')
+                    f_reps.write(seq.decode() + '\n')
+        print('Sequences matching existing alleles:', len(new_header_to_allele))
+    
+        ''' Write novel sequences under their representative header '''
+        output_novel = update_dir + '/novel.faa'
+        novel_seqs = {} # maps representative header to novel sequence
+        novel_headers = {} # maps representative header to all headers sharing the sequence
+        with open(output_novel, 'w+') as f_novel:
+            for header, seq in iter_fasta(new_nr_faa, short_headers=True, decode=True):
+                seqhash = __hash_sequence__(seq.encode())
+                if seqhash in new_seq_hashes:
+                    novel_seqs[header] = seq
+                    novel_headers[header] = new_seq_hashes[seqhash]
+                    f_novel.write('>' + header + '\n' + seq + '\n')
+        print('Novel sequences:', len(novel_seqs))
+    
+        ''' Assign novel sequences to existing clusters with CD-HIT-2D '''
+        clstr_additions = {} # maps <name>_C# to CLSTR member lines to append
+        novel_alleles = {} # maps representative header to new allele name
+        if len(novel_seqs) > 0 and len(representatives) > 0:
+            output_2d = update_dir + '/novel_2d'
+            cluster_with_cdhit_2d(output_reps, output_novel, output_2d, cdhit_args)
+            with open(output_2d + '.clstr', 'r') as f_clstr:
+                gene = None
+                for line in f_clstr:
+                    if line[0] == '>': # new cluster
+                        gene = None
+                    elif line.strip().endswith('*'): # existing cluster representative
+                        gene = line.split()[2][1:-3]
+                    elif not gene is None: # novel sequence joining existing cluster
+                        header = line.split()[2][1:-3]
+                        allele_num = cluster_sizes[gene]
+                        cluster_sizes[gene] += 1
+                        novel_alleles[header] = gene + VARIANT_TYPES['allele'] + str(allele_num)
+                        member_line = line.split('\t', 1)[1]
+                        clstr_additions.setdefault(gene, []).append(member_line)
+            print('Novel sequences joining existing clusters:', len(novel_alleles))
+    
+        ''' Cluster leftover novel sequences with CD-Hit into new clusters '''
+        new_clusters = [] # CLSTR member lines per new cluster
+        leftovers = [x for x in novel_seqs if not x in novel_alleles]
+        if len(leftovers) > 0:
+            output_leftovers = update_dir + '/leftovers.faa'
+            with open(output_leftovers, 'w+') as f_left:
+                for header in leftovers:
+                    f_left.write('>' + header + '\n' + novel_seqs[header] + '\n')
+            cluster_with_cdhit(output_leftovers, output_leftovers + '.cdhit', cdhit_args)
+            with open(output_leftovers + '.cdhit.clstr', 'r') as f_clstr:
+                for line in f_clstr:
+                    if line[0] == '>': # new cluster
+                        cluster_num = max_cluster + len(new_clusters) + 1
+                        new_clusters.append([])
+                    else: # adding allele to new cluster
+                        header = line.split()[2][1:-3]
+                        allele_num = len(new_clusters[-1])
+                        novel_alleles[header] = create_feature_name(name, 'cds', cluster_num, 'allele', allele_num)
+                        new_clusters[-1].append(line.split('\t', 1)[1])
+            print('New clusters:', len(new_clusters))
+    
+        ''' Update CLSTR file, appending members to existing clusters and new clusters '''
+        print('Updating', output_nr_clstr, '...')
+        with open(output_nr_clstr, 'r') as f_clstr:
+            with open(output_nr_clstr + '.tmp', 'w+') as f_clstr_new:
+                member_lines = []
+                def flush_cluster(gene, member_lines):
+                    for member_line in clstr_additions.get(gene, []):
+                        f_clstr_new.write(str(len(member_lines)) + '\t' + member_line)
+                        member_lines.append(member_line)
+                gene = None
+                for line in f_clstr:
+                    if line[0] == '>':
+                        flush_cluster(gene, member_lines)
+                        member_lines = []; gene = None
+                        f_clstr_new.write(line)
+                    else:
+                        member_lines.append(line)
+                        if line.strip().endswith('*'):
+                            gene = rep_header_to_gene[line.split()[2][1:-3]]
+                        f_clstr_new.write(line)
+                flush_cluster(gene, member_lines)
+                for c, cluster_lines in enumerate(new_clusters):
+                    f_clstr_new.write('>Cluster ' + str(max_cluster + c + 1) + '\n')
+                    for m, member_line in enumerate(cluster_lines):
+                        f_clstr_new.write(str(m) + '\t' + member_line)
+        os.rename(output_nr_clstr + '.tmp', output_nr_clstr)
+    
+        ''' Append novel alleles to the non-redundant FAA, update allele names and shared headers '''
+        with open(output_nr_faa, 'a') as f_nr:
+            for header in sorted(novel_alleles, key=lambda x: novel_alleles[x]):
+                f_nr.write('>' + novel_alleles[header] + '\n' + novel_seqs[header] + '\n')
+        sort_fasta(output_nr_faa, output_nr_faa) # restore cluster/allele order and index
+        for header, allele in novel_alleles.items():
+            for synonym_header in novel_headers[header]:
+                new_header_to_allele[synonym_header] = allele
+        for header, allele in new_header_to_allele.items():
+            allele_to_headers.setdefault(allele, []).append(header)
+        with open(output_allele_names, 'w+') as f_names:
+            with open(output_shared_headers, 'w+') as f_shared:
+                for allele in sorted(allele_to_headers, key=breakdown_feature_name):
+                    headers = allele_to_headers[allele]
+                    f_names.write(allele + '\t' + '\t'.join(headers) + '\n')
+                    if len(headers) > 1:
+                        f_shared.write('\t'.join(headers) + '\n')
+        if len(new_missing) > 0:
+            with open(output_missing_headers, 'a') as f_missing:
+                for header in new_missing:
+                    f_missing.write(header + '\n')
+    
+        ''' Process gene/allele membership of new genomes, append to tables '''
+        new_alleles, new_genes = build_genetic_feature_tables(
+            None, new_faa_paths, name, cluster_type='cds', header_to_allele=new_header_to_allele)
+        allele_order = sorted(set(df_alleles.index).union(new_alleles.index), key=breakdown_feature_name)
+        gene_order = sorted(set(df_genes.index).union(new_genes.index), key=breakdown_feature_name)
+        df_alleles = pd.concat([df_alleles.reindex(allele_order), new_alleles.reindex(allele_order)], axis=1)
+        df_genes = pd.concat([df_genes.reindex(gene_order), new_genes.reindex(gene_order)], axis=1)
+        df_alleles = df_alleles.astype(pd.SparseDtype('int64', np.nan))
+        df_genes = df_genes.astype(pd.SparseDtype('int64', np.nan))
+    
+        ''' Save tables as PICKLE.GZ (preserve SparseArrays), native tables, and CSV.GZ (sparse long format) '''
+        __save_feature_table__(df_alleles, output_allele_table, save_csv, save_table)
+        __save_feature_table__(df_genes, output_gene_table, save_csv, save_table)
+    finally:
+        shutil.rmtree(update_dir, ignore_errors=True)
+    
+    return df_alleles, df_genes, new_header_to_allele
+
+
 def build_cds_nucl_pangenome(genome_data, output_dir, name='Test',
                              allowed_features=['CDS', 'tRNA'],
                              cdhit_args={'-n': 5, '-c':0.8}, fastasort_path=None,
-                             save_csv=True):
+                             save_csv=True, n_jobs=1, extract=True, save_table=True):
     '''
         Constructs a pan-genome based on  coding nucleic acid sequences with the following steps:
         1) Extract coding transcripts based on FNA/GFF pairs
         2) Cluster CDS by sequence into putative transcripts using CD-HIT-EST
-        3) Rename non-redundant transcript as <name>_T#A#, referring to transcript cluster and allele number
+        3) Rename non-redundant coding sequences as <name>_C#A#, referring to gene cluster and allele number
         4) Compile allele/transcript membership into binary transcript allele x genome and transcript x genome tables
 
-        Generates eight files within output_dir:
+        Generates up to eleven files within output_dir:
         1) <name>_strain_by_coding_nuc_allele.pickle.gz, binary allele x genome table with SparseArray structure
         2) <name>_strain_by_coding_nuc.pickle.gz, binary gene x genome table with SparseArray structure
-        1) <name>_strain_by_coding_nuc_allele.csv.gz, binary allele x genome table as flat file (if save_csv)
-        2) <name>_strain_by_coding_nuc.csv.gz, binary gene x genome table as flat file (if save_csv)
-        3) <name>_coding_nuc_nr.fna, all non-redundant coding seqs observed, with headers <name>_T#A#
-        4) <name>_coding_nuc_nr.fna.cdhit.clstr, CD-HIT-EST output file from clustering
-        5) <name>_coding_nuc_allele_names.tsv, mapping between <name>_T#A# to original transcript headers
-        6) <name>_coding_nuc_redundant_headers.tsv, lists of headers sharing the same sequences, with the
-            representative header relevant to #5 listed first for each group.
-        7) <name>_coding_missing_headers.txt, lists headers for original entries missing sequences
+        3) <name>_strain_by_coding_nuc_allele.table, allele table in native format (see save_feature_table; if save_table)
+        4) <name>_strain_by_coding_nuc.table, gene table in native format (see save_feature_table; if save_table)
+        5) <name>_strain_by_coding_nuc_allele.csv.gz, binary allele x genome table as long-format (feature, genome, value) CSV (if save_csv)
+        6) <name>_strain_by_coding_nuc.csv.gz, binary gene x genome table as long-format (feature, genome, value) CSV (if save_csv)
+        7) <name>_coding_nuc_nr.fna, all non-redundant coding seqs observed, with headers <name>_C#A#
+        8) <name>_coding_nuc_nr.fna.cdhit.clstr, CD-HIT-EST output file from clustering
+        9) <name>_coding_nuc_allele_names.tsv, mapping between <name>_C#A# to original coding sequence headers
+        10) <name>_coding_nuc_redundant_headers.tsv, lists of headers sharing the same sequences, with the
+            representative header relevant to #9 listed first for each group.
+        11) <name>_coding_nuc_missing_headers.txt, lists headers for original entries missing sequences
 
         Parameters
         ----------
         genome_data : list
-            List of 2-tuples (genome_gff, genome_fna) for use by extract_coding()
+            List of 2-tuples (genome_gff, genome_fna) for use by extract_coding_fna()
         output_dir : str
             Path to directory to generate outputs and intermediates.
         name : str
             Header to prepend to all output files and allele names (default 'Test')
-        flanking : tuple
-            (X,Y) where X = number of nts to include from 5' end of feature,
-            and Y = number of nts to include from 3' end feature. Features
-            may be truncated by contig boundaries (default (0,0))
         allowed_features : list
             List of GFF feature types to extract. Default includes
             features labeled "CDS" and "tRNA"
@@ -190,18 +441,44 @@ def build_cds_nucl_pangenome(genome_data, output_dir, name='Test',
             Path to Exonerate's fastasort binary, optionally for sorting
             final FAA files (default None)
         save_csv : bool
-            If true, saves allele and gene tables as csv.gz. May be limiting
+            If true, saves allele and gene tables as long-format csv.gz. May be limiting
             step for very large tables (default True)
+        save_table : bool
+            If true, also saves allele and gene tables in native format (.table directories,
+            see save_feature_table) for fast partial loading (default True)
+        n_jobs : int
+            Number of processes used to extract coding sequences from genomes in
+            parallel, and to hash them when identifying non-redundant sequences,
+            see consolidate_seqs(). If -1, uses all available cores (default 1)
+        extract : bool
+            If true, extracts coding sequences from each genome. Otherwise, reuses
+            <genome>_nuc_coding.fna files previously extracted with the same parameters,
+            i.e. by extract_pangenome_features() (default True)
 
         Returns
         -------
         df_nuc_alleles : pd.DataFrame
-            Binary non-coding allele x genome table
+            Binary coding nucleotide allele x genome table
         df_nuc_genes : pd.DataFrame
-            Binary non-coding gene x genome table
+            Binary coding nucleotide gene x genome table
+        header_to_allele : dict
+            Maps original coding sequence headers to <name>_C#A# alleles
         '''
 
-    ''' Extract coding nucleid acid sequences from all genomes '''
+    ''' Extract coding nucleic acid sequences from all genomes '''
+    genome_coding_paths = []; extraction_tasks = []
+    for i, gff_fna in enumerate(genome_data):
+        ''' Prepare output path '''
+        genome_gff, genome_fna = gff_fna
+        genome = __get_genome_from_filename__(genome_gff)
+        genome_nuc = __get_derived_path__(genome_gff, 'coding') # output coding sequences here
+        genome_coding_paths.append(genome_nuc)
+        extraction_tasks.append((genome, (genome_gff, genome_fna, genome_nuc, allowed_features)))
+    if extract:
+        print('Extracting coding sequences...')
+        __map_genomes__(extract_coding_fna, extraction_tasks, n_jobs=n_jobs)
+
+    ''' Reduce to non-redundant sequence set '''
     print('Identifying non-redundant CDS sequences...')
     output_nr_nuc_fna = output_dir + '/' + name + '_coding_nuc_nr.fna' #final non-redundant
     output_shared_headers = output_dir + '/' + name + '_coding_nuc_redundant_headers.tsv' # records headers that have the same sequence
@@ -209,37 +486,17 @@ def build_cds_nucl_pangenome(genome_data, output_dir, name='Test',
     output_nr_nuc_fna = output_nr_nuc_fna.replace('//','/')
     output_shared_headers = output_shared_headers.replace('//','/')
     output_missing_headers = output_missing_headers.replace('//','/')
+    non_redundant_seq_hashes, missing_headers = consolidate_seqs(
+        genome_coding_paths, output_nr_nuc_fna, output_shared_headers, output_missing_headers, n_jobs=n_jobs)
 
-    # before we consolidate the sequences, we need to generate the coding fna files
-    # print('Extracting coding-sequences...')
-    # genome_coding_paths = []
-    # for i, gff_fna in enumerate(genome_data):
-    #     '''Prepare output path'''
-    #     genome_gff, genome_fna = gff_fna
-    #     genome = __get_genome_from_filename__(genome_gff)
-    #     genome_dir = '/'.join(genome_gff.split('/')[:-1]) + '/' if '/' in genome_gff else ''
-    #     genome_nuc_dir = genome_dir + 'derived/'  # output coding sequences here
-    #     if not os.path.exists(genome_nuc_dir):
-    #         os.mkdir(genome_nuc_dir)
-    #     genome_nuc = genome_nuc_dir + genome + '_nuc_coding.fna'
-    #     '''Extract non-coding sequnces'''
-    #     print(i+1, genome)
-    #     genome_coding_paths.append(genome_nuc)
-    #     extract_coding_fna(genome_gff, genome_fna, genome_nuc,
-    #                       allowed_features=allowed_features)
-
-    # consolidate redundant sequences
-    # non_redundant_seq_hashes, missing_headers = consolidate_seqs(
-    # genome_coding_paths, output_nr_nuc_fna, output_shared_headers, output_missing_headers)
-
-    # ''' Apply CD-Hit to non-redundant CDS sequences '''
-    # output_nr_faa_copy = output_nr_nuc_fna + '.cdhit'  # temporary FAA copy generated by CD-Hit
-    # output_nr_clstr = output_nr_nuc_fna + '.cdhit.clstr'  # cluster file generated by CD-Hit
-    # cluster_with_cdhit(output_nr_nuc_fna, output_nr_faa_copy, cdhit_args)
-    # os.remove(output_nr_faa_copy)  # delete CD-hit copied sequences
+    ''' Apply CD-HIT-EST to non-redundant CDS sequences '''
+    output_nr_fna_copy = output_nr_nuc_fna + '.cdhit'  # temporary FNA copy generated by CD-HIT-EST
+    output_nr_clstr = output_nr_nuc_fna + '.cdhit.clstr'  # cluster file generated by CD-HIT-EST
+    cluster_with_cdhit(output_nr_nuc_fna, output_nr_fna_copy, cdhit_args)
+    os.remove(output_nr_fna_copy)  # delete CD-HIT-EST copied sequences
 
     ''' Extract genes and alleles, rename unique sequences as <name>_C#A# '''
-    output_allele_names = output_dir + '/' + name + '_allele_names.tsv'  # allele names vs non-redundant headers
+    output_allele_names = output_dir + '/' + name + '_coding_nuc_allele_names.tsv'  # allele names vs non-redundant headers
     output_allele_names = output_allele_names.replace('//', '/')
     header_to_allele = rename_genes_and_alleles(
         output_nr_clstr, output_nr_nuc_fna, output_nr_nuc_fna,
@@ -252,32 +509,24 @@ def build_cds_nucl_pangenome(genome_data, output_dir, name='Test',
     df_alleles, df_genes = build_genetic_feature_tables(
         output_nr_clstr, genome_coding_paths, name,
         cluster_type='cds', header_to_allele=header_to_allele)
+    df_alleles.columns = df_alleles.columns.map(lambda x: x.replace('_nuc_coding',''))
+    df_genes.columns = df_genes.columns.map(lambda x: x.replace('_nuc_coding',''))
 
-    ''' Save tables as PICKLE.GZ (preserve SparseArrays) and CSV.GZ (backup flat file) '''
-    output_allele_table = output_dir + '/' + name + '_strain_by_allele'
-    output_gene_table = output_dir + '/' + name + '_strain_by_gene'
+    ''' Save tables as PICKLE.GZ (preserve SparseArrays), native tables, and CSV.GZ (sparse long format) '''
+    output_allele_table = output_dir + '/' + name + '_strain_by_coding_nuc_allele'
+    output_gene_table = output_dir + '/' + name + '_strain_by_coding_nuc'
     output_allele_table = output_allele_table.replace('//', '/')
     output_gene_table = output_gene_table.replace('//', '/')
-    output_allele_csv = output_allele_table + '.csv.gz'
-    output_gene_csv = output_gene_table + '.csv.gz'
-    output_allele_pickle = output_allele_table + '.pickle.gz'
-    output_gene_pickle = output_gene_table + '.pickle.gz'
-    print('Saving', output_allele_pickle, '...')
-    df_alleles.to_pickle(output_allele_pickle)
-    print('Saving', output_gene_pickle, '...')
-    df_genes.to_pickle(output_gene_pickle)
-    if save_csv:
-        print('Saving', output_allele_csv, '...')
-        df_alleles.to_csv(output_allele_csv)
-        print('Saving', output_gene_csv, '...')
-        df_genes.to_csv(output_gene_csv)
+    __save_feature_table__(df_alleles, output_allele_table, save_csv, save_table)
+    __save_feature_table__(df_genes, output_gene_table, save_csv, save_table)
 
     return df_alleles, df_genes, header_to_allele
 
 
 def build_noncoding_pangenome(genome_data, output_dir, name='Test', flanking=(0,0),
                               allowed_features=['transcript', 'tRNA', 'rRNA', 'misc_binding'],
-                              cdhit_args={'-n':5, '-c':0.8}, fastasort_path=None, save_csv=True):
+                              cdhit_args={'-n':5, '-c':0.8}, fastasort_path=None, save_csv=True,
+                              n_jobs=1, seq_store=None, extract=True, save_table=True):
     ''' 
     Constructs a pan-genome based on noncoding sequences with the following steps:
     1) Extract non-coding transcripts (optionally with flanking NTs) based on FNA/GFF pairs
@@ -285,17 +534,19 @@ def build_noncoding_pangenome(genome_data, output_dir, name='Test', flanking=(0,
     3) Rename non-redundant transcript as <name>_T#A#, referring to transcript cluster and allele number
     4) Compile allele/transcript membership into binary transcript allele x genome and transcript x genome tables
     
-    Generates eight files within output_dir:
+    Generates up to eleven files within output_dir:
     1) <name>_strain_by_noncoding_allele.pickle.gz, binary allele x genome table with SparseArray structure
-    2) <name>_strain_by_noncoding.pickle.gz, binary gene x genome table with SparseArray structure
-    1) <name>_strain_by_noncoding_allele.csv.gz, binary allele x genome table as flat file (if save_csv)
-    2) <name>_strain_by_noncoding.csv.gz, binary gene x genome table as flat file (if save_csv)
-    3) <name>_noncoding_nr.fna, all non-redundant non-coding seqs observed, with headers <name>_T#A#
-    4) <name>_noncoding_nr.fna.cdhit.clstr, CD-HIT-EST output file from clustering
-    5) <name>_noncoding_allele_names.tsv, mapping between <name>_T#A# to original transcript headers
-    6) <name>_noncoding_redundant_headers.tsv, lists of headers sharing the same sequences, with the
-        representative header relevant to #5 listed first for each group.
-    7) <name>_noncoding_missing_headers.txt, lists headers for original entries missing sequences
+    2) <name>_strain_by_noncoding_gene.pickle.gz, binary gene x genome table with SparseArray structure
+    3) <name>_strain_by_noncoding_allele.table, allele table in native format (see save_feature_table; if save_table)
+    4) <name>_strain_by_noncoding_gene.table, gene table in native format (see save_feature_table; if save_table)
+    5) <name>_strain_by_noncoding_allele.csv.gz, binary allele x genome table as long-format (feature, genome, value) CSV (if save_csv)
+    6) <name>_strain_by_noncoding_gene.csv.gz, binary gene x genome table as long-format (feature, genome, value) CSV (if save_csv)
+    7) <name>_noncoding_nr.fna, all non-redundant non-coding seqs observed, with headers <name>_T#A#
+    8) <name>_noncoding_nr.fna.cdhit.clstr, CD-HIT-EST output file from clustering
+    9) <name>_noncoding_allele_names.tsv, mapping between <name>_T#A# to original transcript headers
+    10) <name>_noncoding_redundant_headers.tsv, lists of headers sharing the same sequences, with the
+        representative header relevant to #9 listed first for each group.
+    11) <name>_noncoding_missing_headers.txt, lists headers for original entries missing sequences
     
     Parameters
     ----------
@@ -320,8 +571,22 @@ def build_noncoding_pangenome(genome_data, output_dir, name='Test', flanking=(0,
         Path to Exonerate's fastasort binary, optionally for sorting
         final FAA files (default None)
     save_csv : bool
-        If true, saves allele and gene tables as csv.gz. May be limiting
+        If true, saves allele and gene tables as long-format csv.gz. May be limiting
         step for very large tables (default True)
+    save_table : bool
+        If true, also saves allele and gene tables in native format (.table directories,
+        see save_feature_table) for fast partial loading (default True)
+    n_jobs : int
+        Number of processes used to extract non-coding sequences from genomes in 
+        parallel, and to hash them when identifying non-redundant sequences, 
+        see consolidate_seqs(). If -1, uses all available cores (default 1)
+    seq_store : pyphylon.seqstore.SequenceStore
+        Persistent sequence store to reuse hashes of unchanged non-coding sequence
+        files across runs and record allele names, see consolidate_seqs() (default None)
+    extract : bool
+        If true, extracts non-coding sequences from each genome. Otherwise, reuses
+        <genome>_noncoding.fna files previously extracted with the same parameters, 
+        i.e. by extract_pangenome_features() (default True)
         
     Returns 
     -------
@@ -332,23 +597,19 @@ def build_noncoding_pangenome(genome_data, output_dir, name='Test', flanking=(0,
     '''
     
     ''' Extract non-coding sequences from all genomes '''
-    print('Extracting non-coding sequences...')
-    genome_noncoding_paths = []
+    genome_noncoding_paths = []; extraction_tasks = []
     for i, gff_fna in enumerate(genome_data):
         ''' Prepare output path '''
         genome_gff, genome_fna = gff_fna
         genome = __get_genome_from_filename__(genome_gff)
-        genome_dir = '/'.join(genome_gff.split('/')[:-1]) + '/' if '/' in genome_gff else ''
-        genome_nc_dir = genome_dir + 'derived/' # output noncoding sequences here
-        if not os.path.exists(genome_nc_dir):
-            os.mkdir(genome_nc_dir)
-        genome_nc = genome_nc_dir + genome + '_noncoding.fna'
-            
-        ''' Extract non-coding sequences '''
-        print(i+1, genome)
+        genome_nc = __get_derived_path__(genome_gff, 'noncoding') # output noncoding sequences here
         genome_noncoding_paths.append(genome_nc)
-        extract_noncoding(genome_gff, genome_fna, genome_nc, 
-            flanking=flanking, allowed_features=allowed_features)
+        extraction_tasks.append((genome, (genome_gff, genome_fna, genome_nc, flanking, allowed_features)))
+            
+    ''' Extract non-coding sequences '''
+    if extract:
+        print('Extracting non-coding sequences...')
+        __map_genomes__(extract_noncoding, extraction_tasks, n_jobs=n_jobs)
         
     ''' Reduce to non-redundant sequence set '''
     print('Identifying non-redundant non-coding sequences...')
@@ -362,7 +623,7 @@ def build_noncoding_pangenome(genome_data, output_dir, name='Test', flanking=(0,
     output_missing_headers = output_missing_headers.replace('//','/')
     nr_seq_hashes, missing_headers = consolidate_seqs(
         genome_noncoding_paths, output_nr_fna, 
-        output_shared_headers, output_missing_headers)
+        output_shared_headers, output_missing_headers, n_jobs=n_jobs, seq_store=seq_store)
     # maps sequence hash to headers of that sequence, in order observed
     ''' Apply CD-Hit to non-redundant non-coding sequences '''
     output_nr_fna_copy = output_nr_fna + '.cdhit' # temporary FNA copy generated by CD-HIT-EST
@@ -377,7 +638,7 @@ def build_noncoding_pangenome(genome_data, output_dir, name='Test', flanking=(0,
         output_nr_clstr, output_nr_fna, output_nr_fna, 
         output_allele_names, name=name, cluster_type='noncoding',
         shared_headers_file=output_shared_headers,
-        fastasort_path=fastasort_path)
+        fastasort_path=fastasort_path, seq_store=seq_store, genome_paths=genome_noncoding_paths)
     # maps original headers to short names <name>_T#A#
     
     ''' Process gene/allele membership into binary tables '''    
@@ -387,35 +648,35 @@ def build_noncoding_pangenome(genome_data, output_dir, name='Test', flanking=(0,
     df_nc_alleles.columns = df_nc_alleles.columns.map(lambda x: x.replace('_noncoding',''))
     df_nc_genes.columns = df_nc_genes.columns.map(lambda x: x.replace('_noncoding','')) 
     
-    ''' Save tables as PICKLE.GZ (preserve SparseArrays) and CSV.GZ (backup flat file) '''
+    ''' Save tables as PICKLE.GZ (preserve SparseArrays), native tables, and CSV.GZ (sparse long format) '''
     output_allele_table = output_dir + '/' + name + '_strain_by_noncoding_allele'
     output_gene_table = output_dir + '/' + name + '_strain_by_noncoding_gene'
     output_allele_table = output_allele_table.replace('//','/')
     output_gene_table = output_gene_table.replace('//','/')
-    output_allele_csv = output_allele_table + '.csv.gz'
-    output_gene_csv = output_gene_table + '.csv.gz'
-    output_allele_pickle = output_allele_table + '.pickle.gz'
-    output_gene_pickle = output_gene_table + '.pickle.gz'
-    print('Saving', output_allele_pickle, '...')
-    df_nc_alleles.to_pickle(output_allele_pickle)
-    print('Saving', output_gene_pickle, '...')
-    df_nc_genes.to_pickle(output_gene_pickle)
-    if save_csv:
-        print('Saving', output_allele_csv, '...')
-        df_nc_alleles.to_csv(output_allele_csv)
-        print('Saving', output_gene_csv, '...')
-        df_nc_genes.to_csv(output_gene_csv)
+    __save_feature_table__(df_nc_alleles, output_allele_table, save_csv, save_table)
+    __save_feature_table__(df_nc_genes, output_gene_table, save_csv, save_table)
     
     return df_nc_alleles, df_nc_genes, header_to_allele
     
 
 # Helper functions
-def consolidate_seqs(genome_paths, nr_out, shared_headers_out, missing_headers_out=None):
-    ''' 
+def consolidate_seqs(genome_paths, nr_out, shared_headers_out, missing_headers_out=None,
+                     n_jobs=1, shard_size=None, seq_store=None):
+    '''
     Combines sequences for many genomes into a single file without duplicate
     sequences to be clustered using CD-Hit, i.e. with cluster_with_cdhit(). Tracks
     headers that share the same sequence, and optionally headers without sequences.
-    
+
+    If n_jobs > 1, genome files are split into shards of consecutive genomes
+    that are parsed and hashed by worker processes. Shards are then merged
+    in the original genome order, such that all outputs are identical to the
+    serial (n_jobs=1) outputs, including the first-seen order of sequences.
+
+    If seq_store is provided, headers and hashes of genome files that are 
+    unchanged since they were last stored are loaded from the store instead 
+    of re-reading and re-hashing the files, and new or modified genome files 
+    are added to the store. Sequences are then written to nr_out on single lines.
+
     Parameters
     ----------
     genome_paths : list
@@ -426,6 +687,16 @@ def consolidate_seqs(genome_paths, nr_out, shared_headers_out, missing_headers_o
         Output path for shared headers TSV file
     missing_headers_out : str
         Output path for headers without sequences TXT file (default None)
+    n_jobs : int
+        Number of worker processes used to parse and hash genomes. If 1,
+        genomes are processed serially in this process. If -1, uses all
+        available cores (default 1)
+    shard_size : int
+        Number of genomes parsed per worker task when n_jobs != 1. If None,
+        genomes are split into ~4 shards per worker, with at most 64 genomes
+        per shard to bound worker memory (default None)
+    seq_store : pyphylon.seqstore.SequenceStore
+        Persistent sequence store to reuse across runs (default None)
 
     Returns
     -------
@@ -437,7 +708,7 @@ def consolidate_seqs(genome_paths, nr_out, shared_headers_out, missing_headers_o
     non_redundant_seq_hashes = {} # maps sequence hash to headers of that sequence, in order observed
     encounter_order = [] # stores sequence hashes in order encountered
     missing_headers = [] # stores headers without sequences
-    
+
     def process_header_and_seq(header, seq_blocks, output_file):
         ''' Processes a header/sequence pair against the running list of non-redundant sequences '''
         seq = ''.join(seq_blocks)
@@ -453,21 +724,67 @@ def consolidate_seqs(genome_paths, nr_out, shared_headers_out, missing_headers_o
                 output_file.write('\n'.join(seq_blocks) + '\n')
         elif len(header) > 0 and len(seq) == 0: # header without sequence
             missing_headers.append(header)
-    
+
     ''' Scan for redundant sequences across all files, build non-redundant file '''
     with open(nr_out, 'w+') as f_nr_out:
-        for genome_path in genome_paths:
-            with open(genome_path, 'r') as f:
-                header = ''; seq_blocks = []
-                for line in f:
-                    if line[0] == '>': # header encountered
-                        process_header_and_seq(header, seq_blocks, f_nr_out)
-                        header = __get_header_from_fasta_line__(line)
-                        seq_blocks = []
-                    else: # sequence line encountered
-                        seq_blocks.append(line.strip())
-                process_header_and_seq(header, seq_blocks, f_nr_out) # process last record
-                
+        if not seq_store is None: # reuse stored hashes for unchanged genomes
+            genome_paths = list(genome_paths)
+            stale_paths = [x for x in genome_paths if not seq_store.is_current(x)]
+            print('Genomes loaded from sequence store:', len(genome_paths) - len(stale_paths))
+            if n_jobs == 1:
+                stale_results = (__hash_fasta_genomes__([x])[0] for x in stale_paths)
+            else:
+                from joblib import Parallel, delayed
+                shards = __shard_paths__(stale_paths, n_jobs, shard_size)
+                print('Hashing', len(stale_paths), 'genomes in', len(shards), 'shards...')
+                shard_results = Parallel(n_jobs=n_jobs, return_as='generator')(
+                    delayed(__hash_fasta_genomes__)(shard) for shard in shards)
+                stale_results = (x for shard_result in shard_results for x in shard_result)
+            stale_paths = set(stale_paths)
+
+            ''' Merge genomes in order, same as the serial scan '''
+            for genome_path in genome_paths:
+                if genome_path in stale_paths:
+                    genome_records, genome_missing, genome_seqs = next(stale_results)
+                    seq_store.add_source(genome_path, genome_records, genome_missing, genome_seqs)
+                else:
+                    genome_records, genome_missing = seq_store.get_source(genome_path)
+                    genome_seqs = None
+                for header, seqhash in genome_records:
+                    if seqhash in non_redundant_seq_hashes:
+                        non_redundant_seq_hashes[seqhash].append(header)
+                    else:
+                        encounter_order.append(seqhash)
+                        non_redundant_seq_hashes[seqhash] = [header]
+                        seq = genome_seqs[seqhash] if genome_seqs else seq_store.get_sequence(seqhash)
+                        f_nr_out.write('>' + header + '\n')
+                        f_nr_out.write(seq + '\n')
+                missing_headers += genome_missing
+        elif n_jobs == 1: # parse and hash genomes in this process
+            for genome_path in genome_paths:
+                for header, seq_blocks in iter_fasta(genome_path, skip_empty=False, short_headers=True, 
+                                                     decode=True, keep_lines=True):
+                    process_header_and_seq(header, seq_blocks, f_nr_out)
+        else: # parse and hash shards of genomes in worker processes
+            from joblib import Parallel, delayed
+            genome_paths = list(genome_paths)
+            shards = __shard_paths__(genome_paths, n_jobs, shard_size)
+            print('Hashing', len(genome_paths), 'genomes in', len(shards), 'shards...')
+            shard_results = Parallel(n_jobs=n_jobs, return_as='generator')(
+                delayed(__hash_fasta_shard__)(shard) for shard in shards)
+
+            ''' Merge shards in genome order, same as the serial scan '''
+            for shard_records, shard_missing, shard_seqs in shard_results:
+                for header, seqhash in shard_records:
+                    if seqhash in non_redundant_seq_hashes:
+                        non_redundant_seq_hashes[seqhash].append(header)
+                    else:
+                        encounter_order.append(seqhash)
+                        non_redundant_seq_hashes[seqhash] = [header]
+                        f_nr_out.write('>' + header + '\n')
+                        f_nr_out.write(shard_seqs[seqhash] + '\n')
+                missing_headers += shard_missing
+
     ''' Save shared and missing headers to file '''
     with open(shared_headers_out, 'w+') as f_header_out:
         for seqhash in encounter_order:
@@ -511,15 +828,46 @@ def cluster_with_cdhit(fasta_file, cdhit_out, cdhit_args={'-n':5, '-c':0.8}):
         print(line)
 
         
+def cluster_with_cdhit_2d(db_fasta, query_fasta, cdhit_out, cdhit_args={'-n':5, '-c':0.8}):
+    '''
+    Runs CD-HIT-2D to assign sequences in query_fasta to clusters represented
+    by sequences in db_fasta. Requires CD-Hit to be available in PATH. Uses 
+    CD-HIT-2D for FAA files (default), and CD-HIT-EST-2D for FNA files.
+    Query sequences not similar to any db_fasta sequence are written to cdhit_out.
+    
+    Parameters
+    ----------
+    db_fasta : str
+        Path to FAA/FNA file with cluster representatives
+    query_fasta : str
+        Path to FAA/FNA file with sequences to be assigned to clusters
+    cdhit_out : str
+        Path to be provided to CD-HIT-2D output argument
+    cdhit_args : dict
+        Dictionary of alignment arguments to be provided to CD-HIT-2D, other than
+        -i, -i2, -o, and -d. Default is for FAA files. (default {'-n':5, '-c':0.8})
+    ''' 
+    cdhit_prog = 'cd-hit-est-2d' if query_fasta[-4:].lower() == '.fna' else 'cd-hit-2d'
+    args = [cdhit_prog, '-i', db_fasta, '-i2', query_fasta, '-o', cdhit_out, '-d', '0']
+    for arg in cdhit_args:
+        args += [arg, str(cdhit_args[arg])]
+    print('Running:', args)
+    for line in __stream_stdout__(' '.join(args)):
+        print(line)
+
+        
 def rename_genes_and_alleles(clstr_file, nr_fasta_in, nr_fasta_out, 
                              feature_names_out, name='Test', cluster_type='cds',
-                             shared_headers_file=None, fastasort_path=None):
+                             shared_headers_file=None, fastasort_path=None, seq_store=None,
+                             genome_paths=None):
     '''
     Processes a CD-Hit CLSTR file (clstr_file) to rename headers in the orignal
     fasta as <name>_C#A# for CDS, or <name>_T#A# for non-coding features,
     based on cluster membership and stores header-name mappings as a TSV.
     
-    Can optionally sort final fasta file if fastasort_path is specified, from Exonerate
+    The final fasta file is sorted by cluster and allele number, and indexed as 
+    <nr_fasta_out>.fai (see fasta.sort_fasta). Can optionally sort with fastasort 
+    instead if fastasort_path is specified, from Exonerate
     https://www.ebi.ac.uk/about/vertebrate-genomics/software/exonerate
     
     Parameters
@@ -541,13 +889,22 @@ def rename_genes_and_alleles(clstr_file, nr_fasta_in, nr_fasta_out,
         Path to shared headers. If provided, will expand the header-allele
         mapping to include headers that map to the same sequence/allele (default None)
     fastasort_path : str
-        Path to Exonerate fastasort, used to optionally sort nr_faa (default None)
+        Path to Exonerate fastasort, used to optionally sort nr_faa instead of the
+        built-in sort. No index is written in this case (default None)
+    seq_store : pyphylon.seqstore.SequenceStore
+        If provided, records allele names by sequence in the store used to 
+        generate nr_fasta_in with consolidate_seqs(), for load_header_to_allele() (default None)
+    genome_paths : list
+        Paths to the genome FASTAs passed to consolidate_seqs(), required with seq_store.
+        Only headers from these files are mapped to alleles in the store (default None)
         
     Returns
     -------
-    header_to_allele : dict
-        Maps original headers to new allele names
+    header_to_allele : HeaderAlleleMap
+        Maps original headers to new allele names (read-only, dict-like)
     '''
+    if not seq_store is None and genome_paths is None:
+        raise ValueError('genome_paths are required to record alleles in seq_store')
     
     ''' Optionally, load up shared headers '''
     shared_headers = {} # maps representative header to synonym headers
@@ -560,52 +917,64 @@ def rename_genes_and_alleles(clstr_file, nr_fasta_in, nr_fasta_out,
                 shared_headers[representative_header] = synonym_headers
     
     ''' Read through CLSTR file to map original headers to C#A#/T#A# names '''
-    header_to_allele = {} # maps headers to allele name (name_C#A# or name_T#A#)
-    max_cluster = 0 
+    synonym_headers = []; synonym_alleles = [] # headers sharing sequences with clstr_file headers
     with open(feature_names_out, 'w+') as f_naming:
-        with open(clstr_file, 'r') as f_clstr:
-            for line in tqdm(f_clstr):
-                if line[0] == '>': # starting new gene cluster
-                    cluster_num = line.split()[-1].strip() # cluster number as string
-                    max_cluster = cluster_num
-                else: # adding allele to cluster
-                    data = line.split()
-                    allele_num = int(data[0]) # allele number as string, convert to int
-                    allele_header = data[2][1:-3] # old allele header
-                    allele_name = create_feature_name(name, cluster_type, cluster_num, 'allele', allele_num)
-                    header_to_allele[allele_header] = allele_name
-                    mapped_headers = [allele_header]
-                    if allele_header in shared_headers: # if synonym headers are available
-                        for synonym_header in shared_headers[allele_header]:
-                            header_to_allele[synonym_header] = allele_name
-                        mapped_headers += shared_headers[allele_header]
-                    f_naming.write(allele_name + '\t' + ('\t'.join(mapped_headers)).strip() + '\n')
+        clstr = read_clstr(clstr_file)
+        allele_names = __get_clstr_allele_names__(clstr, name, cluster_type)
+        for allele_header, allele_name in zip(tqdm(clstr['header']), allele_names):
+            mapped_headers = [allele_header]
+            if allele_header in shared_headers: # if synonym headers are available
+                synonym_headers += shared_headers[allele_header]
+                synonym_alleles += [allele_name] * len(shared_headers[allele_header])
+                mapped_headers += shared_headers[allele_header]
+            f_naming.write(allele_name + '\t' + ('\t'.join(mapped_headers)).strip() + '\n')
+        clstr_header_to_allele = HeaderAlleleMap(clstr['header'], allele_names) # one header per allele
+        del clstr, allele_names, shared_headers
+    header_to_allele = clstr_header_to_allele.with_entries(synonym_headers, synonym_alleles)
+    del synonym_headers, synonym_alleles
+    
+    ''' Optionally, record allele names by sequence for later runs '''
+    if not seq_store is None:
+        print('Recording alleles in sequence store...')
+        seq_store.set_alleles(__get_allele_label__(name, cluster_type), clstr_header_to_allele, genome_paths)
+    del clstr_header_to_allele
                     
     ''' Create the fasta file with renamed features '''
+    def write_renamed(allele_headers, allele_lines):
+        ''' Writes a batch of sequences under their allele names, looked up at once '''
+        allele_names = header_to_allele.get_many(allele_headers)
+        for allele_header, allele_name, lines in zip(allele_headers, allele_names, allele_lines):
+            if not allele_name is None:
+                f_fasta_new.write('>' + allele_name + '\n')
+                f_fasta_new.writelines(lines)
+            else:
+                print('MISSING:', allele_header)
+    
     with open(nr_fasta_in, 'r') as f_fasta_old:
         with open(nr_fasta_out + '.tmp', 'w+') as f_fasta_new:
-            ''' Iterate through alleles in cluster/allele order '''
-            missing = True # if currently in a sequence without a header
+            ''' Iterate through alleles in cluster/allele order, in batches of headers '''
+            allele_headers = []; allele_lines = [] # sequence lines per header
             for line in tqdm(f_fasta_old):
-                if line[0] == '>': # writing updated header line
-                    allele_header = line[1:].strip()
-                    if allele_header in header_to_allele:
-                        allele_name = header_to_allele[allele_header]
-                        f_fasta_new.write('>' + allele_name + '\n')
-                        missing = False
-                    else:
-                        print('MISSING:', allele_header)
-                        missing = True
-                elif not missing: # writing sequence line
-                    f_fasta_new.write(line)
+                if line[0] == '>': # starting a new sequence
+                    if len(allele_headers) >= 10000:
+                        write_renamed(allele_headers, allele_lines)
+                        allele_headers = []; allele_lines = []
+                    allele_headers.append(line[1:].strip())
+                    allele_lines.append([])
+                elif len(allele_lines) > 0: # sequence line, skipped if before any header
+                    allele_lines[-1].append(line)
+            write_renamed(allele_headers, allele_lines)
     
     ''' Move fasta file to desired output path '''
     if nr_fasta_out == nr_fasta_in: # if overwriting, remove old faa file
         os.remove(nr_fasta_in) 
     os.rename(nr_fasta_out + '.tmp', nr_fasta_out)
     
-    ''' If available, use exonerate.fastasort to sort entries in fasta file '''
-    if fastasort_path:
+    ''' Sort entries in fasta file, with exonerate.fastasort if available '''
+    if not fastasort_path:
+        print('Sorting sequences by header...')
+        sort_fasta(nr_fasta_out, nr_fasta_out)
+    else:
         print('Sorting sequences by header...')
         args = [fastasort_path, nr_fasta_out]
         with open(nr_fasta_out + '.tmp', 'w+') as f_sort:
@@ -618,6 +987,8 @@ def rename_genes_and_alleles(clstr_file, nr_fasta_in, nr_fasta_out,
             os.remove(nr_fasta_out + '.tmp')
         else: # sorting passed (probably)
             os.rename(nr_fasta_out + '.tmp', nr_fasta_out)
+        if os.path.exists(nr_fasta_out + '.fai'): # index from an earlier sort_fasta() no longer matches
+            os.remove(nr_fasta_out + '.fai')
     return header_to_allele
 
 
@@ -628,7 +999,8 @@ def build_genetic_feature_tables(clstr_file, genome_fasta_paths, name='Test', cl
     allele x genome (allele_table_out) and gene x genome (gene_table_out).
     Works for both CDS clusters and non-coding transcript clusters.
     Uses a CD-Hit CLSTR file, the corresponding original fasta files, 
-    and shared header mappings.
+    and shared header mappings. Tables are built as scipy.sparse matrices
+    (see build_genetic_feature_matrices) and returned as sparse DataFrames.
     
     Parameters
     ----------
@@ -644,7 +1016,7 @@ def build_genetic_feature_tables(clstr_file, genome_fasta_paths, name='Test', cl
     shared_header_file : str
         Path to shared header TSV file, if synonym headers are not mapped
         in header_to_allele or header_to_allele is not provided (default None)
-    header_to_allele : dict
+    header_to_allele : HeaderAlleleMap or dict
         Pre-calculated header-allele mappings corresponding to clstr_file,
         if available from rename_genes_and_alleles() (default None)
 
@@ -655,87 +1027,123 @@ def build_genetic_feature_tables(clstr_file, genome_fasta_paths, name='Test', cl
     df_genes : pd.DataFrame
         Binary gene x genome table
     '''
+    allele_matrix, gene_matrix, allele_order, gene_order, genome_order = \
+        build_genetic_feature_matrices(clstr_file, genome_fasta_paths, name, cluster_type,
+                                       shared_header_file, header_to_allele)
+    
+    ''' Construct DataFrame '''
+    print('Building DataFrame...')
+    df_alleles = __create_sparse_data_frame__(allele_matrix, allele_order, genome_order)
+    df_genes = __create_sparse_data_frame__(gene_matrix, gene_order, genome_order)
+    return df_alleles, df_genes
+
+
+def build_genetic_feature_matrices(clstr_file, genome_fasta_paths, name='Test', cluster_type='cds',
+                                   shared_header_file=None, header_to_allele=None):
+    '''
+    Builds binary allele x genome and gene x genome presence/absence matrices 
+    as scipy.sparse CSC int8 matrices. (allele, genome) coordinates are collected 
+    directly while scanning the original genome fasta files, and gene presence 
+    is derived from a single sparse allele-to-gene indicator product, so no dense
+    per-genome vectors are allocated. See build_genetic_feature_tables for 
+    the corresponding DataFrames.
+    
+    Parameters
+    ----------
+    clstr_file : str
+        Path to CD-Hit CLSTR file used to build header-allele mappings
+    genome_fasta_paths : list
+        Paths to genome fasta files originally combined and clustered (see consolidate_seqs)
+    name : str
+        Name to attach to features and files (default 'Test')
+    cluster_type : str
+        If 'cds', features are named <name>_C#A# for gene clusters/alleles. 
+        If 'noncoding', features are named <name>_T#A# for transcripts (default 'cds')
+    shared_header_file : str
+        Path to shared header TSV file, if synonym headers are not mapped
+        in header_to_allele or header_to_allele is not provided (default None)
+    header_to_allele : HeaderAlleleMap or dict
+        Pre-calculated header-allele mappings corresponding to clstr_file,
+        if available from rename_genes_and_alleles() (default None)
+
+    Returns 
+    -------
+    allele_matrix : scipy.sparse.csc_matrix
+        Binary allele x genome matrix (int8)
+    gene_matrix : scipy.sparse.csc_matrix
+        Binary gene x genome matrix (int8)
+    allele_order : list
+        Allele names corresponding to rows of allele_matrix
+    gene_order : list
+        Gene names corresponding to rows of gene_matrix
+    genome_order : list
+        Genome names corresponding to columns of both matrices
+    '''
     
     ''' Load header-allele mappings '''
     print('Loadings header-allele mappings...')
-    header_to_allele = load_header_to_allele(clstr_file, 
-        shared_header_file, header_to_allele, cluster_type)
+    header_to_allele = load_header_to_allele(clstr_file, shared_header_file, 
+        header_to_allele, name=name, cluster_type=cluster_type)
                     
-    ''' Initialize gene and allele tables '''
+    ''' Initialize gene and allele orders '''
     genome_order = sorted([__get_genome_from_filename__(x) for x in genome_fasta_paths]) 
         # for genome names, trim .faa from filenames
     print('Sorting alleles...')
-    allele_order = sorted(list(set(header_to_allele.values())))
+    allele_order = [x.decode() for x in header_to_allele.alleles] # sorted, get_ids() indexes into this
     
     print('Sorting clusters...')
     gene_order = []; last_gene = None
-    for allele in tqdm(allele_order):
+    allele_to_gene_i = np.zeros(shape=len(allele_order), dtype='int64') # allele position to gene position
+    for allele_i, allele in enumerate(tqdm(allele_order)):
         gene = __get_gene_from_allele__(allele)
         if gene != last_gene:
             gene_order.append(gene)
             last_gene = gene
+        allele_to_gene_i[allele_i] = len(gene_order) - 1
     print('Genomes:', len(genome_order))
     print('Clusters:', len(gene_order))
     print('Alleles:', len(allele_order))
     
-    ''' To use sparse matrix, map genomes, alleles, and genes to positions '''
-    allele_indices = {allele_order[i]:i for i in range(len(allele_order))}
-    gene_indices = {gene_order[i]:i for i in range(len(gene_order))}   
-    allele_arrays = {} # maps genome:allele vectors as SparseArrays
-    gene_arrays = {} # maps genome:gene vector as SparseArrays
+    ''' Map genomes and headers directly to matrix positions '''
+    genome_indices = {genome_order[i]:i for i in range(len(genome_order))}
+    allele_coords = [] # allele positions per genome
+    genome_coords = [] # genome position per allele position
 
     ''' Scan original genome file for allele and gene membership '''
     for i, genome_fasta in enumerate(sorted(genome_fasta_paths)):
         genome = __get_genome_from_filename__(genome_fasta)
-        genome_i = genome_order.index(genome)
-        allele_arrays[genome] = np.zeros(shape=len(allele_order), dtype='int64')
-        gene_arrays[genome] = np.zeros(shape=len(gene_order), dtype='int64')
-        with open(genome_fasta, 'r') as f_fasta:
-            header = ''; seq = '' # track the sequence to skip over empty sequences
-            for line in f_fasta.readlines(): # pre-load, slight speed-up
-                ''' Load all alleles and genes per genome '''
-                if line[0] == '>': # new header line encountered
-                    if len(seq) > 0:
-                        if header in header_to_allele:
-                            allele_name = header_to_allele[header]
-                            allele_i = allele_indices[allele_name]
-                            allele_arrays[genome][allele_i] = 1
-                            gene = __get_gene_from_allele__(allele_name)
-                            gene_i = gene_indices[gene]
-                            gene_arrays[genome][gene_i] = 1
-                        else:
-                            print('MISSING:', header)
-                    header = __get_header_from_fasta_line__(line)
-                    seq = '' # reset sequence
-                else: # sequence line encountered
-                    seq += line.strip()
-            if len(seq) > 0: # process last record
-                if header in header_to_allele:
-                    allele_name = header_to_allele[header]
-                    allele_i = allele_indices[allele_name]
-                    allele_arrays[genome][allele_i] = 1
-                    gene = __get_gene_from_allele__(allele_name)
-                    gene_i = gene_indices[gene]
-                    gene_arrays[genome][gene_i] = 1
-                else:
-                    print('MISSING:', header)
-                
-        allele_arrays[genome] = pd.arrays.SparseArray(allele_arrays[genome])
-        gene_arrays[genome] = pd.arrays.SparseArray(gene_arrays[genome])
-        allele_arrays[genome].fill_value = np.nan
-        gene_arrays[genome].fill_value = np.nan
+        genome_i = genome_indices[genome]
+        ''' Load all alleles per genome, skipping empty sequences '''
+        headers = [header for header, _ in iter_fasta(genome_fasta, headers_only=True, short_headers=True)]
+        genome_alleles = header_to_allele.get_ids(headers) # allele positions, -1 if missing
+        for missing_i in np.flatnonzero(genome_alleles < 0):
+            print('MISSING:', headers[missing_i].decode())
+        genome_alleles = np.unique(genome_alleles[genome_alleles >= 0])
+        allele_coords.append(genome_alleles)
+        genome_coords.append(np.full(shape=len(genome_alleles), fill_value=genome_i, dtype='int64'))
         print('Updating genome', i+1, ':', genome, end=' ') 
-        print('\tAlleles:', allele_arrays[genome].sum(), '\tClusters:', gene_arrays[genome].sum())
-        
-    ''' Construct DataFrame '''
-    print('Building DataFrame...')
-    df_alleles = pd.DataFrame(data=allele_arrays, index=allele_order)
-    df_genes = pd.DataFrame(data=gene_arrays, index=gene_order)
-    return df_alleles, df_genes
+        print('\tAlleles:', len(genome_alleles), '\tClusters:', len(np.unique(allele_to_gene_i[genome_alleles])))
+    
+    ''' Assemble sparse matrices '''
+    print('Building sparse matrices...')
+    allele_coords = np.concatenate(allele_coords) if allele_coords else np.zeros(0, dtype='int64')
+    genome_coords = np.concatenate(genome_coords) if genome_coords else np.zeros(0, dtype='int64')
+    allele_matrix = scipy.sparse.csc_matrix(
+        (np.ones(shape=len(allele_coords), dtype='int8'), (allele_coords, genome_coords)),
+        shape=(len(allele_order), len(genome_order)))
+    gene_indicator = scipy.sparse.csr_matrix( # gene x allele membership
+        (np.ones(shape=len(allele_order), dtype='int32'), (allele_to_gene_i, np.arange(len(allele_order)))),
+        shape=(len(gene_order), len(allele_order)))
+    gene_matrix = (gene_indicator @ allele_matrix.astype('int32')).tocsc()
+    gene_matrix.data = np.ones(shape=len(gene_matrix.data), dtype='int8') # alleles per gene > 0
+    gene_matrix = gene_matrix.astype('int8')
+    gene_matrix.eliminate_zeros()
+    return allele_matrix, gene_matrix, allele_order, gene_order, genome_order
 
 
 def load_header_to_allele(clstr_file=None, shared_header_file=None, 
-                          header_to_allele=None, name='Test', cluster_type='cds'):
+                          header_to_allele=None, name='Test', cluster_type='cds',
+                          seq_store=None):
     '''
     Loads a mapping from original fasta headers to allele names format 
     <name>_C#A# for genes or <name>_T#A# for noncoding features.
@@ -748,7 +1156,7 @@ def load_header_to_allele(clstr_file=None, shared_header_file=None,
     shared_header_file : str
         Path to shared header TSV file, if synonym headers are not mapped
         in header_to_allele or header_to_allele is not provided (default None)
-    header_to_allele : dict
+    header_to_allele : HeaderAlleleMap or dict
         Pre-calculated header-allele mappings corresponding to clstr_file,
         if available from rename_genes_and_alleles (default None)
     name : str
@@ -756,47 +1164,53 @@ def load_header_to_allele(clstr_file=None, shared_header_file=None,
     cluster_type : str
         If 'cds', features are named <name>_C#A# for gene clusters/alleles. 
         If 'noncoding', features are named <name>_T#A# for transcripts (default 'cds')
+    seq_store : pyphylon.seqstore.SequenceStore
+        If provided with alleles recorded by rename_genes_and_alleles(), header-allele
+        mappings are loaded from the store instead of clstr_file, including all
+        headers sharing the same sequence (default None)
         
     Returns
     -------
-    full_header_to_allele : dict
+    full_header_to_allele : HeaderAlleleMap
         Full header-allele mappings combining contents of both header_to_allele 
-        (copied or built from clstr_file) and shared_header_file.
-    '''
-    
-    ''' Load header to allele mapping from CLSTR, if not provided '''
-    if header_to_allele is None:
-        full_header_to_allele = {} # maps representative header to allele name (name_C#A#)
-        with open(clstr_file, 'r') as f_clstr:
-            for line in f_clstr:
-                if line[0] == '>': # starting new gene cluster
-                    cluster_num = line.split()[-1].strip() # cluster number as string
-                    max_cluster = cluster_num
-                else: # adding allele to cluster
-                    data = line.split()
-                    allele_num = data[0] # allele number as string
-                    allele_header = data[2][1:-3] # old allele header
-                    allele_name = create_feature_name(name, cluster_type, cluster_num, 'allele', allele_num)
-                    full_header_to_allele[allele_header] = allele_name
-    elif type(header_to_allele) == dict:
-        full_header_to_allele = header_to_allele.copy()
+        (converted or built from clstr_file) and shared_header_file.
+    '''
+    
+    ''' Load header to allele mapping from sequence store or CLSTR, if not provided '''
+    allele_label = __get_allele_label__(name, cluster_type)
+    if header_to_allele is None and (not seq_store is None) and seq_store.has_alleles(allele_label):
+        full_header_to_allele = seq_store.get_header_to_allele(allele_label)
+    elif header_to_allele is None:
+        clstr = read_clstr(clstr_file) # maps representative header to allele name (name_C#A#)
+        full_header_to_allele = HeaderAlleleMap(clstr['header'], __get_clstr_allele_names__(clstr, name, cluster_type))
+    elif isinstance(header_to_allele, HeaderAlleleMap): # read-only, no copy needed
+        full_header_to_allele = header_to_allele
+    elif isinstance(header_to_allele, collections.abc.Mapping):
+        full_header_to_allele = HeaderAlleleMap(header_to_allele.keys(), header_to_allele.values())
     
     ''' Load headers that share the same sequence '''
     if shared_header_file:
+        repr_headers = []; alt_headers = []; alt_counts = []
         with open(shared_header_file, 'r') as f_header:
             for line in f_header:
                 headers = [x.strip() for x in line.split('\t')]
                 if len(headers) > 1:
-                    repr_header = headers[0]
-                    repr_allele = full_header_to_allele[repr_header]
-                    for alt_header in headers[1:]:
-                        full_header_to_allele[alt_header] = repr_allele
+                    repr_headers.append(headers[0])
+                    alt_headers += headers[1:]
+                    alt_counts.append(len(headers) - 1)
+        repr_alleles = full_header_to_allele.get_many(repr_headers) # batch lookup
+        for repr_header, repr_allele in zip(repr_headers, repr_alleles):
+            if repr_allele is None:
+                raise KeyError(repr_header)
+        alt_alleles = [allele for allele, count in zip(repr_alleles, alt_counts) for _ in range(count)]
+        full_header_to_allele = full_header_to_allele.with_entries(alt_headers, alt_alleles)
     return full_header_to_allele
 
 
 def build_upstream_pangenome(genome_data, allele_names, output_dir, limits=(-50,3), 
                              name='Test', include_fragments=False, max_overlap=-1, 
-                             fastasort_path=None, save_csv=True):
+                             fastasort_path=None, save_csv=True, n_jobs=1, extract=True,
+                             save_table=True):
     '''
     Extracts nucleotides upstream of coding sequences for multiple genomes, 
     create <genome>_upstream.fna files in the same directory for each genome.
@@ -806,12 +1220,14 @@ def build_upstream_pangenome(genome_data, allele_names, output_dir, limits=(-50,
     return build_proximal_pangenome(
         genome_data, allele_names, output_dir, limits, 
         side='upstream', name=name, include_fragments=include_fragments, 
-        max_overlap=max_overlap, fastasort_path=fastasort_path, save_csv=save_csv)
+        max_overlap=max_overlap, fastasort_path=fastasort_path, save_csv=save_csv,
+        n_jobs=n_jobs, extract=extract, save_table=save_table)
     
 
 def build_downstream_pangenome(genome_data, allele_names, output_dir, limits=(-3,50), 
                                name='Test', include_fragments=False, max_overlap=-1, 
-                               fastasort_path=None, save_csv=True):
+                               fastasort_path=None, save_csv=True, n_jobs=1, extract=True,
+                               save_table=True):
     '''
     Extracts nucleotides downstream of coding sequences for multiple genomes, 
     create <genome>_downstream.fna files in the same directory for each genome.
@@ -821,11 +1237,13 @@ def build_downstream_pangenome(genome_data, allele_names, output_dir, limits=(-3
     return build_proximal_pangenome(
         genome_data, allele_names, output_dir, limits, 
         side='downstream', name=name, include_fragments=include_fragments, 
-        max_overlap=max_overlap, fastasort_path=fastasort_path, save_csv=save_csv)
+        max_overlap=max_overlap, fastasort_path=fastasort_path, save_csv=save_csv,
+        n_jobs=n_jobs, extract=extract, save_table=save_table)
 
     
 def build_proximal_pangenome(genome_data, allele_names, output_dir, limits, side, name='Test', 
-                             include_fragments=False, max_overlap=-1, fastasort_path=None, save_csv=True):
+                             include_fragments=False, max_overlap=-1, fastasort_path=None, save_csv=True,
+                             n_jobs=1, extract=True, save_table=True):
     '''
     Extracts nucleotides proximal to coding sequences for multiple genomes, 
     create genome-specific proximal sequence fna files in the same directory for each genome.
@@ -859,11 +1277,22 @@ def build_proximal_pangenome(genome_data, allele_names, output_dir, limits, side
         of other genes such that the overlap is no more than <max_overlap> nts.
         If negative, does not truncate UTRs s.t. all UTRs same length (default -1)
     fastasort_path : str
-        Path to Exonerate's fastasort binary, optionally for sorting
-        final FNA files (default None)
+        Path to Exonerate's fastasort binary, optionally for sorting final FNA 
+        files instead of the built-in sort, see fasta.sort_fasta (default None)
     save_csv : bool
-        If true, saves allele and gene tables as csv.gz. May be limiting
+        If true, saves allele and gene tables as long-format csv.gz. May be limiting
         step for very large tables (default True)
+    save_table : bool
+        If true, also saves allele and gene tables in native format (.table directories,
+        see save_feature_table) for fast partial loading (default True)
+    n_jobs : int
+        Number of processes used to extract proximal sequences from genomes in 
+        parallel. Workers share the header-allele mapping without copying it per 
+        genome. If -1, uses all available cores (default 1)
+    extract : bool
+        If true, extracts proximal sequences from each genome. Otherwise, reuses
+        <genome>_<side>.fna files previously extracted with the same parameters, 
+        i.e. by extract_pangenome_features() (default True)
         
     Returns
     -------
@@ -876,26 +1305,20 @@ def build_proximal_pangenome(genome_data, allele_names, output_dir, limits, side
     feature_to_allele = __load_feature_to_allele__(allele_names)
         
     ''' Generate proximal sequences '''
-    print('Extracting', side, 'sequences...')
-    genome_proximals = []
+    genome_proximals = []; extraction_tasks = []
     for i, gff_fna in enumerate(genome_data):
         ''' Prepare output path '''
         genome_gff, genome_fna = gff_fna
         genome = __get_genome_from_filename__(genome_gff)
-        genome_dir = '/'.join(genome_gff.split('/')[:-1]) + '/' if '/' in genome_gff else ''
-        genome_prox_dir = genome_dir + 'derived/'
-        if not os.path.exists(genome_prox_dir):
-            os.mkdir(genome_prox_dir)
-        genome_prox = genome_prox_dir + genome + '_' + side + '.fna'
-            
-        ''' Extract proximal sequences '''
-        print(i+1, genome)
+        genome_prox = __get_derived_path__(genome_gff, side)
         genome_proximals.append(genome_prox)
-        extract_proximal_sequences(genome_gff, genome_fna, genome_prox, 
-                                   limits=limits, side=side,
-                                   feature_to_allele=feature_to_allele,
-                                   include_fragments=include_fragments,
-                                   max_overlap=max_overlap)
+        extraction_tasks.append((genome, (genome_gff, genome_fna, genome_prox, limits, max_overlap, side)))
+            
+    ''' Extract proximal sequences '''
+    if extract:
+        print('Extracting', side, 'sequences...')
+        __map_genomes__(extract_proximal_sequences, extraction_tasks, n_jobs=n_jobs, 
+                        shared={'feature_to_allele':feature_to_allele, 'include_fragments':include_fragments})
         
     ''' Consolidate non-redundant proximal sequences per gene '''
     print('Identifying non-redundant', side, 'sequences per gene...')
@@ -903,24 +1326,22 @@ def build_proximal_pangenome(genome_data, allele_names, output_dir, limits, side
     nr_prox_out = nr_prox_out.replace('//','/')
     df_proximal = consolidate_proximal(genome_proximals, nr_prox_out, feature_to_allele, side)
     
-    ''' Optionally sort non-redundant proximal sequences file '''
-    if fastasort_path:
-        print('Sorting sequences by header...')
+    ''' Sort non-redundant proximal sequences file, with exonerate.fastasort if available '''
+    print('Sorting sequences by header...')
+    if not fastasort_path:
+        sort_fasta(nr_prox_out, nr_prox_out)
+    else:
         args = ['./' + fastasort_path, nr_prox_out]
         with open(nr_prox_out + '.tmp', 'w+') as f_sort:
             sp.call(args, stdout=f_sort)
         os.rename(nr_prox_out + '.tmp', nr_prox_out)
+        if os.path.exists(nr_prox_out + '.fai'): # index from an earlier sort_fasta() no longer matches
+            os.remove(nr_prox_out + '.fai')
         
     ''' Save proximal x genome table '''
     prox_table_out = output_dir + '/' + name + '_strain_by_' + side
     prox_table_out = prox_table_out.replace('//','/')
-    prox_table_pickle = prox_table_out + '.pickle.gz'
-    prox_table_csv = prox_table_out + '.csv.gz'
-    print('Saving', prox_table_pickle, '...')
-    df_proximal.to_pickle(prox_table_pickle)
-    if save_csv:
-        print('Saving', prox_table_csv, '...')
-        df_proximal.to_csv(prox_table_csv)
+    __save_feature_table__(df_proximal, prox_table_out, save_csv, save_table)
     return df_proximal
 
     
@@ -953,6 +1374,7 @@ def consolidate_proximal(genome_proximals, nr_proximal_out, feature_to_allele, s
     genome_to_proximal = {} # maps genome:proximal_name:1 if present (<name>_C#U# or <name>_C#D#)
     unique_proximal_ids = set() # record non-redundant list of proximal sequence IDs <name>_C#U# or <name>_C#D#
     genome_order = [] # sorted list of genomes inferred from proximal sequence file names
+    new_sequence = False # if the current proximal sequence is new for its gene
     
     with open(nr_proximal_out, 'w+') as f_nr_prox:
         for genome_proximal in sorted(genome_proximals):
@@ -962,39 +1384,20 @@ def consolidate_proximal(genome_proximals, nr_proximal_out, feature_to_allele, s
             genome_to_proximal[genome] = {}
             genome_order.append(genome)
             
-            ''' Process genome's proximal record '''
-            with open(genome_proximal, 'r') as f_prox: # reading current proximal seq file
-                header = ''; prox_seq = ''; new_sequence = False
-                for line in f_prox.readlines(): # slight speed up reading whole file at once, should only be few MBs
-                    if line[0] == '>': # header line
-                        if len(prox_seq) > 0:
-                            ''' Process header-seq to non-redundant <name>_C#<U/D># proximal allele '''
-                            feature = header.split('_' + side + '(')[0] # trim off "_<up/down>stream" footer
-                            allele = feature_to_allele[feature] # get <name>_C#A# allele
-                            gene = __get_gene_from_allele__(allele) # gene <name>_C# gene
-                            if not gene in gene_to_unique_proximal:
-                                gene_to_unique_proximal[gene] = {}
-                            if not prox_seq in gene_to_unique_proximal[gene]:
-                                gene_to_unique_proximal[gene][prox_seq] = len(gene_to_unique_proximal[gene])
-                                prox_id = gene + ftype_abb + str(gene_to_unique_proximal[gene][prox_seq])
-                                unique_proximal_ids.add(prox_id)
-                                new_sequence = True
-                            prox_id = gene + ftype_abb + str(gene_to_unique_proximal[gene][prox_seq])
-                            genome_to_proximal[genome][prox_id] = 1
-                            
-                            ''' Write renamed sequence to running file '''
-                            if new_sequence:
-                                f_nr_prox.write('>' + prox_id + '\n')
-                                f_nr_prox.write(prox_seq + '\n')
-                                new_sequence = False
-
-                        header = line[1:].strip(); prox_seq = ''
-                    else: # sequence line
-                        prox_seq += line.strip()
+            ''' Look up <name>_C#A# alleles of the genome's proximal records at once '''
+            records = list(iter_fasta(genome_proximal, decode=True))
+            footer = '_' + side + '(' # trim off "_<up/down>stream" footer from headers
+            features = [header.split(footer)[0] for header, _ in records]
+            if isinstance(feature_to_allele, HeaderAlleleMap): # batch lookup
+                alleles = feature_to_allele.get_many(features)
+                if None in alleles:
+                    raise KeyError(features[alleles.index(None)])
+            else:
+                alleles = [feature_to_allele[x] for x in features]
             
-                ''' Process last record'''
-                feature = header.split('_' + side + '(')[0] # trim off "_<up/down>stream" footer
-                allele = feature_to_allele[feature] # get <name>_C#A# allele
+            ''' Process genome's proximal records '''
+            for (header, prox_seq), allele in zip(records, alleles):
+                ''' Process header-seq to non-redundant <name>_C#<U/D># proximal allele '''
                 gene = __get_gene_from_allele__(allele) # gene <name>_C# gene
                 if not gene in gene_to_unique_proximal:
                     gene_to_unique_proximal[gene] = {}
@@ -1065,7 +1468,8 @@ def extract_proximal_sequences(genome_gff, genome_fna, proximal_out, limits, max
     Output features are named "<feature header>_<up/down>stream(<limit1>,<limit2>)" 
     if overlap is not restricted, otherwise features are named:
     "<feature header>_<up/down>stream(<limit1>,<limit2>,<max_overlap>)"
-    Excludes features that do not have any UTR bases.
+    Excludes features that do not have any UTR bases. To extract several
+    feature types from the same genome at once, see extract_genome_features().
         
     Parameters
     ----------
@@ -1098,114 +1502,12 @@ def extract_proximal_sequences(genome_gff, genome_fna, proximal_out, limits, max
         If true, include upstream sequences that are not fully available 
         due to contig boundaries (default False)
     '''
-
-    def extract_utr(start, stop, strand, contig, contig_seq, occupancy):
-        ''' Calculate ideal bounds for UTR, without accounting for overlap '''
-        pos = (side, strand)
-        utr_side = start if pos in [('upstream','+'),('downstream','-')] else stop # side UTR effectively starts from
-        utr_limits = limits if strand == '+' else (-limits[1], -limits[0]) # how to extend UTR bounds
-        utr_start = utr_side + utr_limits[0]
-        utr_stop = utr_side + utr_limits[1]
-        
-        ''' Optionally account for overlap '''
-        if max_overlap >= 0: # checking CDS-UTR overlaps
-            leftbound, rightbound = strand_occupancy[contig][strand][(start, stop)]
-            leftbound -= max_overlap
-            rightbound += max_overlap
-            if utr_start < leftbound: # 5' overlap exceeds limit
-                utr_start = leftbound
-                #print 'UTR start overlap for', start, stop
-            if utr_stop > rightbound: # 3' overlap exceeds limit
-                utr_stop = rightbound
-                #print 'UTR stop overlap for', start, stop
-            
-        ''' Extract UTR from computed bounds, RC if negative strand '''
-        proximal = contig_seq[utr_start:utr_stop].strip()
-        proximal = reverse_complement(proximal) if strand == '-' else proximal
-        is_fragment = (utr_start < 0) or (utr_stop > len(contig_seq)) # if cut-off by contig bounds
-        return proximal, is_fragment
-    
-    
-    strand_occupancy = {} # maps contig:strand:(start,stop):[(left start,stop), (right start,stop)]
-    if max_overlap >= 0:   
-        ''' Load feature order on each contig and each strand '''
-        occupancies = {}
-        with open(genome_gff, 'r') as f_gff:
-            for line in f_gff:
-                line = line.strip()
-                if len(line) > 0 and line[0] != '#':
-                    contig, src, feat_type, start, stop, score, \
-                        strand, phase, attr_raw = line.split('\t')
-                    if feat_type == 'CDS': # only consider CDS-UTR overlaps
-                        contig = contig.split('|')[-1] # accn|<contig> to just <contig>
-                        if not contig in occupancies:
-                            occupancies[contig] = {'+':[], '-':[]}
-                        start = int(start) - 1 # starts are 1-indexed
-                        stop = int(stop) # stops 1-indexed, inclusive = correct exclusive bound
-                        occupancies[contig][strand].append( (start, stop) )
-                         
-        ''' Convert feature order to 5'/3' neighbors pairs '''
-        for contig in occupancies:
-            strand_occupancy[contig] = {'+':{}, '-':{}}
-            for strand in occupancies[contig]:
-                n_features = len(occupancies[contig][strand])
-                for i, feature in enumerate(occupancies[contig][strand]): # features in order on strand
-                    leftbound = (-np.inf,-np.inf) if i == 0 else occupancies[contig][strand][i-1]
-                    rightbound = (np.inf,np.inf) if i == n_features-1 else occupancies[contig][strand][i+1]
-                    leftbound = leftbound[1] # take 3' end of nearest CDS to the 5' side
-                    rightbound = rightbound[0] # take 5' end of nearest CDS to the 3' end
-                    strand_occupancy[contig][strand][feature] = (leftbound, rightbound) 
-        del occupancies
-                        
-    ''' Load contig sequences '''
-    contigs = load_sequences_from_fasta(genome_fna, header_fxn=lambda x: x.split()[0])
-            
-    ''' Load header-allele name mapping '''
-    if feature_to_allele: # dictionary provided directly
-        feat_to_allele = feature_to_allele
-    elif allele_names: # allele map file provided
-        feat_to_allele = __load_feature_to_allele__(allele_names)
-    else: # no allele mapping, process everything
-        feat_to_allele = None
-                    
-    ''' Parse GFF file for CDS coordinates '''
-    feature_footer = '_' + side
-    params = (limits[0], limits[1], max_overlap) if max_overlap >= 0 else limits
-    feature_footer += str(params).replace(' ','')
-    proximal_count = 0 # total UTRs extracted
-    coding_length = limits[1] if side == 'upstream' else -limits[0] # bases of UTR that overlap with reference gene CDS
-    with open(proximal_out, 'w+') as f_prox:
-        with open(genome_gff, 'r') as f_gff:
-            for line in f_gff:
-                line = line.strip()
-                if len(line) > 0 and line[0] != '#':
-                    contig, src, feat_type, start, stop, score, \
-                        strand, phase, attr_raw = line.split('\t')
-                    contig = contig.split('|')[-1] # accn|<contig> to just <contig>
-                    start = int(start) - 1 # starts are 1-indexed, inclusive
-                    stop = int(stop) # stops 1-indexed, inclusive = correct exclusive bound
-                    attrs = {} # key:value
-                    for entry in attr_raw.split(';'):
-                        k,v = entry.split('='); attrs[k] = v
-                    gffid = attrs['ID']
-
-                    ''' Verify allele has been mapped, and contig has been identified '''
-                    if contig in contigs: 
-                        if gffid in feat_to_allele or feat_to_allele is None:
-                            try:
-                                contig_seq = contigs[contig]
-                            except KeyError:
-                                continue
-                            proximal, is_fragment = extract_utr(start, stop, strand, contig, contig_seq, strand_occupancy)
-                                
-                            ''' Save proximal sequence '''
-                            if len(proximal) > coding_length and (not is_fragment or include_fragments):
-                                feat_name = gffid + feature_footer
-                                f_prox.write('>' + feat_name + '\n')
-                                f_prox.write(proximal + '\n')
-                                proximal_count += 1
-                                
-    print('Loaded', side, 'sequences:', proximal_count)
+    proximal_args = {'upstream_out':None, 'downstream_out':None}
+    proximal_args[side + '_out'] = proximal_out
+    proximal_args[side + '_limits'] = limits
+    extract_genome_features(genome_gff, genome_fna, max_overlap=max_overlap, 
+                            feature_to_allele=feature_to_allele, allele_names=allele_names,
+                            include_fragments=include_fragments, **proximal_args)
 
     
 def extract_noncoding(genome_gff, genome_fna, noncoding_out, flanking=(0,0),
@@ -1216,6 +1518,8 @@ def extract_noncoding(genome_gff, genome_fna, noncoding_out, flanking=(0,0),
         1) Assumes contigs are labeled "accn|<contig>". 
         2) Assumes protein features have ".peg." in the ID
         3) Assumes ID = fig|<genome>.peg.#
+    To extract several feature types from the same genome at once, 
+    see extract_genome_features().
         
     Parameters
     ----------
@@ -1234,42 +1538,227 @@ def extract_noncoding(genome_gff, genome_fna, noncoding_out, flanking=(0,0),
         features labeled "CDS" or "repeat_region" 
         (default ['transcript', 'tRNA', 'rRNA', 'misc_binding'])
     '''
-    contigs = load_sequences_from_fasta(genome_fna, header_fxn=lambda x:x.split()[0])
-    with open(noncoding_out, 'w+') as f_noncoding:
-        with open(genome_gff, 'r') as f_gff:
-            for line in f_gff:
-                ''' Check for non-comment and non-empty line '''
-                if not line[0] == '#' and not len(line.strip()) == 0: 
-                    contig, src, feature_type, start, stop, \
-                        score, strand, phase, meta = line.split('\t')
-                    contig = contig[5:] # trim off "accn|" header
-                    start = int(start)
-                    stop = int(stop)
-                    
-                    if feature_type in allowed_features: 
-                        ''' Get noncoding feature sequence and ID '''
-                        contig_seq = contigs[contig]
-                        fstart = start - 1 - flanking[0]
-                        fstart = max(0,fstart) # avoid looping due to contig boundaries
-                        fstop = stop + flanking[1]
-                        feature_seq = contig_seq[fstart:fstop]
-                        if strand == '-': # negative strand
-                            feature_seq = reverse_complement(feature_seq)
-                        meta_key_vals = [x.split('=') for x in meta.split(';')]
-                        metadata = {x[0]:x[1] for x in meta_key_vals}
-                        feature_id = metadata['ID']
-                        
-                        ''' Save to output file '''
-                        feature_seq = '\n'.join(feature_seq[i:i+70] for i in range(0, len(feature_seq), 70))
-                        f_noncoding.write('>' + feature_id + '\n')
-                        f_noncoding.write(feature_seq + '\n') 
+    extract_genome_features(genome_gff, genome_fna, noncoding_out=noncoding_out,
+                            noncoding_flanking=flanking, noncoding_features=allowed_features)
+
 
+def extract_genome_features(genome_gff, genome_fna, coding_out=None, upstream_out=None, 
+                            downstream_out=None, noncoding_out=None, 
+                            coding_features=['CDS', 'tRNA'], upstream_limits=(-50,3), 
+                            downstream_limits=(-3,50), max_overlap=-1, include_fragments=False,
+                            noncoding_flanking=(0,0), 
+                            noncoding_features=['transcript', 'tRNA', 'rRNA', 'misc_binding'],
+                            feature_to_allele=None, allele_names=None):
+    '''
+    Extracts coding, upstream, downstream and/or non-coding nucleotide sequences 
+    from a genome in a single pass. The GFF is parsed and contigs are loaded once, 
+    CDS neighbors for max_overlap are computed once for both upstream and downstream
+    sequences, and all requested FNA files are written together. Each output matches
+    that of extract_coding_fna(), extract_upstream_sequences(), extract_downstream_sequences()
+    and extract_noncoding() respectively, which are wrappers for this function. 
+    Outputs left as None are not extracted.
+    
+    Parameters
+    ----------
+    genome_gff : str
+        Path to genome GFF file with feature coordinates
+    genome_fna : str
+        Path to genome FNA file with contig nucleotides
+    coding_out : str
+        Path to output coding sequences FNA, see extract_coding_fna() (default None)
+    upstream_out : str
+        Path to output upstream sequences FNA, see extract_proximal_sequences() (default None)
+    downstream_out : str
+        Path to output downstream sequences FNA, see extract_proximal_sequences() (default None)
+    noncoding_out : str
+        Path to output non-coding sequences FNA, see extract_noncoding() (default None)
+    coding_features : list
+        GFF feature types written to coding_out (default ['CDS', 'tRNA'])
+    upstream_limits : 2-tuple
+        Length of upstream region to extract, formatted (-X,Y) (default (-50,3))
+    downstream_limits : 2-tuple
+        Length of downstream region to extract, formatted (-X,Y) (default (-3,50))
+    max_overlap : int
+        If non-negative, truncates UTRs that cross over into coding sequences
+        of other genes such that the overlap is no more than <max_overlap> nts.
+        If negative, does not truncate UTRs s.t. all UTRs same length (default -1)
+    include_fragments : bool
+        If true, include upstream/downstream sequences that are not fully 
+        available due to contig boundaries (default False)
+    noncoding_flanking : tuple
+        (X,Y) where X = number of nts to include from 5' end of feature,
+        and Y = number of nts to include from 3' end feature for noncoding_out (default (0,0))
+    noncoding_features : list
+        GFF feature types written to noncoding_out 
+        (default ['transcript', 'tRNA', 'rRNA', 'misc_binding'])
+    feature_to_allele : dict
+        Dictionary mapping original feature headers to <name>_C#A# short names,
+        limits upstream/downstream sequences to mapped features (default None)
+    allele_names : str
+        Path to allele names file if feature_to_allele is not provided. If neither are 
+        provided, upstream/downstream sequences are extracted for all features (default None)
+        
+    Returns
+    -------
+    feature_counts : dict
+        Maps each extracted output type ('coding', 'upstream', 'downstream', 
+        'noncoding') to the number of sequences written
+    '''
+    
+    def extract_spans(allowed_features, flanking):
+        ''' Extract features with flanking bases, RC if negative strand, wrapped at 70 nts '''
+        selected = np.flatnonzero(np.isin(feat_types, allowed_features))
+        fstarts = np.maximum(starts[selected] - flanking[0], 0) # avoid looping due to contig boundaries
+        fstops = stops[selected] + flanking[1]
+        feature_seqs = contigs.extract(contig_ids[selected], fstarts, fstops, reverse=is_minus[selected])
+        feature_seqs = ['\n'.join(x[i:i+70] for i in range(0, len(x), 70)) for x in feature_seqs]
+        return [gffids[i] for i in selected], feature_seqs
+    
+    def extract_utrs(side, limits):
+        ''' Extract UTRs of mapped features, named <ID>_<side>(<limits>[,<max_overlap>]) '''
+        if feat_to_allele is None:
+            selected = np.arange(len(gffids))
+        elif isinstance(feat_to_allele, HeaderAlleleMap): # batch lookup
+            selected = np.flatnonzero(feat_to_allele.get_ids(gffids) >= 0)
+        else:
+            selected = np.flatnonzero(np.array([x in feat_to_allele for x in gffids], dtype='bool'))
+        is_plus = strands[selected] == '+'
+        
+        ''' Calculate ideal bounds for UTR, without accounting for overlap '''
+        from_start = is_plus if side == 'upstream' else is_minus[selected] # side UTR effectively starts from
+        utr_side = np.where(from_start, starts[selected], stops[selected])
+        utr_start = utr_side + np.where(is_plus, limits[0], -limits[1]) # how to extend UTR bounds
+        utr_stop = utr_side + np.where(is_plus, limits[1], -limits[0])
+        
+        ''' Optionally account for overlap '''
+        if max_overlap >= 0: # checking CDS-UTR overlaps, non-CDS features are unbounded
+            bounds = [strand_occupancy.get((contig, strand, start, stop), (-np.inf, np.inf)) 
+                      for contig, _, start, stop, strand, _ in (features[i] for i in selected)]
+            bounds = np.array(bounds, dtype='float64').reshape(-1, 2)
+            utr_start = np.maximum(utr_start, bounds[:,0] - max_overlap).astype('int64') # 5' overlap exceeds limit
+            utr_stop = np.minimum(utr_stop, bounds[:,1] + max_overlap).astype('int64') # 3' overlap exceeds limit
+        
+        ''' Keep UTRs with non-coding bases, optionally including those cut-off by contig bounds '''
+        contig_lengths = contigs.lengths[contig_ids[selected]]
+        is_fragment = (utr_start < 0) | (utr_stop > contig_lengths)
+        utr_lengths = np.clip(utr_stop, 0, contig_lengths) - np.clip(utr_start, 0, contig_lengths)
+        coding_length = limits[1] if side == 'upstream' else -limits[0] # bases of UTR that overlap with reference gene CDS
+        is_kept = (utr_lengths > coding_length) & (include_fragments | ~is_fragment)
+        selected = selected[is_kept]
+        proximals = contigs.extract(contig_ids[selected], utr_start[is_kept], utr_stop[is_kept],
+                                    reverse=is_minus[selected])
+        feature_footer = '_' + side + str((limits[0], limits[1], max_overlap) if max_overlap >= 0 else limits)
+        feature_footer = feature_footer.replace(' ','')
+        return [gffids[i] + feature_footer for i in selected], proximals
+    
+    ''' Prepare requested outputs as (type, path, extractor, extractor args) '''
+    outputs = []
+    if coding_out:
+        outputs.append(('coding', coding_out, extract_spans, (coding_features, (0,0))))
+    if upstream_out:
+        outputs.append(('upstream', upstream_out, extract_utrs, ('upstream', upstream_limits)))
+    if downstream_out:
+        outputs.append(('downstream', downstream_out, extract_utrs, ('downstream', downstream_limits)))
+    if noncoding_out:
+        outputs.append(('noncoding', noncoding_out, extract_spans, (noncoding_features, noncoding_flanking)))
+    if len(outputs) == 0:
+        return {}
+    
+    ''' Parse GFF and load contig sequences once for all outputs '''
+    contigs = ContigStore(genome_fna)
+    features = [x for x in __load_gff_features__(genome_gff) if x[0] in contigs] # skip unidentified contigs
+    has_proximal = bool(upstream_out or downstream_out)
+    strand_occupancy = __get_strand_occupancy__(features) if has_proximal and max_overlap >= 0 else {}
+    contig_ids = np.array([contigs.index[x[0]] for x in features], dtype='int64')
+    feat_types = np.array([x[1] for x in features], dtype='object')
+    starts = np.array([x[2] for x in features], dtype='int64')
+    stops = np.array([x[3] for x in features], dtype='int64')
+    strands = np.array([x[4] for x in features], dtype='object')
+    is_minus = strands == '-'
+    gffids = [x[5] for x in features]
     
+    ''' Load header-allele name mapping '''
+    if feature_to_allele: # dictionary provided directly
+        feat_to_allele = feature_to_allele
+    elif allele_names and has_proximal: # allele map file provided
+        feat_to_allele = __load_feature_to_allele__(allele_names)
+    else: # no allele mapping, process everything
+        feat_to_allele = None
+        
+    ''' Extract and write all requested feature sequences '''
+    feature_counts = {}
+    for feature_type, out_path, extractor, extractor_args in outputs:
+        headers, seqs = extractor(*extractor_args)
+        with open(out_path, 'w+') as f_out:
+            f_out.write(''.join('>' + header + '\n' + seq + '\n' for header, seq in zip(headers, seqs)))
+        feature_counts[feature_type] = len(headers)
+        if feature_type in ['upstream', 'downstream']:
+            print('Loaded', feature_type, 'sequences:', feature_counts[feature_type])
+    return feature_counts
+
+
+def extract_pangenome_features(genome_data, coding=True, upstream=True, downstream=True, 
+                               noncoding=True, n_jobs=1, **extract_args):
+    '''
+    Extracts coding, upstream, downstream and/or non-coding nucleotide sequences for
+    multiple genomes with extract_genome_features(), parsing each genome only once.
+    Creates <genome>_nuc_coding.fna, <genome>_upstream.fna, <genome>_downstream.fna and 
+    <genome>_noncoding.fna files in a derived/ directory next to each genome's GFF, the 
+    same files generated by build_cds_nucl_pangenome(), build_upstream_pangenome(), 
+    build_downstream_pangenome() and build_noncoding_pangenome(). These builders can 
+    then reuse the extracted sequences with extract=False.
+    
+    Parameters
+    ----------
+    genome_data : list
+        List of 2-tuples (genome_gff, genome_fna)
+    coding : bool
+        If true, extracts coding sequences (default True)
+    upstream : bool
+        If true, extracts upstream sequences (default True)
+    downstream : bool
+        If true, extracts downstream sequences (default True)
+    noncoding : bool
+        If true, extracts non-coding sequences (default True)
+    n_jobs : int
+        Number of processes used to extract sequences from genomes in 
+        parallel. If -1, uses all available cores (default 1)
+    **extract_args
+        Additional arguments for extract_genome_features(), i.e. limits,
+        max_overlap, feature_to_allele or allele_names
+        
+    Returns
+    -------
+    genome_feature_paths : dict
+        Maps each extracted output type ('coding', 'upstream', 'downstream', 
+        'noncoding') to the list of per-genome FNA paths, in genome_data order
+    '''
+    feature_types = [x for x, selected in [('coding', coding), ('upstream', upstream), 
+        ('downstream', downstream), ('noncoding', noncoding)] if selected]
+    if 'allele_names' in extract_args and not extract_args.get('feature_to_allele'):
+        extract_args['feature_to_allele'] = __load_feature_to_allele__(extract_args.pop('allele_names'))
+    
+    print('Extracting', ', '.join(feature_types), 'sequences...')
+    genome_feature_paths = {x:[] for x in feature_types}; extraction_tasks = []
+    for genome_gff, genome_fna in genome_data:
+        genome = __get_genome_from_filename__(genome_gff)
+        out_paths = {x:__get_derived_path__(genome_gff, x) for x in feature_types}
+        for feature_type in feature_types:
+            genome_feature_paths[feature_type].append(out_paths[feature_type])
+        extraction_tasks.append((genome, (genome_gff, genome_fna, out_paths.get('coding'), 
+            out_paths.get('upstream'), out_paths.get('downstream'), out_paths.get('noncoding'))))
+    __map_genomes__(extract_genome_features, extraction_tasks, n_jobs=n_jobs, shared=extract_args)
+    return genome_feature_paths
+
+
 def validate_gene_table(df_genes, df_alleles, log_group=1):
     '''
     Verifies that the gene x genome table is consistent with the
-    corresponding allele x genome table. Optimized to run column-by-column
-    rather than gene-by-gene for sparse tables.
+    corresponding allele x genome table, i.e. that each genome has a gene 
+    if and only if it has at least one of the gene's alleles. Computed with 
+    sparse matrix algebra: an allele-to-gene indicator matrix is multiplied 
+    with the allele table, and the result is compared to the gene table.
+    Works for both sparse and dense tables.
     
     Parameters
     ----------
@@ -1279,29 +1768,49 @@ def validate_gene_table(df_genes, df_alleles, log_group=1):
         Either the allele x genome table, or path to the table
     log_group : int
         Print message per this many genomes 
+        
+    Returns
+    -------
+    genome_inconsistencies : pd.Series
+        Number of inconsistent genes per genome
     '''
     dfg = load_feature_table(df_genes)
     dfa = load_feature_table(df_alleles)
     print('Validating gene clusters...')
-    num_inconsistencies = 0
-    for g,genome in enumerate(df_genes.columns):
+    
+    ''' Map alleles to genes, including genes missing from the gene table '''
+    allele_genes = [__get_gene_from_allele__(x) for x in dfa.index]
+    gene_order = list(dfg.index) + sorted(set(allele_genes).difference(dfg.index))
+    gene_indices = {gene:i for i, gene in enumerate(gene_order)}
+    indicator = scipy.sparse.csr_matrix(
+        (np.ones(len(allele_genes), dtype='int32'), ([gene_indices[x] for x in allele_genes], 
+        np.arange(len(allele_genes)))), shape=(len(gene_order), len(allele_genes)))
+    
+    ''' Compare genes implied by alleles to gene table '''
+    allele_matrix = _to_scipy_sparse(dfa.loc[:,dfg.columns], dtype='int32')
+    gene_matrix = _to_scipy_sparse(dfg, dtype='int32')
+    gene_matrix.resize((len(gene_order), gene_matrix.shape[1])) # genes only found by alleles
+    has_gene = (indicator @ allele_matrix) > 0
+    inconsistent = ((has_gene != (gene_matrix > 0))).tocsc()
+    genome_inconsistencies = pd.Series(np.diff(inconsistent.indptr), index=dfg.columns, 
+                                       name='inconsistencies')
+    
+    ''' Report inconsistent genes per genome '''
+    for g, genome in enumerate(dfg.columns):
         if (g+1) % log_group == 0:
             print(g+1, 'Testing', genome)
-        genes = set(dfg[genome].dropna().index)
-        alleles = dfa[genome].dropna().index
-        allele_genes = set(alleles.map(__get_gene_from_allele__))
-        if genes != allele_genes:
-            inconsistencies = genes.symmetric_difference(allele_genes)
-            print('\tInconsistent:', inconsistencies)
-            num_inconsistencies += len(inconsistencies)
-    print('Gene Table Inconsistencies:', num_inconsistencies) 
+        if genome_inconsistencies.iloc[g] > 0:
+            genome_slice = slice(inconsistent.indptr[g], inconsistent.indptr[g+1])
+            print('\tInconsistent:', set(gene_order[i] for i in inconsistent.indices[genome_slice]))
+    print('Gene Table Inconsistencies:', genome_inconsistencies.sum()) 
+    return genome_inconsistencies
 
 
 def validate_gene_table_dense(df_genes, df_alleles):
     '''
     Verifies that the gene x genome table is consistent with the
-    corresponding allele x genome table. Original approach for
-    when df_genes and df_alleles are dense DataFrames.
+    corresponding allele x genome table. Dense tables are now handled 
+    directly by validate_gene_table(), see there for details.
     
     Parameters
     ----------
@@ -1309,47 +1818,17 @@ def validate_gene_table_dense(df_genes, df_alleles):
         Either the gene x genome table, or path to the table
     df_alleles : pd.DataFrame or str
         Either the allele x genome table, or path to the table
+        
+    Returns
+    -------
+    genome_inconsistencies : pd.Series
+        Number of inconsistent genes per genome
     '''
-    dfg = load_feature_table(df_genes)
-    dfa = load_feature_table(df_alleles)
-    print('Validating gene clusters...')
-    
-    current_cluster = None; allele_data = []; 
-    clusters_tested = 0; inconsistencies = 0
-    for allele_row in dfa.fillna(0).itertuples(name=None):
-        cluster = __get_gene_from_allele__(allele_row[0])
-        if current_cluster is None: # initializing
-            current_cluster = cluster
-        elif current_cluster != cluster: # end of gene cluster
-            alleles_all = np.array(allele_data)
-            has_gene = alleles_all.sum(axis=0) > 0
-            is_consistent = np.array_equal(has_gene, dfg.loc[current_cluster,:].fillna(0).values)
-            clusters_tested += 1
-            if not is_consistent:
-                print('Inconsistent', cluster)
-                print(has_gene)
-                print(dfg.loc[current_cluster,:].fillna(0).values)
-                inconsistencies += 1
-            if clusters_tested % 1000 == 0:
-                print('\tTested', clusters_tested, 'clusters')
-            allele_data = []
-            current_cluster = cluster
-        allele_data.append(np.array(allele_row[1:]))
-    
-    ''' Process final line '''
-    alleles_all = np.array(allele_data) 
-    has_gene = alleles_all.sum(axis=0) > 0
-    is_consistent = np.array_equal(has_gene, dfg.loc[current_cluster,:].fillna(0).values)
-    if not is_consistent:
-        print('Inconsistent', cluster)
-        print(has_gene)
-        print(dfg.loc[current_cluster,:].fillna(0).values)
-        inconsistencies += 1
-    print('Gene Table Inconsistencies:', inconsistencies)
+    return validate_gene_table(df_genes, df_alleles)
     
 
 def validate_upstream_table(df_upstream, upstream_fna_paths, nr_upstream_fna,
-                            allele_names, log_group=1):
+                            allele_names, log_group=1, n_jobs=1, return_table=False):
     '''
     Verifies that the upstream x genome table is consistent with
     the corresponding extracted upstream sequences. See 
@@ -1368,15 +1847,19 @@ def validate_upstream_table(df_upstream, upstream_fna_paths, nr_upstream_fna,
         Path to allele names file generated by build_cds_pangenome()
     log_group : int
         Print message per this many genomes (default 1)
+    n_jobs : int
+        Number of processes used to validate genomes in parallel (default 1)
+    return_table : bool
+        If True, returns per-genome results as a DataFrame (default False)
     '''
     return validate_table_against_fasta(
         df_features=df_upstream, genome_fasta_paths=upstream_fna_paths, 
         features_fasta=nr_upstream_fna, allele_names=allele_names,
-        log_group=log_group)
+        log_group=log_group, n_jobs=n_jobs, return_table=return_table)
 
     
 def validate_downstream_table(df_downstream, downstream_fna_paths, nr_downstream_fna, 
-                              allele_names, log_group=1):
+                              allele_names, log_group=1, n_jobs=1, return_table=False):
     '''
     Verifies that the downstream x genome table is consistent with
     the corresponding extracted downstream sequences. See 
@@ -1395,15 +1878,19 @@ def validate_downstream_table(df_downstream, downstream_fna_paths, nr_downstream
         Path to allele names file generated by build_cds_pangenome()
     log_group : int
         Print message per this many genomes (default 1)
+    n_jobs : int
+        Number of processes used to validate genomes in parallel (default 1)
+    return_table : bool
+        If True, returns per-genome results as a DataFrame (default False)
     '''
     return validate_table_against_fasta(
         df_features=df_downstream, genome_fasta_paths=downstream_fna_paths, 
         features_fasta=nr_downstream_fna, allele_names=allele_names, 
-        log_group=log_group)
+        log_group=log_group, n_jobs=n_jobs, return_table=return_table)
     
     
 def validate_allele_table(df_alleles, genome_fasta_paths, 
-                          alleles_fasta, log_group=1):
+                          alleles_fasta, log_group=1, n_jobs=1, return_table=False):
     ''' 
     Verifies that the allele x genome table is consistent with the
     the corresponding fasta files. Originally validate_table_against_fasta().
@@ -1421,15 +1908,20 @@ def validate_allele_table(df_alleles, genome_fasta_paths,
         Either 'cds' or 'noncoding' depending on feature (default 'cds')
     log_group : int
         Print message per this many genomes (default 1)
+    n_jobs : int
+        Number of processes used to validate genomes in parallel (default 1)
+    return_table : bool
+        If True, returns per-genome results as a DataFrame (default False)
     '''
     return validate_table_against_fasta(
         df_features=df_alleles, genome_fasta_paths=genome_fasta_paths, 
-        features_fasta=alleles_fasta, allele_names=None, log_group=log_group)
+        features_fasta=alleles_fasta, allele_names=None, log_group=log_group, n_jobs=n_jobs, 
+        return_table=return_table)
     
 
 def validate_table_against_fasta(df_features, genome_fasta_paths, 
                                  features_fasta, allele_names=None, 
-                                 log_group=1):
+                                 log_group=1, n_jobs=1, return_table=False):
     '''
     Verifies that a table x genome table is consistent with the original 
     fasta files. Works for the following cases:
@@ -1438,6 +1930,12 @@ def validate_table_against_fasta(df_features, genome_fasta_paths,
     - CDS downstream table vs original upstream FNA files
     - Non-coding allele table vs original non-coding FNA files
     
+    Sequence (and feature name) digests are held in sorted arrays and 
+    looked up in batches with np.searchsorted. Genomes can be validated in 
+    parallel, with workers sharing the digest arrays. By default, genomes 
+    with inconsistencies are printed, otherwise per-genome results can be 
+    returned as a DataFrame with return_table.
+    
     Parameters
     ----------
     df_features : pd.DataFrame or str
@@ -1452,14 +1950,29 @@ def validate_table_against_fasta(df_features, genome_fasta_paths,
         downstream sequence validation due to conserved UTRs (default None).
     log_group : int
         Print message per this many genomes (default 1)
+    n_jobs : int
+        Number of processes used to validate genomes in parallel. 
+        If -1, uses all available cores (default 1)
+    return_table : bool
+        If True, returns per-genome results instead of printing inconsistent 
+        genomes (default False)
+        
+    Returns
+    -------
+    df_validation : pd.DataFrame
+        Only if return_table. Per-genome results, in order of sorted genome_fasta_paths, with columns
+        - table_only : number of features in the table, but not the genome fasta
+        - genome_only : number of features in the genome fasta, but not the table
+        - missing : number of genome fasta records without a non-redundant sequence
+        - consistent : True if the table and genome fasta have the same features
     '''
     dfa = load_feature_table(df_features)
-    inconsistencies = 0 # number of genomes with table-genome inconsistencies
     
     ''' Pre-load allele names if available '''
+    name_index = {}
     if allele_names: 
         print('Loading feature names...')
-        feathash_to_allele = {}
+        feature_digests = []; feature_genes = []
         with open(allele_names, 'r') as f:
             for line in f:
                 data = line.strip().split('\t')
@@ -1472,92 +1985,57 @@ def validate_table_against_fasta(df_features, genome_fasta_paths,
                         but may possibly break compatibility with non-PATRIC files. '''
                     if feature.count('|') == 2:
                         feature = feature[:feature.rindex('|')]
-                    feature_hash = __hash_sequence__(feature)
-                    feathash_to_allele[feature_hash] = allele
+                    feature_digests.append(__hash_sequence__(feature.encode()))
+                    feature_genes.append(trim_variant(allele))
+        name_digests, name_order = __sorted_digest_index__(feature_digests)
+        name_index = {'name_digests':name_digests, 'name_genes':np.array(feature_genes, dtype='object')[name_order]}
+        del feature_digests, feature_genes
 
-    ''' Pre-load hashes for non-redundant protein sequences '''
+    ''' Pre-load hashes for non-redundant sequences '''
     print('Loading non-redundant sequences...')
-    seqhash_to_feature = {}
-    def load_sequence_entry(seq_blocks, header):
-        if len(seq_blocks) > 0:
-            seq = ''.join(seq_blocks)
-            seq = seq if (allele_names is None) else seq + trim_variant(header)
-            seqhash = __hash_sequence__(seq)
-            if seqhash in seqhash_to_feature:
-                print('COLLISION:' , header)
-            seqhash_to_feature[seqhash] = header
-
-    with open(features_fasta, 'r') as f_fasta:
-        header = ''; seq_blocks = []
-        for line in f_fasta:
-            if line[0] == '>': # new sequence encountered
-                load_sequence_entry(seq_blocks, header)
-                header = line[1:].strip()
-                seq_blocks = []
-            else: # sequence encountered
-                seq_blocks.append(line.strip())
-        load_sequence_entry(seq_blocks, header) # process last record
-    print('Non-redundant sequences:', len(seqhash_to_feature))
-
-    ''' Validate individual genomes against table '''
-    
-    def check_genome_sequence(seq_blocks, genome_features, feature_name, num_missing):
-        if len(seq_blocks) > 0:
-            seq = ''.join(seq_blocks)
-            if not (allele_names is None):
-                ''' Also validating allele name '''
-                feature_name = feature_name.split('_upstream(')[0]
-                feature_name = feature_name.split('_downstream(')[0]
-                feature_hash = __hash_sequence__(feature_name)
-                if feature_hash in feathash_to_allele:
-                    seq += trim_variant(feathash_to_allele[feature_hash])
-            seqhash = __hash_sequence__(seq)
-            if seqhash in seqhash_to_feature:
-                ''' Note: Sequence hashes may be missing if any original
-                    sequences were excluded intentionally, i.e. too short '''
-                feature = seqhash_to_feature[seqhash] # original name to NR name
-                genome_features.add(feature)
-            else:
-                num_missing += 1
-        return genome_features
-    
-    missing_features = 0
-    feature_counts = dfa.sum() # genome x total features
-    for i, genome_fasta in enumerate(sorted(genome_fasta_paths)):
+    nr_features = []; nr_digests = []
+    for header, seq in iter_fasta(features_fasta, decode=True):
+        seq = seq if (allele_names is None) else seq + trim_variant(header)
+        nr_features.append(header)
+        nr_digests.append(__hash_sequence__(seq.encode()))
+    seq_digests, seq_ids = __sorted_digest_index__(nr_digests, report=nr_features)
+    print('Non-redundant sequences:', len(seq_digests))
+    del nr_digests
+
+    ''' Identify features present in each genome '''
+    genome_fasta_paths = sorted(genome_fasta_paths)
+    validation_tasks = [(__get_genome_from_filename__(x), (x,)) for x in genome_fasta_paths]
+    genome_results = __map_genomes__(__find_genome_features__, validation_tasks, n_jobs=n_jobs, 
+        shared=dict(seq_digests=seq_digests, seq_ids=seq_ids, **name_index), log_interval=None)
+
+    ''' Check that identified features are consistent with the table '''
+    feature_ids = {x:i for i, x in enumerate(nr_features)} # table rows outside of features_fasta
+    feature_ids.update({x:len(nr_features) + i for i, x in enumerate(dfa.index) if not x in feature_ids})
+    row_ids = np.array([feature_ids[x] for x in dfa.index], dtype='int64')
+    validation = []
+    for i, (genome_fasta, (genome_feature_ids, missing)) in enumerate(zip(genome_fasta_paths, genome_results)):
         if (i+1) % log_group == 0:
             print('Validating genome', i+1, ':', genome_fasta)
-        ''' Load all features present in the genome '''
-        genome_features = set()
-        with open(genome_fasta, 'r') as f_fasta:
-            feature_header = ''; seq_blocks = []
-            for line in f_fasta:
-                if line[0] == '>': # new sequence encountered
-                    genome_features = check_genome_sequence(seq_blocks, genome_features, feature_header, missing_features)
-                    feature_header = line[1:].strip()
-                    seq_blocks = []
-                else: # sequence encountered
-                    seq_blocks.append(line.strip())
-            genome_features = check_genome_sequence(seq_blocks, genome_features, feature_header, missing_features) 
-            # process last record
-            
-        ''' Check that identified features are consistent with the table '''
         genome = __get_genome_from_filename__(genome_fasta) # trim off full path and .fna/.faa
         if not genome in dfa.columns: # possible footer
             genome = '_'.join(genome.split('_')[:-1])
         df_ga = dfa.loc[:,genome]
-        table_features = set(df_ga.index[df_ga == 1]) # features from df_features
-        test = table_features == genome_features # features from original fasta
-        inconsistencies += (1 - int(test))
-        if not test:
-            table_only = len(table_features.difference(genome_features))
-            genome_only = len(genome_features.difference(table_features))
+        table_feature_ids = np.unique(row_ids[np.asarray(df_ga == 1)]) # features from df_features
+        table_only = len(np.setdiff1d(table_feature_ids, genome_feature_ids, assume_unique=True))
+        genome_only = len(np.setdiff1d(genome_feature_ids, table_feature_ids, assume_unique=True))
+        validation.append((genome, table_only, genome_only, missing, table_only + genome_only == 0))
+        if table_only + genome_only > 0 and not return_table:
             print(genome, '\t', 'Table only:', table_only, '\t', 'Genome only:', genome_only)
-    print('Missing Features:', missing_features)
-    print('Feature Table Inconsistencies:', inconsistencies)
+    df_validation = pd.DataFrame(validation, columns=['genome', 'table_only', 'genome_only', 'missing', 
+                                                      'consistent']).set_index('genome')
+    print('Missing Features:', df_validation.missing.sum())
+    print('Feature Table Inconsistencies:', (~df_validation.consistent).sum())
+    if return_table:
+        return df_validation
 
 
 def validate_upstream_table_direct(df_upstream, genome_fna_paths, nr_upstream_fna,
-                                  limits=(-50,3), log_group=1):
+                                  limits=(-50,3), log_group=1, n_jobs=1):
     '''
     Does a partial validation of the upstream x genome table by checking that
     the recorded upstream sequences are present in the corresponding genome, 
@@ -1565,11 +2043,11 @@ def validate_upstream_table_direct(df_upstream, genome_fna_paths, nr_upstream_fn
     upstream sequences. See validate_proximal_table() for parameters.
     '''
     validate_proximal_table_direct(df_upstream, genome_fna_paths, nr_upstream_fna, 
-                            limits, 'upstream', log_group)
+                            limits, 'upstream', log_group, n_jobs)
 
     
 def validate_downstream_table_direct(df_downstream, genome_fna_paths, nr_downstream_fna,
-                              limits=(-3,50), log_group=1):
+                              limits=(-3,50), log_group=1, n_jobs=1):
     '''
     Does a partial validation of the downstream x genome table by checking that
     the recorded downstream downstream are present in the corresponding genome, 
@@ -1577,15 +2055,19 @@ def validate_downstream_table_direct(df_downstream, genome_fna_paths, nr_downstr
     downstream sequences. See validate_proximal_table() for parameters.
     '''
     validate_proximal_table_direct(df_downstream, genome_fna_paths, nr_downstream_fna, 
-                            limits, 'downstream', log_group)
+                            limits, 'downstream', log_group, n_jobs)
     
 
-def validate_proximal_table_direct(df_prox, genome_fna_paths, nr_prox_fna, limits, side, log_group=1):
+def validate_proximal_table_direct(df_prox, genome_fna_paths, nr_prox_fna, limits, side, log_group=1,
+                                   n_jobs=1):
     '''
     Does a partial validation of the proximal x genome table by checking that
     the recorded proximal sequences are present in the corresponding genome, 
     and counts start codons observed. DOES NOT check the exact location of the
-    proximal sequences. TODO: Does not yet support non-fixed length UTRs.
+    proximal sequences. Each genome's contigs (both strands) are scanned once per 
+    distinct proximal sequence length with a 2-bit k-mer index, see 
+    fasta.ContigStore.contains(), so truncated UTRs (i.e. with max_overlap) 
+    are also supported.
     
     Parameters
     ----------
@@ -1602,6 +2084,9 @@ def validate_proximal_table_direct(df_prox, genome_fna_paths, nr_prox_fna, limit
         Either "upstream" or "downstream"
     log_group : int
         Print message per this many genomes 
+    n_jobs : int
+        Number of processes used to scan genomes in parallel. Workers share 
+        the non-redundant proximal sequences. If -1, uses all available cores (default 1)
     '''
     dfp = load_feature_table(df_prox)
     
@@ -1610,31 +2095,21 @@ def validate_proximal_table_direct(df_prox, genome_fna_paths, nr_prox_fna, limit
     nr_prox = load_sequences_from_fasta(nr_prox_fna)
             
     ''' Verify present of each proximal sequence within each genome '''
-    window = limits[1] - limits[0]
-    for g, genome_fna in enumerate(genome_fna_paths):
-        genome_contigs = load_sequences_from_fasta(genome_fna)
+    validation_tasks = []
+    for genome_fna in genome_fna_paths:
         genome = __get_genome_from_filename__(genome_fna)
+        dfp_strain = dfp.loc[:,genome]
+        table_prox = list(dfp_strain.index[pd.notnull(dfp_strain)]) # proximal sequences as defined by the table
+        validation_tasks.append((genome, (genome_fna, table_prox)))
+    genome_missing = __map_genomes__(__find_missing_proximal__, validation_tasks, 
+                                     n_jobs=n_jobs, shared={'nr_prox':nr_prox}, log_interval=None)
+    
+    ''' Report undetected proximal sequences '''
+    for g, (genome, (genome_fna, table_prox)) in enumerate(validation_tasks):
         if (g+1) % log_group == 0:
             print(g+1, 'Evaluating', genome, genome_fna)
-        dfp_strain = dfp.loc[:,genome]
-        table_prox = dfp_strain.index[pd.notnull(dfp_strain)] # proximal sequences as defined by the table
-        table_prox_seqs = {nr_prox[x]:x for x in table_prox} # maps sequences to names
-        
-        ''' Scan all contigs for detected fixed-length proximal sequences '''
-        for contig in list(genome_contigs.values()):
-            for i in range(len(contig)):
-                segment = contig[i:i+window]
-                if segment in table_prox_seqs: 
-                    table_prox_seqs.pop(segment)
-            rc_contig = reverse_complement(contig)
-            for i in range(len(rc_contig)):
-                segment = rc_contig[i:i+window]
-                if segment in table_prox_seqs: 
-                    table_prox_seqs.pop(segment)
-                    
-        ''' Report undetected proximal sequences '''
-        for prox in table_prox_seqs:
-            print('\tMissing', table_prox_seqs[prox], 'from', genome)
+        for prox in genome_missing[g]:
+            print('\tMissing', prox, 'from', genome)
         
     ''' Count start/stop codons among non-redundant proximal sequences '''
     if limits[1] >= 3 and side == 'upstream':
@@ -1655,7 +2130,7 @@ def validate_proximal_table_direct(df_prox, genome_fna_paths, nr_prox_fna, limit
         print(collections.Counter(stop_codons))
 
         
-def generate_annotations(features, annotation_files):
+def generate_annotations(features, annotation_files, cache=True):
     '''
     For a set of features, creates a pd.Series with PATRIC annotations
     for each feature, or np.nan if no annotation was found.
@@ -1665,6 +2140,8 @@ def generate_annotations(features, annotation_files):
         returns the consensus annotation.
     3) For proximal UTR features, returns the consensus annotation
         of the parent cluster-level feature.
+    Annotations are looked up by binary search with index_annotations(), 
+    which indexes each annotation file on first use.
         
     Parameters
     ----------
@@ -1672,8 +2149,13 @@ def generate_annotations(features, annotation_files):
         List of features to extract annotations.
     annotations_files : iterable
         Paths to files containing annotations, from extract_annotations().
+    cache : bool
+        If True, reuses or saves each file's index as <annotation_file>.idx.npz,
+        see index_annotations(). Use False for read-only annotation directories
+        to index in memory only (default True)
     '''
-    relevant_features = list(features) + []
+    features = list(features)
+    relevant_features = features + []
     for feature in features:
         name, cluster_type, cluster_num, variant_type, variant_num = \
             breakdown_feature_name(feature)
@@ -1682,14 +2164,10 @@ def generate_annotations(features, annotation_files):
             relevant_features.append(feature_cluster)
             
     ''' Load relevant features from annotations file '''
-    relevant_features = set(relevant_features)
+    relevant_features = sorted(set(relevant_features))
     relevant_annotations = {}
     for annot_file in annotation_files:
-        with open(annot_file, 'r') as f:
-            for line in f:
-                data = line.strip().split('\t'); feature = data[0]
-                if feature in relevant_features:
-                    relevant_annotations[feature] = ';'.join(data[1:])
+        relevant_annotations.update(__fetch_annotations__(annot_file, relevant_features, cache=cache))
     
     ''' Process loaded annotations '''
     feature_to_annot = {}
@@ -1707,6 +2185,61 @@ def generate_annotations(features, annotation_files):
     return pd.Series(feature_to_annot, index=features)
 
 
+def index_annotations(annotation_file, cache=True):
+    '''
+    Indexes an annotation file from extract_annotations() for random access 
+    by feature, as the sorted feature names in the first column with the byte 
+    offset and length of each line. If a feature is listed more than once, 
+    its last line is indexed.
+    
+    If cache, the index is saved to <annotation_file>.idx.npz, and loaded from 
+    there while the size and modification time of annotation_file are unchanged.
+    If the index cannot be saved (i.e. read-only directory), it is only kept in memory.
+    
+    Parameters
+    ----------
+    annotation_file : str
+        Path to annotation file from extract_annotations()
+    cache : bool
+        If True, loads or saves <annotation_file>.idx.npz (default True)
+        
+    Returns
+    -------
+    annotation_index : dict
+        Maps 'features' to sorted feature names (bytes array), and
+        'offsets' and 'lengths' to the byte span of each feature's line
+    '''
+    stat = os.stat(annotation_file)
+    source_stat = np.array([stat.st_size, stat.st_mtime_ns], dtype='int64')
+    index_file = annotation_file + '.idx.npz'
+    if cache and os.path.isfile(index_file):
+        with np.load(index_file) as cached:
+            if np.array_equal(cached['source_stat'], source_stat):
+                return {x:cached[x] for x in ['features', 'offsets', 'lengths']}
+    
+    ''' Locate each line and its feature name '''
+    with open(annotation_file, 'rb') as f:
+        lines = f.read().split(b'\n')
+    lengths = np.array([len(x) for x in lines], dtype='int64')
+    offsets = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]]).astype('int64')
+    features = np.array([x.split(b'\t', 1)[0].strip() for x in lines], dtype='S')
+    del lines
+    
+    ''' Sort by feature, keeping the last line for repeated features '''
+    is_feature = features != b''
+    features, offsets, lengths = features[is_feature], offsets[is_feature], lengths[is_feature]
+    order = np.argsort(features, kind='stable')
+    features, offsets, lengths = features[order], offsets[order], lengths[order]
+    is_last = np.ones(len(features), dtype='bool')
+    is_last[:-1] = features[:-1] != features[1:]
+    annotation_index = {'features':features[is_last], 'offsets':offsets[is_last], 'lengths':lengths[is_last]}
+    if cache:
+        try:
+            np.savez(index_file, source_stat=source_stat, **annotation_index)
+        except OSError as e:
+            print('Unable to cache annotation index, keeping in memory:', e)
+    return annotation_index
+
 
 def extract_coding_fna(genome_gff, genome_fna, coding_out,
                        allowed_features=['CDS', 'tRNA']):
@@ -1716,6 +2249,8 @@ def extract_coding_fna(genome_gff, genome_fna, coding_out,
             1) Assumes contigs are labeled "accn|<contig>".
             2) Assumes protein features have ".peg." in the ID
             3) Assumes ID = fig|<genome>.peg.#
+        To extract several feature types from the same genome at once, 
+        see extract_genome_features().
 
         Parameters
         ----------
@@ -1730,49 +2265,21 @@ def extract_coding_fna(genome_gff, genome_fna, coding_out,
             features labeled "CDS" and "tRNA"
             (default ['CDS', 'tRNA'])
     '''
-
-    contigs = load_sequences_from_fasta(genome_fna, header_fxn=lambda x: x.split()[0])
-    with open(coding_out, 'w+') as f_coding:
-        with open(genome_gff, 'r') as f_gff:
-            for line in f_gff:
-                ''' Check for non-comment and non-empty line '''
-                if not line[0] == '#' and not len(line.strip()) == 0:
-                    contig, src, feature_type, start, stop, \
-                    score, strand, phase, meta = line.split('\t')
-                    contig = contig[5:]  # trim off "accn|" header
-                    fstart = int(start) - 1
-                    fstop = int(stop)
-
-                    if feature_type in allowed_features:
-                        ''' Get noncoding feature sequence and ID '''
-                        try:
-                            contig_seq = contigs[contig]
-                        except KeyError:
-                            print(contigs.keys())
-                            break
-
-                        fstart = max(0, fstart)  # avoid looping due to contig boundaries
-                        feature_seq = contig_seq[fstart:fstop]
-                        if strand == '-':  # negative strand
-                            feature_seq = reverse_complement(feature_seq)
-                        meta_key_vals = [x.split('=') for x in meta.split(';')]
-                        metadata = {x[0]: x[1] for x in meta_key_vals}
-                        feature_id = metadata['ID']
-
-                        ''' Save to output file '''
-                        feature_seq = '\n'.join(feature_seq[i:i + 70] for i in range(0, len(feature_seq), 70))
-                        f_coding.write('>' + feature_id + '\n')
-                        f_coding.write(feature_seq + '\n')
-
+    extract_genome_features(genome_gff, genome_fna, coding_out=coding_out,
+                            coding_features=allowed_features)
 
 
 def extract_annotations(genome_gffs, allele_name_file, annotations_out, 
                         batch=100, collapse_alleles=True, flexible_locus_tag=False,
-                        allowed_features=None):
+                        allowed_features=None, n_jobs=1, index_file=None):
     '''
     For a given allele name file (usually <org>_allele_names.tsv),
     extracts the corresponding PATRIC annotations from original gff files.
-    Can load gff files in batches to limit memory usage.
+    GFF files are parsed in batches (in parallel with n_jobs) into a feature ID 
+    to product index, held in memory or in an SQLite file (index_file). The allele 
+    name file is then read once, replacing IDs with annotations in a single pass.
+    Batching only bounds memory use with index_file: without it, every batch is 
+    merged into one in-memory index that grows to hold all annotations.
     
     Parameters
     ----------
@@ -1781,9 +2288,11 @@ def extract_annotations(genome_gffs, allele_name_file, annotations_out,
     allele_name_file : str
         Path to file with allele-protein ID map, usually <org>_allele_names.tsv
     annotations_out : str
-        Path to output annotations. Will also create a .tmp intermediate.
+        Path to output annotations
     batch : int
-        Maximum GFF files to load into at once
+        Maximum GFF files to parse at once. If an ID is annotated in multiple 
+        batches, the first batch is used. Only limits peak memory if index_file 
+        is provided (default 100)
     collapse_alleles : bool
         If True, reports annotations at the gene level, using the most common allele
         annotation. Alleles with non-plurality annotation are reported separately.
@@ -1797,83 +2306,68 @@ def extract_annotations(genome_gffs, allele_name_file, annotations_out,
     allowed_features : list or None
         List of GFF feature types to extract. If None, all feature
         types are extracted (default None)
+    n_jobs : int
+        Number of processes used to parse GFF files in parallel. 
+        If -1, uses all available cores (default 1)
+    index_file : str
+        If provided, path to an SQLite file for the ID to product index. Required 
+        to keep memory bounded when all annotations do not fit in memory, otherwise 
+        the index is kept in memory. Overwritten if it exists (default None)
     '''
     
-    ''' Copy allele name table '''
-    tmp_out = annotations_out + '.tmp'
-    shutil.copyfile(allele_name_file, tmp_out)
-    
-    ''' Iteratively replace protein IDs with annotations from GFFs (in batches) '''
+    ''' Index annotations from GFFs (in batches) '''
+    if index_file is None:
+        annotations = {}
+    else:
+        import sqlite3
+        if os.path.exists(index_file):
+            os.remove(index_file)
+        annotations = sqlite3.connect(index_file)
+        annotations.execute('CREATE TABLE annotations (fid TEXT PRIMARY KEY, product TEXT) WITHOUT ROWID')
     n_gffs = len(genome_gffs)
     for g in range(0,n_gffs,batch):
-        ''' Load annotations for batch of GFFs '''
-        annotations = {}
-        for gff in genome_gffs[g:g+batch]:
-            with open(gff,'r') as f_gff:
-                for line in f_gff:
-                    data = line.strip().split('\t')
-                    if len(data) == 9: 
-                        feature_type = data[2]
-                        if allowed_features is None or feature_type in allowed_features:
-                            line_annots = data[-1].split(';')
-                            line_annots = dict([x.split('=') for x in line_annots])
-                            if 'ID' in line_annots and 'product' in line_annots:
-                                product = line_annots['product']
-                                product = urllib.parse.unquote(product) # replace % hex characters
-                                fid2 = line_annots['ID']; fid3 = None
-                                if 'locus_tag' in line_annots:
-                                    fid3 = fid2 + '|' + line_annots['locus_tag']
-                                if flexible_locus_tag: # save both names when possible
-                                    annotations[fid2] = product
-                                    if not fid3 is None:
-                                        annotations[fid3] = product
-                                else: # save only 3-term, or only 2-term if no locus_tag 
-                                    fid = fid2 if (fid3 is None) else fid3
-                                    annotations[fid] = product
-        print('Loaded', len(annotations), 'annotations from batch', g+1, '-', min(n_gffs,g+batch))
-        
-        ''' Incorporate newly loaded annotations '''
-        with open(tmp_out, 'r') as f_last:
-            with open(tmp_out+'2', 'w+') as f_next:
-                for line in f_last:
-                    data = line.strip().split('\t')
-                    allele = data[0]; fids = data[1:]
-                    fids = [annotations[x] if x in annotations else x for x in fids]
-                    fids = list(collections.OrderedDict.fromkeys(fids)) # remove duplicate annotations
-                    output = allele + '\t' + '\t'.join(fids)
-                    f_next.write(output + '\n')
-        shutil.move(tmp_out+'2', tmp_out) # remove last round
-
-    ''' Optionally collapse allele-level annotations to gene-level '''
-    if collapse_alleles:
-        with open(tmp_out, 'r') as f_last:
-            current_cluster = None
-            with open(annotations_out, 'w+') as f_next:
-                for line in f_last:
-                    data = line.strip().split('\t')
+        parsing_tasks = [(__get_genome_from_filename__(x), (x,)) for x in genome_gffs[g:g+batch]]
+        batch_annotations = {}
+        for gff_annotations in __map_genomes__(__load_gff_annotations__, parsing_tasks, n_jobs=n_jobs,
+                shared={'flexible_locus_tag':flexible_locus_tag, 'allowed_features':allowed_features},
+                log_interval=None):
+            batch_annotations.update(gff_annotations) # later GFFs in a batch take precedence
+        print('Loaded', len(batch_annotations), 'annotations from batch', g+1, '-', min(n_gffs,g+batch))
+        if index_file is None:
+            for fid, product in batch_annotations.items():
+                annotations.setdefault(fid, product) # earlier batches take precedence
+        else:
+            annotations.executemany('INSERT OR IGNORE INTO annotations VALUES (?,?)', batch_annotations.items())
+            annotations.commit()
+        del batch_annotations
+    
+    ''' Replace protein IDs with annotations in one pass, optionally collapsing alleles to genes '''
+    with open(allele_name_file, 'r') as f_alleles:
+        with open(annotations_out, 'w+') as f_out:
+            current_cluster = None; cluster_alleles = []; cluster_annots = []
+            while True:
+                lines = [x.strip().split('\t') for x in itertools.islice(f_alleles, 100000)]
+                if len(lines) == 0:
+                    break
+                lookup = annotations if index_file is None else \
+                    __lookup_annotations__(annotations, set(x for data in lines for x in data[1:]))
+                for data in lines:
                     allele = data[0]
-                    cluster =  __get_gene_from_allele__(allele)
-                    allele_annots = '\t'.join(data[1:])
-                    if current_cluster is None: # initialize first cluster
-                        current_cluster = cluster
-                        cluster_alleles = [allele]
-                        cluster_annots = [allele_annots]
-                    elif cluster == current_cluster: # continuing current cluster
-                        cluster_alleles.append(allele)
-                        cluster_annots.append(allele_annots)
-                    else: # start of new cluster
-                        most_common_annot, count = collections.Counter(cluster_annots).most_common(1)[0]
-                        f_next.write(current_cluster + '\t' + most_common_annot + '\n')
-                        for i, annots in enumerate(cluster_annots):
-                            if annots != most_common_annot:
-                                f_next.write(cluster_alleles[i] + '\t' + annots + '\n')
-                        # Initialize next cluster
-                        current_cluster = cluster
-                        cluster_alleles = [allele]
-                        cluster_annots = [allele_annots]
-        os.remove(tmp_out)
-    else: 
-        shutil.move(tmp_out, annotations_out)
+                    fids = [lookup[x] if x in lookup else x for x in data[1:]]
+                    fids = list(collections.OrderedDict.fromkeys(fids)) # remove duplicate annotations
+                    allele_annots = '\t'.join(fids)
+                    if not collapse_alleles:
+                        f_out.write(allele + '\t' + allele_annots + '\n')
+                        continue
+                    cluster = __get_gene_from_allele__(allele)
+                    if cluster != current_cluster: # start of new cluster
+                        __write_cluster_annotations__(f_out, current_cluster, cluster_alleles, cluster_annots)
+                        current_cluster = cluster; cluster_alleles = []; cluster_annots = []
+                    cluster_alleles.append(allele)
+                    cluster_annots.append(allele_annots)
+            __write_cluster_annotations__(f_out, current_cluster, cluster_alleles, cluster_annots) # final cluster
+    if not index_file is None:
+        annotations.close()
     
 
 def load_sequences_from_fasta(fasta, header_fxn=None, seq_fxn=None, filter_fxn=None):
@@ -1883,47 +2377,264 @@ def load_sequences_from_fasta(fasta, header_fxn=None, seq_fxn=None, filter_fxn=N
         sequences (seq_fxn). Drops the ">" from all headers,
         and removes line breaks from sequences. '''
     header_to_seq = {}
-    with open(fasta, 'r') as f:
-        header = ''; seq = ''
-        for line in f:
-            if line[0] == '>': # header line
-                if len(header) > 0 and len(seq) > 0:
-                    if filter_fxn is None or filter_fxn(header):
-                        seq = seq_fxn(seq) if seq_fxn else seq
-                        header_to_seq[header] = seq
-                header = line.strip()[1:]
-                header = header_fxn(header) if header_fxn else header
-                seq = ''
-            else: # sequence line
-                seq += line.strip()
-        if len(header) > 0 and len(seq) > 0:
-            if filter_fxn is None or filter_fxn(header):
-                seq = seq_fxn(seq) if seq_fxn else seq
-                header_to_seq[header] = seq
+    for header, seq in iter_fasta(fasta, decode=True):
+        header = header_fxn(header) if header_fxn else header
+        if len(header) > 0 and (filter_fxn is None or filter_fxn(header)):
+            seq = seq_fxn(seq) if seq_fxn else seq
+            header_to_seq[header] = seq
     return header_to_seq
 
 
-def load_feature_table(feature_table):
+def load_feature_table(feature_table, genomes=None, features=None):
     ''' 
-    Loads DataFrames from CSV, CSV.GZ, PICKLE, or PICKLE.GZ.
-    Uses index_col=0 for CSVs. Returns feature_table if provided 
-    with anything other than a string.
+    Loads DataFrames from CSV, CSV.GZ, PICKLE, PICKLE.GZ, or a native table 
+    directory written by save_feature_table. Uses index_col=0 for dense CSVs, and 
+    reads long-format (feature, genome, value) CSVs from save_feature_table_csv 
+    as sparse tables. Native tables are memory-mapped, so only the selected genomes 
+    are read from disk. Returns feature_table if provided with anything other than 
+    a string (subset if genomes or features are provided).
+    
+    Parameters
+    ----------
+    feature_table : str or pd.DataFrame
+        Path to table, or table
+    genomes : list
+        If provided, only loads these genomes (columns), in this order (default None)
+    features : list
+        If provided, only loads these features (rows), in this order. Repeated
+        features are loaded as repeated rows, same as .loc (default None)
     '''
     if type(feature_table) == str: # path provided
-        if feature_table[-4:].lower() == '.csv' or feature_table[-7:].lower() == '.csv.gz':
-            return pd.read_csv(feature_table, index_col=0)
+        if os.path.isdir(feature_table) and os.path.exists(feature_table + '/manifest.json'):
+            return __load_native_feature_table__(feature_table, genomes, features)
+        elif feature_table[-4:].lower() == '.csv' or feature_table[-7:].lower() == '.csv.gz':
+            csv_columns = list(pd.read_csv(feature_table, nrows=0).columns)
+            if csv_columns == FEATURE_TABLE_CSV_COLUMNS: # sparse long-format
+                df_table = __load_feature_table_csv__(feature_table)
+            else: # dense table
+                df_table = pd.read_csv(feature_table, index_col=0)
         elif feature_table[-7:].lower() == '.pickle' or feature_table[-10:].lower() == '.pickle.gz':
-            return pd.read_pickle(feature_table)
+            df_table = pd.read_pickle(feature_table)
         else:
             return feature_table
     else: # non-string input
-        return feature_table
+        df_table = feature_table
+    if not features is None:
+        df_table = df_table.loc[list(features)]
+    if not genomes is None:
+        df_table = df_table[list(genomes)]
+    return df_table
+
+
+def save_feature_table(df_table, table_dir):
+    '''
+    Saves a feature x genome table in the native table format, a directory with:
+    - indptr.npy, indices.npy, data.npy: CSC arrays with one column per genome.
+        Only present entries are stored (NaN and 0 are absent)
+    - features.npy, genomes.npy: row and column labels
+    - manifest.json: format version, shape, and value dtype/fill value of the table
+    All arrays are raw .npy files that can be memory-mapped by load_feature_table.
+
+    Parameters
+    ----------
+    df_table : pd.DataFrame
+        Feature x genome table, sparse or dense
+    table_dir : str
+        Path to output directory, usually <table>.table
+    '''
+    if os.path.isdir(table_dir):
+        shutil.rmtree(table_dir)
+    os.makedirs(table_dir)
+    dtypes = df_table.dtypes.unique() if df_table.shape[1] > 0 else [pd.SparseDtype('int64', np.nan)]
+    is_sparse = all(isinstance(x, pd.SparseDtype) for x in dtypes)
+    value_dtype = np.result_type(*[x.subtype if isinstance(x, pd.SparseDtype) else x for x in dtypes])
+    fill_value = dtypes[0].fill_value if is_sparse and len(dtypes) == 1 else 0
+    
+    csc = _to_scipy_sparse(df_table, dtype=value_dtype)
+    data = csc.data
+    if np.issubdtype(value_dtype, np.integer) and len(data) > 0: # store values compactly
+        data = data.astype(np.result_type(np.min_scalar_type(data.min()), np.min_scalar_type(data.max())))
+    index_dtype = 'int32' if max(df_table.shape) < 2**31 else 'int64'
+    arrays = {'indptr': csc.indptr.astype('int64'), 'indices': csc.indices.astype(index_dtype), 'data': data,
+              'features': np.array(df_table.index.astype(str), dtype='U'),
+              'genomes': np.array(df_table.columns.astype(str), dtype='U')}
+    for array_name, array in arrays.items():
+        np.save(table_dir + '/' + array_name + '.npy', array, allow_pickle=False)
+    fill_value = None if pd.isna(fill_value) else np.array(fill_value).item() # JSON null for NaN
+    manifest = {'format': 'pyphylon_feature_table', 'version': NATIVE_TABLE_VERSION, 'layout': 'csc',
+                'shape': list(df_table.shape), 'dtype': str(value_dtype), 'sparse': is_sparse,
+                'fill_value': fill_value}
+    with open(table_dir + '/manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+def save_feature_table_csv(df_table, output_csv, chunk_genomes=1000):
+    '''
+    Saves a feature x genome table as a long-format CSV with one (feature, genome, value) 
+    row per present entry (NaN and 0 are absent), written in chunks of genomes. 
+    Features or genomes without any present entries are not recorded.
     
+    Parameters
+    ----------
+    df_table : pd.DataFrame
+        Feature x genome table, sparse or dense
+    output_csv : str
+        Path to output CSV, compressed if ending in .gz
+    chunk_genomes : int
+        Number of genomes converted per chunk (default 1000)
+    '''
+    features = np.array(df_table.index, dtype='object')
+    open_csv = gzip.open if output_csv[-3:].lower() == '.gz' else open
+    with open_csv(output_csv, 'wt', newline='') as f_csv:
+        f_csv.write(','.join(FEATURE_TABLE_CSV_COLUMNS) + '\n')
+        for genomes, csc in iter_feature_table_blocks(df_table, chunk_genomes, dtype='float64'):
+            genome_pos = np.repeat(np.arange(len(genomes)), np.diff(csc.indptr))
+            values = csc.data
+            df_long = pd.DataFrame({'feature': features[csc.indices], 
+                                    'genome': np.array(genomes, dtype='object')[genome_pos],
+                                    'value': values.astype('int64') if np.all(values == np.round(values)) else values})
+            df_long.to_csv(f_csv, header=False, index=False)
+
+
+def iter_feature_table_blocks(feature_table, chunk_genomes=1000, dtype=None):
+    '''
+    Iterates over a feature x genome table in blocks of genomes (columns), so that
+    only one block is held in memory at a time. For native table directories from 
+    save_feature_table, each block is read from the memory-mapped arrays.
     
+    Parameters
+    ----------
+    feature_table : str or pd.DataFrame
+        Path to native table directory, or table (sparse or dense)
+    chunk_genomes : int
+        Number of genomes per block (default 1000)
+    dtype : str
+        If provided, converts block values to this dtype, otherwise keeps the 
+        table's value dtype (default None)
+        
+    Yields
+    ------
+    genomes : pd.Index
+        Genomes in the block
+    csc : scipy.sparse.csc_matrix
+        Feature x genome block with present entries only (NaN and 0 are absent)
+    '''
+    if type(feature_table) == str: # native table, read block by block
+        manifest, load = __open_native_table__(feature_table)
+        indptr, indices, data, all_genomes = load('indptr'), load('indices'), load('data'), load('genomes')
+        value_dtype = dtype if not dtype is None else manifest['dtype']
+        n_features = manifest['shape'][0]
+        for i in range(0, len(all_genomes), chunk_genomes):
+            block_indptr = np.asarray(indptr[i:i+chunk_genomes+1])
+            start, stop = block_indptr[0], block_indptr[-1]
+            csc = scipy.sparse.csc_matrix((np.asarray(data[start:stop], dtype=value_dtype), 
+                                           np.asarray(indices[start:stop]), block_indptr - start), 
+                                          shape=(n_features, len(block_indptr) - 1))
+            yield pd.Index(all_genomes[i:i+chunk_genomes]), csc
+    else:
+        dtypes = feature_table.dtypes.unique() if feature_table.shape[1] > 0 else [np.dtype('float64')]
+        value_dtype = dtype if not dtype is None else \
+            np.result_type(*[x.subtype if isinstance(x, pd.SparseDtype) else x for x in dtypes])
+        for i in range(0, feature_table.shape[1], chunk_genomes):
+            df_chunk = feature_table.iloc[:, i:i+chunk_genomes]
+            yield df_chunk.columns, _to_scipy_sparse(df_chunk, dtype=value_dtype)
+
+
+def __load_feature_table_csv__(feature_table_csv):
+    ''' Loads a long-format CSV from save_feature_table_csv as a Sparse[int64/float, nan] table '''
+    df_long = pd.read_csv(feature_table_csv, dtype={'feature':str, 'genome':str})
+    feature_codes, features = pd.factorize(df_long['feature'])
+    genome_codes, genomes = pd.factorize(df_long['genome'])
+    values = df_long['value'].values
+    csc = scipy.sparse.csc_matrix((values, (feature_codes, genome_codes)), shape=(len(features), len(genomes)))
+    df_table = pd.DataFrame.sparse.from_spmatrix(csc, index=pd.Index(features), columns=pd.Index(genomes))
+    return df_table.astype(pd.SparseDtype(values.dtype, np.nan))
+
+
+def __open_native_table__(table_dir):
+    ''' Reads and checks the manifest of a table from save_feature_table, returning 
+        the manifest and a function that memory-maps one of its arrays by name '''
+    with open(table_dir + '/manifest.json', 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != 'pyphylon_feature_table' or manifest.get('version', 0) > NATIVE_TABLE_VERSION:
+        raise ValueError('Unsupported feature table format in ' + table_dir)
+    load = lambda x: np.load(table_dir + '/' + x + '.npy', mmap_mode='r', allow_pickle=False)
+    return manifest, load
+
+
+def __load_native_feature_table__(table_dir, genomes=None, features=None):
+    ''' Loads a table from save_feature_table, reading only the selected genomes from the memory-mapped arrays '''
+    manifest, load = __open_native_table__(table_dir)
+    indptr, indices, data = load('indptr'), load('indices'), load('data')
+    all_features, all_genomes = pd.Index(load('features')), pd.Index(load('genomes'))
+    
+    ''' Select genomes (columns) '''
+    if genomes is None:
+        genome_pos = np.arange(len(all_genomes))
+        sub_indices, sub_data = np.asarray(indices), np.asarray(data)
+        sub_indptr = np.asarray(indptr)
+    else:
+        genome_pos = __get_label_positions__(all_genomes, genomes)
+        starts, stops = indptr[genome_pos], indptr[genome_pos + 1]
+        counts = stops - starts
+        sub_indptr = np.concatenate([[0], np.cumsum(counts)])
+        entries = np.repeat(starts - sub_indptr[:-1], counts) + np.arange(sub_indptr[-1])
+        sub_indices, sub_data = indices[entries], data[entries]
+    
+    ''' Select features (rows) '''
+    if features is None:
+        feature_pos = np.arange(len(all_features))
+    else: # repeated features are repeated in the output, same as .loc
+        feature_pos = __get_label_positions__(all_features, features)
+        row_counts = np.bincount(feature_pos, minlength=len(all_features)) # output rows per stored row
+        row_starts = np.concatenate([[0], np.cumsum(row_counts)])
+        new_rows = np.argsort(feature_pos, kind='stable') # output rows, grouped by stored row
+        entry_counts = row_counts[sub_indices] # output entries per stored entry
+        entry_ends = np.cumsum(entry_counts)
+        sub_indptr = np.concatenate([[0], entry_ends])[sub_indptr] # output entries before each column
+        entry_offsets = np.arange(entry_ends[-1] if len(entry_ends) > 0 else 0) - \
+            np.repeat(entry_ends - entry_counts, entry_counts) # position among copies of an entry
+        sub_indices = new_rows[np.repeat(row_starts[sub_indices], entry_counts) + entry_offsets]
+        sub_data = np.repeat(sub_data, entry_counts)
+    
+    ''' Assemble DataFrame '''
+    value_dtype = np.dtype(manifest['dtype'])
+    csc = scipy.sparse.csc_matrix((np.asarray(sub_data, dtype=value_dtype), sub_indices, sub_indptr), 
+                                  shape=(len(feature_pos), len(genome_pos)))
+    df_table = pd.DataFrame.sparse.from_spmatrix(csc, index=all_features[feature_pos], columns=all_genomes[genome_pos])
+    fill_value = np.nan if manifest['fill_value'] is None else manifest['fill_value']
+    df_table = df_table.astype(pd.SparseDtype(value_dtype, fill_value))
+    return df_table if manifest['sparse'] else df_table.sparse.to_dense()
+
+
+def __get_label_positions__(labels, selected):
+    ''' Gets positions of selected labels, raising KeyError for missing labels '''
+    positions = labels.get_indexer(pd.Index(selected).astype(str))
+    if (positions < 0).any():
+        missing = np.array(selected, dtype='object')[positions < 0]
+        raise KeyError('Labels not found in table: ' + ', '.join(map(str, missing[:10])))
+    return positions
+
+
+def __save_feature_table__(df_table, output_table, save_csv, save_table=True):
+    ''' Saves table as PICKLE.GZ (preserve SparseArrays), native table, and sparse long-format CSV.GZ '''
+    print('Saving', output_table + '.pickle.gz', '...')
+    df_table.to_pickle(output_table + '.pickle.gz')
+    if save_table:
+        print('Saving', output_table + '.table', '...')
+        save_feature_table(df_table, output_table + '.table')
+    elif os.path.isdir(output_table + '.table'): # drop stale native table from a previous run
+        print('Removing outdated', output_table + '.table', '...')
+        shutil.rmtree(output_table + '.table')
+    if save_csv:
+        print('Saving', output_table + '.csv.gz', '...')
+        save_feature_table_csv(df_table, output_table + '.csv.gz')
+
+
 def reverse_complement(seq):
     ''' Returns the reverse complement of a DNA sequence.
         Supports lower/uppercase and ambiguous bases'''
-    return ''.join([DNA_COMPLEMENT[base] for base in list(seq)])[::-1]
+    return seq.translate(DNA_COMPLEMENT_TABLE)[::-1]
 
 
 def create_feature_name(name, cluster_type, cluster_num, variant_type=None, variant_num=-1):
@@ -1988,39 +2699,27 @@ def trim_variant(feature_name):
 
 def __create_sparse_data_frame__(sparse_array, index, columns):
     ''' 
-    Creates a SparseDataFrame from a scipy.sparse matrix by initializing 
-    individual columns as SparseSeries, then concatenating them. 
-    Sometimes faster than native SparseDataFrame initialization? Known issues: 
-    
-    - Direct initialization is slow in v0.24.2, see https://github.com/pandas-dev/pandas/issues/16773
-    - Empty SparseDataFrame initialization time scales quadratically with number of columns
-    - Initializing as dense and converting sparse uses more memory than directly making sparse
-    '''
-    n_row, n_col = sparse_array.shape
-    X = sparse_array.T if n_row < n_col else sparse_array # make n_col < n_row
-    sparse_cols = []
-    for i in range(X.shape[1]): # create columns individually
-        sparse_col = pd.SparseSeries.from_coo(scipy.sparse.coo_matrix(X[:,i]), dense_index=True)
-        sparse_cols.append(sparse_col)
-    df = pd.concat(sparse_cols, axis=1)
-    df = df.T if n_row < n_col else df # transpose back if n_col > n_row originally
-    df.index = pd.Index(index)
-    df.columns = pd.Index(columns)
-    return df
+    Creates a sparse DataFrame view of a binary scipy.sparse matrix, matching the 
+    tables built elsewhere in this module: Sparse[int64, nan] columns where 1 is 
+    present and NaN is absent. Only the non-zero entries are copied per column.
+    '''
+    df = pd.DataFrame.sparse.from_spmatrix(scipy.sparse.csc_matrix(sparse_array), 
+        index=pd.Index(index), columns=pd.Index(columns))
+    return df.astype(pd.SparseDtype('int64', np.nan))
 
 
 def __load_feature_to_allele__(allele_names):
-    ''' Loads feature-to-allele mapping from file, usually <name>_allele_names.tsv. '''
+    ''' Loads feature-to-allele mapping from file, usually <name>_allele_names.tsv, as a HeaderAlleleMap. '''
     map_feature_to_gffid = lambda x: '|'.join(x.split('|')[:2])
-    feat_to_allele = {}
+    features = []; alleles = []
     with open(allele_names, 'r') as f_all:
         for line in f_all:
             data = line.strip().split('\t')
             allele = data[0]; synonyms = data[1:]
             for synonym in synonyms:
-                gff_synonym = map_feature_to_gffid(synonym)
-                feat_to_allele[gff_synonym] = allele
-    return feat_to_allele
+                features.append(map_feature_to_gffid(synonym))
+                alleles.append(allele)
+    return HeaderAlleleMap(features, alleles)
                           
 def __get_gene_from_allele__(allele):
     ''' Converts <name>_C#A# or <name>_T#A# allele to 
@@ -2028,6 +2727,65 @@ def __get_gene_from_allele__(allele):
     splitter = VARIANT_TYPES['allele']
     return splitter.join(allele.split(splitter)[:-1])
 
+def __get_clstr_allele_names__(clstr, name, cluster_type):
+    ''' Names all members of a parsed CLSTR file (see cdhit.read_clstr) as 
+        <name>_C#A# or <name>_T#A#, same as create_feature_name() '''
+    prefix = name + '_' + CLUSTER_TYPES[cluster_type]
+    allele_type = VARIANT_TYPES['allele']
+    return [prefix + str(c) + allele_type + str(m) for c, m in zip(clstr['cluster'].tolist(), clstr['member'].tolist())]
+
+def __get_allele_label__(name, cluster_type):
+    ''' Labels alleles of a build in a SequenceStore as <name>_C or <name>_T '''
+    return name + '_' + CLUSTER_TYPES[cluster_type]
+
+def __get_derived_path__(genome_gff, feature_type):
+    ''' Path to a genome's extracted 'coding', 'upstream', 'downstream' or 'noncoding' 
+        sequences, <genome dir>/derived/<genome><suffix>.fna, creating derived/ if needed '''
+    genome = __get_genome_from_filename__(genome_gff)
+    genome_dir = '/'.join(genome_gff.split('/')[:-1]) + '/' if '/' in genome_gff else ''
+    genome_derived_dir = genome_dir + 'derived/'
+    if not os.path.exists(genome_derived_dir):
+        os.makedirs(genome_derived_dir, exist_ok=True)
+    return genome_derived_dir + genome + DERIVED_SUFFIXES[feature_type]
+
+def __load_gff_features__(genome_gff):
+    ''' Parses GFF features up to any ##FASTA section as a list of (contig, type, start, 
+        stop, strand, ID) with 0-indexed starts and exclusive stops, in file order. 
+        Contigs labeled "accn|<contig>" are trimmed to just <contig>. '''
+    features = []
+    with open(genome_gff, 'r') as f_gff:
+        for line in f_gff:
+            line = line.strip()
+            if line.startswith('##FASTA'): # end of features, start of sequences
+                break
+            if len(line) > 0 and line[0] != '#':
+                contig, src, feat_type, start, stop, score, \
+                    strand, phase, attr_raw = line.split('\t')
+                gffid = None
+                for entry in attr_raw.split(';'):
+                    key, _, value = entry.partition('=')
+                    if key == 'ID':
+                        gffid = value
+                contig = contig.split('|')[-1] # accn|<contig> to just <contig>
+                features.append((contig, feat_type, int(start) - 1, int(stop), strand, gffid))
+    return features
+
+def __get_strand_occupancy__(features):
+    ''' Maps (contig, strand, start, stop) of each CDS to the (3' end, 5' end) of 
+        the nearest CDS to its left and right on the same strand, or -inf/inf if 
+        none, assuming features are sorted by position (see extract_genome_features) '''
+    occupancies = collections.defaultdict(list)
+    for contig, feat_type, start, stop, strand, gffid in features:
+        if feat_type == 'CDS': # only consider CDS-UTR overlaps
+            occupancies[(contig, strand)].append((start, stop))
+    strand_occupancy = {}
+    for (contig, strand), cds_bounds in occupancies.items():
+        leftbounds = [-np.inf] + [stop for start, stop in cds_bounds[:-1]]
+        rightbounds = [start for start, stop in cds_bounds[1:]] + [np.inf]
+        for (start, stop), leftbound, rightbound in zip(cds_bounds, leftbounds, rightbounds):
+            strand_occupancy[(contig, strand, start, stop)] = (leftbound, rightbound)
+    return strand_occupancy
+
 def __get_genome_from_filename__(filepath):
     ''' Extracts genome from a filepath by removing the full 
         path and the extension '''
@@ -2035,14 +2793,215 @@ def __get_genome_from_filename__(filepath):
     filename = os.path.split(filepath)[1] # remove full path
     return os.path.splitext(filename)[0] # remove extension
 
-def __get_header_from_fasta_line__(line):
-    ''' Extracts a short header from a full header line in a fasta'''
-    return line.split()[0][1:].strip()
-
 def __hash_sequence__(seq):
     ''' Hashes arbitary length strings/sequences to bytestrings '''
     return hashlib.sha256(seq).digest()
 
+def __hash_fasta_shard__(genome_paths):
+    ''' Worker for consolidate_seqs(n_jobs > 1). Hashes all records in a shard of
+        genomes, returning (header, hash) pairs for valid records in order, headers
+        without sequences, and the sequence text of each hash first seen in the shard '''
+    shard_records = []; shard_missing = []; shard_seqs = {}
+    for genome_path in genome_paths:
+        for header, seq_blocks in iter_fasta(genome_path, skip_empty=False, short_headers=True, 
+                                             decode=True, keep_lines=True):
+            seq = ''.join(seq_blocks).encode('utf-8')
+            if len(header) > 0 and len(seq) > 0: # valid header-sequence record
+                seqhash = __hash_sequence__(seq)
+                shard_records.append((header, seqhash))
+                if not seqhash in shard_seqs:
+                    shard_seqs[seqhash] = '\n'.join(seq_blocks)
+            elif len(header) > 0: # header without sequence
+                shard_missing.append(header)
+    return shard_records, shard_missing, shard_seqs
+
+def __hash_fasta_genomes__(genome_paths):
+    ''' Worker for consolidate_seqs(seq_store=...). Hashes all records per genome, 
+        returning (header, hash) pairs for valid records in order, headers without 
+        sequences, and the unwrapped sequence of each hash, for each genome '''
+    genome_results = []
+    for genome_path in genome_paths:
+        genome_records = []; genome_missing = []; genome_seqs = {}
+        for header, seq_blocks in iter_fasta(genome_path, skip_empty=False, short_headers=True, 
+                                             decode=True, keep_lines=True):
+            seq = ''.join(seq_blocks)
+            if len(header) > 0 and len(seq) > 0: # valid header-sequence record
+                seqhash = __hash_sequence__(seq.encode('utf-8'))
+                genome_records.append((header, seqhash))
+                genome_seqs[seqhash] = seq
+            elif len(header) > 0: # header without sequence
+                genome_missing.append(header)
+        genome_results.append((genome_records, genome_missing, genome_seqs))
+    return genome_results
+
+def __shard_paths__(genome_paths, n_jobs, shard_size=None):
+    ''' Splits genome paths into shards of consecutive genomes for worker processes.
+        If shard_size is None, uses ~4 shards per worker, at most 64 genomes per shard '''
+    if shard_size is None:
+        n_workers = os.cpu_count() if n_jobs < 0 else n_jobs
+        shard_size = int(np.ceil(len(genome_paths) / (4.0 * n_workers)))
+        shard_size = min(max(shard_size, 1), 64)
+    return [genome_paths[i:i+shard_size] for i in range(0, len(genome_paths), shard_size)]
+
+__WORKER_STATE__ = {} # read-only keyword arguments shared with __map_genomes__ workers
+
+def __map_genomes__(worker, tasks, n_jobs=1, shared=None, log_interval=1):
+    ''' Runs worker(*args, **shared) for each (genome, args) task, serially if n_jobs == 1, 
+        otherwise on a process pool, returning results in task order. When serial, prints every
+        log_interval-th genome, or none if log_interval is None (i.e. callers that report progress
+        themselves). Where available, workers
+        are forked after shared is set as module state, so large shared objects (i.e. the
+        feature_to_allele dict) are inherited copy-on-write rather than pickled per task.
+        Otherwise, shared is sent once to each worker when it starts. '''
+    shared = {} if shared is None else shared
+    if n_jobs == 1:
+        results = []
+        for i, (genome, args) in enumerate(tasks):
+            if log_interval and (i+1) % log_interval == 0:
+                print(i+1, genome)
+            results.append(worker(*args, **shared))
+        return results
+    
+    import multiprocessing as mp, gc
+    n_workers = os.cpu_count() if n_jobs < 0 else n_jobs
+    n_workers = max(1, min(n_workers, len(tasks)))
+    print('Processing', len(tasks), 'genomes with', n_workers, 'workers...')
+    pool = None
+    try: # state is reset even if the pool fails to start
+        if 'fork' in mp.get_all_start_methods(): # share state copy-on-write
+            __WORKER_STATE__.update(shared)
+            gc.freeze() # keep the garbage collector from touching (and copying) inherited objects
+            pool = mp.get_context('fork').Pool(n_workers)
+        else: # send state once per worker
+            pool = mp.get_context().Pool(n_workers, initializer=__WORKER_STATE__.update, initargs=(shared,))
+        results = pool.starmap(__run_genome_task__, [(worker, args) for genome, args in tasks], chunksize=1)
+        pool.close()
+    finally:
+        if not pool is None:
+            pool.terminate()
+            pool.join()
+        __WORKER_STATE__.clear()
+        gc.unfreeze()
+    return results
+
+def __run_genome_task__(worker, args):
+    ''' Runs one __map_genomes__ task in a worker process with the shared state '''
+    return worker(*args, **__WORKER_STATE__)
+
+def __find_missing_proximal__(genome_fna, table_prox, nr_prox):
+    ''' Worker for validate_proximal_table_direct(). Returns names of proximal 
+        sequences in table_prox that are not found in either strand of the genome '''
+    contigs = ContigStore(genome_fna)
+    found = contigs.contains([nr_prox[x] for x in table_prox])
+    return [x for x, is_found in zip(table_prox, found) if not is_found]
+
+def __sorted_digest_index__(digests, report=None):
+    ''' Sorts a list of digests (bytes) into an 'S32' array for np.searchsorted lookups,
+        returning the sorted unique digests and the index of each in the original list. 
+        For repeated digests, the last index is kept, and optionally its entry 
+        in report (i.e. headers) is printed as a collision. '''
+    digests = np.array(digests, dtype='S32')
+    order = np.argsort(digests, kind='stable')
+    sorted_digests = digests[order]
+    is_last = np.ones(len(order), dtype='bool') # keep last of each run of equal digests
+    is_last[:-1] = sorted_digests[:-1] != sorted_digests[1:]
+    if not report is None:
+        for i in np.sort(order[np.flatnonzero(~is_last) + 1]):
+            print('COLLISION:', report[i])
+    return sorted_digests[is_last], order[is_last]
+
+def __lookup_digests__(sorted_digests, digests):
+    ''' Finds digests (bytes) in an array from __sorted_digest_index__(),
+        returning their positions, or -1 if absent '''
+    digests = np.array(digests, dtype='S32')
+    if len(sorted_digests) == 0:
+        return np.full(len(digests), -1, dtype='int64')
+    positions = np.minimum(np.searchsorted(sorted_digests, digests), len(sorted_digests) - 1)
+    return np.where(sorted_digests[positions] == digests, positions, -1)
+
+def __find_genome_features__(genome_fasta, seq_digests, seq_ids, name_digests=None, name_genes=None):
+    ''' Worker for validate_table_against_fasta(). Returns the sorted unique ids of 
+        non-redundant features found in a genome fasta, and the number of records 
+        without a matching non-redundant sequence. If name_digests is provided, 
+        records are matched by sequence and the gene of the feature name. '''
+    feature_names = []; seqs = []
+    for feature_name, seq in iter_fasta(genome_fasta, short_headers=True, decode=True):
+        feature_names.append(feature_name); seqs.append(seq)
+    if not name_digests is None: # also validating allele name
+        feature_names = [x.split('_upstream(')[0].split('_downstream(')[0] for x in feature_names]
+        name_positions = __lookup_digests__(name_digests, [__hash_sequence__(x.encode()) for x in feature_names])
+        seqs = [seq if p < 0 else seq + name_genes[p] for seq, p in zip(seqs, name_positions)]
+    seq_positions = __lookup_digests__(seq_digests, [__hash_sequence__(x.encode()) for x in seqs])
+    ''' Note: Sequence hashes may be missing if any original
+        sequences were excluded intentionally, i.e. too short '''
+    is_found = seq_positions >= 0
+    return np.unique(seq_ids[seq_positions[is_found]]), int((~is_found).sum())
+
+def __load_gff_annotations__(genome_gff, flexible_locus_tag=False, allowed_features=None):
+    ''' Worker for extract_annotations(). Maps feature IDs (2-term and/or 3-term, 
+        see extract_annotations) to products for features in a GFF file '''
+    annotations = {}
+    with open(genome_gff,'r') as f_gff:
+        for line in f_gff:
+            data = line.strip().split('\t')
+            if len(data) == 9: 
+                feature_type = data[2]
+                if allowed_features is None or feature_type in allowed_features:
+                    line_annots = dict(x.split('=', 1) for x in data[-1].split(';') if '=' in x)
+                    if 'ID' in line_annots and 'product' in line_annots:
+                        product = line_annots['product']
+                        product = urllib.parse.unquote(product) # replace % hex characters
+                        fid2 = line_annots['ID']; fid3 = None
+                        if 'locus_tag' in line_annots:
+                            fid3 = fid2 + '|' + line_annots['locus_tag']
+                        if flexible_locus_tag: # save both names when possible
+                            annotations[fid2] = product
+                            if not fid3 is None:
+                                annotations[fid3] = product
+                        else: # save only 3-term, or only 2-term if no locus_tag 
+                            fid = fid2 if (fid3 is None) else fid3
+                            annotations[fid] = product
+    return annotations
+
+def __lookup_annotations__(db, fids):
+    ''' Loads products for a set of feature IDs from an SQLite annotation index '''
+    fids = list(fids); lookup = {}
+    for i in range(0, len(fids), 500):
+        fid_batch = fids[i:i+500]
+        query = 'SELECT fid, product FROM annotations WHERE fid IN (' + ','.join('?' * len(fid_batch)) + ')'
+        lookup.update(db.execute(query, fid_batch))
+    return lookup
+
+def __fetch_annotations__(annotation_file, features, cache=True):
+    ''' Reads annotations for features present in an annotation file, via 
+        index_annotations(), as a dict mapping features to ";"-joined annotations '''
+    annotation_index = index_annotations(annotation_file, cache=cache)
+    indexed_features = annotation_index['features']
+    if len(features) == 0 or len(indexed_features) == 0:
+        return {}
+    queries = np.array([x.encode() for x in features], dtype='S')
+    positions = np.minimum(np.searchsorted(indexed_features, queries), len(indexed_features) - 1)
+    found = np.flatnonzero(indexed_features[positions] == queries)
+    annotations = {}
+    with open(annotation_file, 'rb') as f:
+        for i in found[np.argsort(annotation_index['offsets'][positions[found]])]: # read in file order
+            p = positions[i]
+            line = os.pread(f.fileno(), int(annotation_index['lengths'][p]), int(annotation_index['offsets'][p]))
+            data = line.decode().strip().split('\t')
+            annotations[features[i]] = ';'.join(data[1:])
+    return annotations
+
+def __write_cluster_annotations__(f_out, cluster, cluster_alleles, cluster_annots):
+    ''' Writes the most common annotation of a cluster as <cluster>\t<annotations>, 
+        followed by <allele>\t<annotations> for alleles with other annotations '''
+    if cluster is None: # no cluster yet
+        return
+    most_common_annot, count = collections.Counter(cluster_annots).most_common(1)[0]
+    f_out.write(cluster + '\t' + most_common_annot + '\n')
+    for allele, annots in zip(cluster_alleles, cluster_annots):
+        if annots != most_common_annot:
+            f_out.write(allele + '\t' + annots + '\n')
+
 def __stream_stdout__(command):
     ''' Hopefully Jupyter-safe method for streaming process stdout '''
     process = sp.Popen(command, stdout=sp.PIPE, shell=True)
@@ -2053,7 +3012,7 @@ def __stream_stdout__(command):
         yield line.rstrip()
 
 
-def find_pangenome_segments(df_genes, threshold=0.1, ax=None):
+def find_pangenome_segments(df_genes, threshold=0.1, ax=None, cache=False):
     '''
     Computes the gene frequency thresholds at which a gene can be categorized as 
     core, accessory, or unique. Specifically, models the gene frequency distribution
@@ -2081,6 +3040,9 @@ def find_pangenome_segments(df_genes, threshold=0.1, ax=None):
         that determines if a gene is core, unique, or accessory (default 0.1)
     ax : plt.axes
         If provided, plots pangenome frequency CDF with segments (default None)
+    cache : bool
+        If True, reuses gene frequencies from earlier calls on the same df_genes
+        object. Only use if df_genes is not modified in place between calls (default False)
         
     Returns
     -------
@@ -2096,8 +3058,8 @@ def find_pangenome_segments(df_genes, threshold=0.1, ax=None):
     '''
 
     ''' Computing gene frequencies and frequency counts '''
-    if type(df_genes) == pd.DataFrame: # data frame provided
-        df_gene_freq = df_genes.fillna(0).sum(axis=1)
+    if type(df_genes) == pd.DataFrame: # data frame provided, summed from sparse storage
+        df_gene_freq = pd.Series(data=_get_row_sums(df_genes, cache=cache), index=df_genes.index)
     else: # array provided
         df_gene_freq = pd.Series(data=df_genes.sum(axis=1), index=map(lambda x: 'G' + str(x), range(df_genes.shape[0])))
     df_freq_counts = df_gene_freq.value_counts()
@@ -2168,53 +3130,153 @@ import scipy.sparse
 from scipy.sparse import coo_matrix
 
 
-def estimate_pan_core_size(df_genes, num_iter=10, log_batch=1):
+def estimate_pan_core_size(df_genes, num_iter=10, log_batch=1, exact=False, max_block=10**7):
     '''
-    Computes pan/core genome size curves for many randomizations
+    Computes pan/core genome size curves for many randomizations, or their 
+    expected values over all strain orderings.
+    
+    After k strains, a gene is counted as core if found in >= 98.7% of them, as 
+    accessory if found in more than 3.7% of k-1 strains but < 98.7% of k, and as
+    rare if found in at least one but < 3.7% of k-1 strains.
+    
+    Parameters
+    ----------
+    df_genes : pd.DataFrame
+        Binary gene x strain table (sparse or dense)
+    num_iter : int
+        Number of random strain orderings to simulate, ignored if exact=True (default 10)
+    log_batch : int
+        Reports progress every log_batch iterations (default 1)
+    exact : bool
+        If True, computes the expected curves over all strain orderings from the
+        gene frequency histogram instead of simulating orderings. The number of 
+        strains containing a gene of frequency f among k random strains follows
+        a hypergeometric distribution, so each curve is a sum of hypergeometric
+        tail probabilities (default False)
+    max_block : int
+        Maximum number of (strain count, gene frequency) pairs evaluated at once 
+        if exact=True, limits memory usage (default 10**7)
+        
+    Returns
+    -------
+    df_pan_core : pd.DataFrame
+        Pan/Core/Acc/Rare sizes after 1..n strains in columns Pan1..Pann, Core1..Coren,
+        etc. Rows are iterations (Iter1..Iternum_iter), or if exact=True, the 
+        expected size (Mean) and its variance (Var). The variance sums the variance
+        of each gene's category and ignores co-occurrence between genes.
     '''
     from tqdm import trange
     num_genes, num_strains = df_genes.shape
+    thresholds = __get_pan_core_thresholds__(num_strains)
+
+    if exact:
+        ''' Sum hypergeometric tail probabilities over the gene frequency histogram '''
+        gene_data = _to_scipy_sparse(df_genes).tocsr()
+        freqs = np.diff(gene_data.indptr)
+        freqs, freq_counts = np.unique(freqs[freqs > 0], return_counts=True)
+        tails = {x:np.zeros((num_strains, len(freqs))) for x in thresholds}
+        block = max(1, max_block // max(1, num_strains))
+        for i in range(0, len(freqs), block):
+            for label, threshold in thresholds.items():
+                tails[label][:,i:i+block] = __get_hypergeom_tails__(freqs[i:i+block], num_strains, threshold)
+        category_probs = [tails['any'], tails['core'], tails['acc'] - tails['core'], tails['any'] - tails['rare']]
+        curves = [np.vstack([x @ freq_counts, (x * (1 - x)) @ freq_counts]) for x in category_probs]
+        row_index = ['Mean', 'Var']
     
-    #gene_data = sparse_arrays_to_sparse_matrix(df_genes)
-    #gene_data = coo_matrix(df_genes)
-    gene_data = df_genes.sparse.to_coo()
-    
-    gene_data = gene_data.T.tocsr() # now strain x cluster
-    pan_genomes = np.zeros((num_iter, num_strains)) # estimated pan-genome curve per iteration
-    core_genomes = np.zeros((num_iter, num_strains)) # estimated core-genome curve per iteration
-    
-    acc_genomes = np.zeros((num_iter, num_strains)) # estimated acc-genome curve per iteration
-    rare_genomes = np.zeros((num_iter, num_strains)) # estimated rare-genome curve per iteration
-
-    ''' Simulate pan/core-genomes for randomly ordered strains '''
-    for i in trange(num_iter):
-        if (i+1) % log_batch == 0:
-            print('Iteration', i+1, 'of', num_iter)
-        shuffle_indices = np.arange(num_strains)
-        np.random.shuffle(shuffle_indices)
-        gene_incidence = np.zeros(num_genes, dtype='int')
-        for j,shuffle_col in enumerate(shuffle_indices):
-            gene_incidence += gene_data[shuffle_col,:]
-            #print(gene_incidence)
-            pan_genomes[i,j] = (gene_incidence > 0).sum()
-            core_genomes[i,j] = (gene_incidence >= (j+1)*0.987).sum()
+    else:
+        ''' Simulate pan/core-genomes for randomly ordered strains '''
+        gene_data = _to_scipy_sparse(df_genes).T.tocsr() # now strain x cluster
+        curves = [np.zeros((num_iter, num_strains)) for _ in range(4)] # pan, core, acc, rare curves per iteration
+        for i in trange(num_iter):
+            if (i+1) % log_batch == 0:
+                print('Iteration', i+1, 'of', num_iter)
+            shuffle_indices = np.arange(num_strains)
+            np.random.shuffle(shuffle_indices)
             
-            acc_genomes[i,j] = ((gene_incidence > j*0.037 ) & (gene_incidence < (j+1)*0.987)).sum()
-            rare_genomes[i,j] = ((gene_incidence > 0 ) & (gene_incidence < j*0.037)).sum()
+            ''' Strain order in which each gene reaches 1, 2, ... strains '''
+            shuffled = gene_data[shuffle_indices,:].tocsc() # row indices sorted within each gene
+            positions = shuffled.indices
+            incidence = np.arange(len(positions)) - np.repeat(shuffled.indptr[:-1], np.diff(shuffled.indptr)) + 1
+            counts = {label:__count_genes_at_threshold__(positions, incidence, threshold) 
+                      for label, threshold in thresholds.items()}
+            curves[0][i] = counts['any']
+            curves[1][i] = counts['core']
+            curves[2][i] = counts['acc'] - counts['core']
+            curves[3][i] = counts['any'] - counts['rare']
+        row_index = map(lambda x: 'Iter' + str(x), range(1,num_iter+1))
 
     ''' Save to DataFrame '''
-    iter_index = map(lambda x: 'Iter' + str(x), range(1,num_iter+1))
     pan_cols = list(map(lambda x: 'Pan' + str(x), range(1,num_strains+1)))
     core_cols = list(map(lambda x: 'Core' + str(x), range(1,num_strains+1)))
     
     acc_cols = list(map(lambda x: 'Acc' + str(x), range(1,num_strains+1)))
     rare_cols = list(map(lambda x: 'Rare' + str(x), range(1,num_strains+1)))
     
-    df_pan_core = pd.DataFrame(index=iter_index, columns=pan_cols + core_cols + acc_cols + rare_cols,
-                               data=np.hstack([pan_genomes, core_genomes, acc_genomes, rare_genomes]))
+    df_pan_core = pd.DataFrame(index=row_index, columns=pan_cols + core_cols + acc_cols + rare_cols,
+                               data=np.hstack(curves))
     return df_pan_core
 
 
+def __get_pan_core_thresholds__(num_strains):
+    ''' 
+    Minimum number of strains containing a gene after 1..num_strains strains, for
+    the gene to be counted in each category used by estimate_pan_core_size:
+    any (>0), core (>=98.7% of k), acc (>3.7% of k-1) and rare (>=3.7% of k-1, 
+    i.e. no longer rare). Each threshold is >= 1 and increases by at most 1 per strain.
+    '''
+    j = np.arange(num_strains)
+    return {'any': np.ones(num_strains, dtype='int64'),
+            'core': np.ceil((j+1)*0.987).astype('int64'),
+            'acc': np.floor(j*0.037).astype('int64') + 1,
+            'rare': np.maximum(np.ceil(j*0.037), 1).astype('int64')}
+
+
+def __count_genes_at_threshold__(positions, incidence, threshold):
+    '''
+    Counts genes found in >= threshold[j] of the first j+1 strains for each j, given
+    the position in the strain order at which each gene reaches each incidence.
+    A gene is counted at j if it reached incidence m = threshold[j] at a position <= j.
+    '''
+    num_strains = len(threshold)
+    first = np.searchsorted(threshold, incidence, side='left') # first j with threshold == m
+    last = np.searchsorted(threshold, incidence, side='right') # one past the last such j
+    start = np.maximum(positions, first)
+    is_counted = start < last
+    change = np.bincount(start[is_counted], minlength=num_strains+1) \
+        - np.bincount(last[is_counted], minlength=num_strains+1)
+    return np.cumsum(change)[:num_strains]
+
+
+def __get_hypergeom_tails__(freqs, num_strains, threshold):
+    '''
+    Computes P(X_k >= threshold[k-1]) for k = 1..num_strains, where X_k is the number
+    of strains containing a gene of each frequency among k strains drawn without 
+    replacement (hypergeometric). Adding strain k+1 raises the tail by 
+    P(X_k = t-1) * (f-t+1) / (N-k), and raising the threshold from t to t+1 lowers 
+    it by P(X_k+1 = t), so each curve is a cumulative sum of closed-form terms.
+    '''
+    N = num_strains
+    f = np.asarray(freqs, dtype='float64')[None,:]
+    k = np.arange(1, N, dtype='float64')[:,None] # adding strain k+1 after k strains
+    t = threshold[:-1,None].astype('float64')
+    gain = __hypergeom_pmf__(t - 1, N, f, k) * np.maximum(f - t + 1, 0) / (N - k)
+    is_raised = (threshold[1:] > threshold[:-1])[:,None]
+    loss = np.where(is_raised, __hypergeom_pmf__(t, N, f, k + 1), 0)
+    tails = np.vstack([f / N, f / N + np.cumsum(gain - loss, axis=0)]) # threshold[0] == 1
+    return np.clip(tails, 0, 1)
+
+
+def __hypergeom_pmf__(x, N, f, k):
+    ''' P(X = x) for X ~ Hypergeometric(N total, f successes, k draws), vectorized '''
+    from scipy.special import gammaln
+    x, f, k = np.broadcast_arrays(x, f, k)
+    is_valid = (x >= 0) & (x <= f) & (x <= k) & (k - x <= N - f)
+    x, f, k = [np.where(is_valid, y, 0) for y in [x, f, k]]
+    log_choose = lambda n, r: gammaln(n + 1) - gammaln(r + 1) - gammaln(n - r + 1)
+    log_pmf = log_choose(f, x) + log_choose(N - f, k - x) - log_choose(N, k)
+    return np.where(is_valid, np.exp(log_pmf), 0)
+
+
 def fit_heaps(df_freqs):
     ''' Fits a single iteration to Heaps Law: PG size = kappa * (genes)^lambda_ '''
     heaps = lambda x, lambda_, kappa: kappa * np.power(x, lambda_)
@@ -2227,33 +3289,178 @@ def fit_heaps(df_freqs):
 
 def fit_heaps_by_iteration(df_pan_core, section='pan'):
     ''' Fits Heaps Law to each iteration and returns lambda_ and kappa for each iteration '''
-    #df = df_pan_core.iloc[:,:int(df_pan_core.shape[1]/2)].T
-    if section.lower() == 'pan':
-        df = df_pan_core[ [x for x in df_pan_core.columns if 'Pan' in x] ].T
-    elif section.lower() == 'core':
-        df = df_pan_core[ [x for x in df_pan_core.columns if 'Core' in x] ].T
-    elif section.lower() == 'acc':
-        df = df_pan_core[ [x for x in df_pan_core.columns if 'Acc' in x] ].T
-    elif section.lower() == 'rare':
-        df = df_pan_core[ [x for x in df_pan_core.columns if 'Rare' in x] ].T
-    
-    n_samples, n_iters = df.shape
-    heaps_fits = {}
-    for i,iter_label in enumerate(df.columns):
-        lambda_, kappa = fit_heaps(df.iloc[:,i])
-        heaps_fits[iter_label] = {'lambda_': lambda_, 'kappa': kappa}
-    return pd.DataFrame.from_dict(heaps_fits, orient='index').reindex(df.columns)
+    df_fits = fit_heaps_batch(df_pan_core, sections=[section], n_bootstrap=0)
+    df_fits = df_fits.loc[section.lower()]
+    df_fits.index.name = None
+    return df_fits
+
+
+def fit_heaps_batch(df_pan_core, sections=['pan','core','acc','rare'], n_bootstrap=100, 
+                    ci=0.95, seed=None, max_iter=100, max_block=10**7):
+    '''
+    Fits Heaps Law, size = kappa * (genomes)^lambda_, to every iteration of every 
+    section at once. Each curve is initialized by least squares in log-log space, 
+    then refined by vectorized Levenberg-Marquardt to the least squares fit in 
+    linear space (as in fit_heaps). Confidence intervals are estimated by 
+    resampling the points of each curve with replacement and refitting.
+
+    Parameters
+    ----------
+    df_pan_core : pd.DataFrame
+        Curves from estimate_pan_core_size, with columns Pan1..Pann, Core1..Coren, etc.
+    sections : list
+        Sections to fit, any of 'pan', 'core', 'acc', 'rare' (default all)
+    n_bootstrap : int
+        Number of bootstrap resamples per curve, 0 to skip confidence intervals (default 100)
+    ci : float
+        Confidence level of the percentile intervals (default 0.95)
+    seed : int
+        Seed for bootstrap resampling (default None)
+    max_iter : int
+        Maximum number of Levenberg-Marquardt iterations (default 100)
+    max_block : int
+        Maximum number of curve points fitted at once, limits memory usage (default 10**7)
+
+    Returns
+    -------
+    df_fits : pd.DataFrame
+        lambda_ and kappa per (section, iteration), and if n_bootstrap > 0, 
+        lambda_low, lambda_high, kappa_low and kappa_high
+    '''
+    df_pan_core = df_pan_core.drop(index='Var', errors='ignore') # variance of exact curves
+    rng = np.random.default_rng(seed)
+    section_labels = {'pan':'Pan', 'core':'Core', 'acc':'Acc', 'rare':'Rare'}
+    fits = []
+    for section in sections:
+        if not section.lower() in section_labels:
+            raise ValueError('Unknown section ' + str(section) + ', expected one of ' + str(list(section_labels)))
+        
+        ''' Get curve for each iteration, ordered by number of genomes '''
+        label = section_labels[section.lower()]
+        df_section = df_pan_core.filter(regex='^' + label + r'\d+$')
+        n_genomes = df_section.columns.str[len(label):].astype(int).values
+        order = np.argsort(n_genomes)
+        x = n_genomes[order].astype('float64')
+        Y = df_section.values[:,order].astype('float64')
+        
+        ''' Fit each curve '''
+        lambdas, kappas = __fit_heaps_curves__(x, Y, max_iter=max_iter)
+        df_fit = pd.DataFrame(index=pd.MultiIndex.from_product([[section.lower()], df_section.index], 
+                                                               names=['section', 'iteration']),
+                              data={'lambda_': lambdas, 'kappa': kappas})
+        
+        ''' Refit resampled curves for confidence intervals '''
+        if n_bootstrap > 0:
+            n_points = len(x)
+            block = max(1, max_block // (n_bootstrap * max(1, n_points)))
+            bounds = {'lambda_low':[], 'lambda_high':[], 'kappa_low':[], 'kappa_high':[]}
+            for i in range(0, Y.shape[0], block):
+                Y_block = Y[i:i+block]
+                weights = rng.multinomial(n_points, np.ones(n_points) / n_points, 
+                                          size=Y_block.shape[0] * n_bootstrap)
+                boot_lambdas, boot_kappas = __fit_heaps_curves__(
+                    x, np.repeat(Y_block, n_bootstrap, axis=0), weights=weights, max_iter=max_iter)
+                for name, boot_params in [('lambda', boot_lambdas), ('kappa', boot_kappas)]:
+                    boot_params = boot_params.reshape(Y_block.shape[0], n_bootstrap)
+                    low, high = np.nanquantile(boot_params, [(1-ci)/2, (1+ci)/2], axis=1)
+                    bounds[name + '_low'].append(low); bounds[name + '_high'].append(high)
+            for name, values in bounds.items():
+                df_fit[name] = np.concatenate(values)
+        fits.append(df_fit)
+    return pd.concat(fits)
+
+
+def __fit_heaps_curves__(x, Y, weights=None, max_iter=100, tol=1e-10):
+    '''
+    Weighted least squares fit of y = kappa * x^lambda_ to each row of Y. Returns 
+    arrays of lambda_ and kappa with one value per row.
+    '''
+    W = np.ones(Y.shape) if weights is None else np.asarray(weights, dtype='float64')
+    log_x = np.log(x)[None,:]
+    
+    ''' Initialize with least squares on log(y) = log(kappa) + lambda_ * log(x) '''
+    W_log = W * (Y > 0)
+    log_y = np.log(np.where(Y > 0, Y, 1))
+    total = W_log.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = (W_log * log_x).sum(axis=1) / total
+        mean_y = (W_log * log_y).sum(axis=1) / total
+        sxx = (W_log * (log_x - mean_x[:,None])**2).sum(axis=1)
+        sxy = (W_log * (log_x - mean_x[:,None]) * (log_y - mean_y[:,None])).sum(axis=1)
+        is_loglinear = sxx > 0
+        lambdas = np.where(is_loglinear, sxy / sxx, 0)
+        kappas = np.where(is_loglinear, np.exp(mean_y - lambdas * mean_x), 
+                          (W * Y).sum(axis=1) / W.sum(axis=1))
+    
+    ''' Refine with Levenberg-Marquardt '''
+    residual_ss = lambda lambdas, kappas: (W * (Y - kappas[:,None] * np.exp(lambdas[:,None] * log_x))**2).sum(axis=1)
+    sse = residual_ss(lambdas, kappas)
+    damping = np.full(Y.shape[0], 1e-3)
+    is_active = np.isfinite(sse)
+    for _ in range(max_iter):
+        if not is_active.any():
+            break
+        power = np.exp(lambdas[:,None] * log_x)
+        fitted = kappas[:,None] * power
+        jac_lambda, jac_kappa = fitted * log_x, power
+        residuals = Y - fitted
+        a11 = (W * jac_lambda**2).sum(axis=1)
+        a12 = (W * jac_lambda * jac_kappa).sum(axis=1)
+        a22 = (W * jac_kappa**2).sum(axis=1)
+        g1 = (W * jac_lambda * residuals).sum(axis=1)
+        g2 = (W * jac_kappa * residuals).sum(axis=1)
+        a11, a22 = a11 * (1 + damping), a22 * (1 + damping)
+        det = a11 * a22 - a12**2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step_lambda = np.where(is_active & (det > 0), (a22 * g1 - a12 * g2) / det, 0)
+            step_kappa = np.where(is_active & (det > 0), (a11 * g2 - a12 * g1) / det, 0)
+        with np.errstate(over='ignore', invalid='ignore'):
+            new_sse = residual_ss(lambdas + step_lambda, kappas + step_kappa)
+        is_better = is_active & (new_sse < sse)
+        lambdas = np.where(is_better, lambdas + step_lambda, lambdas)
+        kappas = np.where(is_better, kappas + step_kappa, kappas)
+        damping = np.where(is_better, damping / 10, damping * 10)
+        
+        ''' Stop curves that no longer improve '''
+        is_converged = is_better & (sse - new_sse <= tol * sse)
+        sse = np.where(is_better, new_sse, sse)
+        is_active &= ~(is_converged | (damping > 1e10))
+    return lambdas, kappas
 
 
 
 # Generate submatrices to measure robustness
-def get_gene_frequency_submatrices(P, breakpoints=[0, 25, 50, 75, 100]):
+def get_gene_frequency_submatrices(P, breakpoints=[0, 25, 50, 75, 100], return_masks=False, cache=False):
+    '''
+    Splits genes by frequency (% of genomes) between each pair of breakpoints,
+    (min_freq, max_freq]. Gene frequencies are summed from the sparse storage of P.
+
+    Parameters
+    ----------
+    P : pd.DataFrame
+        Binary gene x genome table (sparse or dense)
+    breakpoints : list
+        Gene frequency breakpoints in % (default [0, 25, 50, 75, 100])
+    return_masks : bool
+        If True, returns boolean row masks of P instead of submatrix copies, 
+        keeping memory use near the size of P (default False)
+    cache : bool
+        If True, reuses gene frequencies from earlier calls on the same P object.
+        Only use if P is not modified in place between calls (default False)
+
+    Returns
+    -------
+    result : dict
+        Nested dict result[min_freq][max_freq] with the submatrix of P (or row mask)
+        for genes with min_freq < frequency <= max_freq. Empty DataFrame (or all-False
+        mask) if min_freq >= max_freq.
+    '''
     # Convert the matrix P into a DataFrame if it isn't already
     if not isinstance(P, pd.DataFrame):
         P = pd.DataFrame(P)
     
     # Calculate the gene frequencies as percentages
-    gene_frequencies = P.sum(axis=1) / P.shape[1] * 100
+    gene_frequencies = _get_row_sums(P, cache=cache) / P.shape[1] * 100
     
     # Initialize a nested dictionary to store the submatrices
     result = {min_freq: {max_freq: None for max_freq in breakpoints} for min_freq in breakpoints}
@@ -2261,10 +3468,11 @@ def get_gene_frequency_submatrices(P, breakpoints=[0, 25, 50, 75, 100]):
     for min_freq in breakpoints:
         for max_freq in breakpoints:
             if min_freq < max_freq:
-                submatrix = P[(gene_frequencies > min_freq) & (gene_frequencies <= max_freq)]
-                result[min_freq][max_freq] = submatrix
+                mask = (gene_frequencies > min_freq) & (gene_frequencies <= max_freq)
+                result[min_freq][max_freq] = mask if return_masks else P[mask]
             else:
-                result[min_freq][max_freq] = pd.DataFrame() # empty DataFrame
+                result[min_freq][max_freq] = np.zeros(P.shape[0], dtype=bool) if return_masks \
+                    else pd.DataFrame() # empty DataFrame
 
     return result
 
@@ -0,0 +1,227 @@
+'''
+Persistent, content-addressed store of sequences and headers, shared across
+pangenome construction runs (see pangenome.consolidate_seqs).
+'''
+
+import os, sqlite3
+
+from pyphylon.alleles import HeaderAlleleMap
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sequences (
+    digest BLOB PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS headers (
+    source TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    header TEXT NOT NULL,
+    digest BLOB,
+    PRIMARY KEY (source, rank)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS headers_by_digest ON headers (digest);
+CREATE INDEX IF NOT EXISTS headers_by_header ON headers (header);
+CREATE TABLE IF NOT EXISTS alleles (
+    label TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    allele TEXT NOT NULL,
+    PRIMARY KEY (label, digest)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS label_sources (
+    label TEXT NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (label, source)
+) WITHOUT ROWID;
+'''
+
+
+class SequenceStore(object):
+    '''
+    On-disk, append-only sequence store indexed by SHA-256 digest. Sequences are
+    appended to a flat side file (<path>.seqs) and located through a SQLite index
+    (<path>), which also records:
+
+    - header postings: the headers of each source FASTA in file order, with
+      the digest of their sequence (NULL for headers without sequences)
+    - sources: size and modification time of each source FASTA, so that
+      unchanged files can be reused without re-reading or re-hashing them
+    - alleles: digest to allele name mappings per build label, i.e. <name>_C
+      for CDS or <name>_T for non-coding builds, see pangenome.rename_genes_and_alleles
+    - label sources: source FASTAs of each build label, so that headers of other
+      builds sharing the store are never mapped to its alleles
+
+    Memory use does not depend on the number of stored sequences.
+
+    Parameters
+    ----------
+    path : str
+        Path to the SQLite index, created if missing. Sequences are stored in <path>.seqs
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.seqs_path = path + '.seqs'
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.seqs_out = open(self.seqs_path, 'ab')
+        self.seqs_in = open(self.seqs_path, 'rb')
+        self.__reconcile__()
+
+    def __reconcile__(self):
+        ''' Drops index entries beyond the end of the sequence file, i.e. if
+            a previous run was interrupted between appending and committing '''
+        size = os.path.getsize(self.seqs_path)
+        self.db.execute('DELETE FROM sequences WHERE offset + length > ?', (size,))
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        ''' Closes the index and sequence file '''
+        self.db.commit()
+        self.db.close()
+        self.seqs_out.close()
+        self.seqs_in.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM sequences').fetchone()[0]
+
+    def __contains__(self, digest):
+        return self.db.execute('SELECT 1 FROM sequences WHERE digest = ?',
+                               (digest,)).fetchone() is not None
+
+    def is_current(self, source):
+        ''' Returns True if the FASTA at path source has been stored and has
+            not changed (same size and modification time) since '''
+        stat = os.stat(source)
+        row = self.db.execute('SELECT size, mtime FROM sources WHERE source = ?',
+                              (os.path.abspath(source),)).fetchone()
+        return row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns
+
+    def add_source(self, source, records, missing, seqs):
+        '''
+        Stores the contents of a hashed FASTA, replacing any previous version.
+
+        Parameters
+        ----------
+        source : str
+            Path to the FASTA file
+        records : list
+            (header, digest) for each header with a sequence, in file order
+        missing : list
+            Headers without sequences
+        seqs : dict
+            Maps each digest in records to its sequence (str or bytes). Sequences
+            with digests already in the store are not stored again
+        '''
+        stat = os.stat(source)
+        source = os.path.abspath(source)
+        self.db.execute('DELETE FROM headers WHERE source = ?', (source,))
+        offset = self.seqs_out.seek(0, os.SEEK_END)
+        new_seqs = []
+        for digest in dict.fromkeys(digest for header, digest in records):
+            if not digest in self:
+                seq = seqs[digest]
+                seq = seq.encode() if isinstance(seq, str) else seq
+                self.seqs_out.write(seq)
+                new_seqs.append((digest, offset, len(seq)))
+                offset += len(seq)
+        self.seqs_out.flush()
+        self.db.executemany('INSERT OR IGNORE INTO sequences VALUES (?,?,?)', new_seqs)
+        postings = [(source, i, header, digest) for i, (header, digest) in enumerate(records)]
+        postings += [(source, len(records) + i, header, None) for i, header in enumerate(missing)]
+        self.db.executemany('INSERT INTO headers VALUES (?,?,?,?)', postings)
+        self.db.execute('INSERT OR REPLACE INTO sources VALUES (?,?,?)',
+                        (source, stat.st_size, stat.st_mtime_ns))
+        self.db.commit()
+
+    def get_source(self, source):
+        '''
+        Returns the stored contents of a FASTA, see add_source().
+
+        Returns
+        -------
+        records : list
+            (header, digest) for each header with a sequence, in file order
+        missing : list
+            Headers without sequences
+        '''
+        records = []; missing = []
+        rows = self.db.execute('SELECT header, digest FROM headers WHERE source = ? ORDER BY rank',
+                               (os.path.abspath(source),))
+        for header, digest in rows:
+            if digest is None:
+                missing.append(header)
+            else:
+                records.append((header, digest))
+        return records, missing
+
+    def get_sequence(self, digest, decode=True):
+        ''' Returns the sequence with a given digest, as str if decode else bytes '''
+        row = self.db.execute('SELECT offset, length FROM sequences WHERE digest = ?',
+                              (digest,)).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        seq = os.pread(self.seqs_in.fileno(), row[1], row[0])
+        return seq.decode() if decode else seq
+
+    def set_alleles(self, label, header_to_allele, sources):
+        '''
+        Records allele names for a build, using the digest of each header's sequence
+        in the build's source FASTAs.
+
+        Parameters
+        ----------
+        label : str
+            Build label, i.e. <name>_C for CDS builds or <name>_T for non-coding builds
+        header_to_allele : dict or HeaderAlleleMap
+            Maps headers (at least one per allele) to allele names
+        sources : list
+            Paths to the FASTA files of the build, already stored with add_source(),
+            in the order they were consolidated. If a header occurs in several sources,
+            its first occurrence in this order is used, same as consolidate_seqs()
+        '''
+        self.db.execute('DELETE FROM alleles WHERE label = ?', (label,))
+        self.db.execute('DELETE FROM label_sources WHERE label = ?', (label,))
+        self.db.executemany('INSERT OR IGNORE INTO label_sources VALUES (?,?)',
+                            ((label, os.path.abspath(source)) for source in sources))
+        self.db.execute('''CREATE TEMP TABLE IF NOT EXISTS build_sources (
+                               source TEXT PRIMARY KEY, position INTEGER NOT NULL) WITHOUT ROWID''')
+        self.db.execute('DELETE FROM build_sources')
+        self.db.executemany('INSERT OR IGNORE INTO build_sources VALUES (?,?)',
+                            ((os.path.abspath(source), i) for i, source in enumerate(sources)))
+        self.db.executemany(
+            '''INSERT OR REPLACE INTO alleles (label, digest, allele)
+               SELECT ?, h.digest, ? FROM headers h 
+               JOIN build_sources s ON s.source = h.source
+               WHERE h.header = ? AND h.digest IS NOT NULL
+               ORDER BY s.position, h.rank LIMIT 1''',
+            ((label, allele, header) for header, allele in header_to_allele.items()))
+        self.db.execute('DELETE FROM build_sources')
+        self.db.commit()
+
+    def has_alleles(self, label):
+        ''' Returns True if allele names have been recorded for a build label '''
+        return self.db.execute('SELECT 1 FROM alleles WHERE label = ? LIMIT 1',
+                               (label,)).fetchone() is not None
+
+    def get_header_to_allele(self, label):
+        ''' Returns a HeaderAlleleMap (read-only, dict-like) mapping every header of the
+            build's sources to its allele name for a build label, including headers 
+            sharing the same sequence '''
+        rows = self.db.execute(
+            '''SELECT h.header, a.allele FROM alleles a
+               JOIN headers h ON h.digest = a.digest
+               JOIN label_sources s ON s.label = a.label AND s.source = h.source
+               WHERE a.label = ?''', (label,))
+        return HeaderAlleleMap.from_items(rows)
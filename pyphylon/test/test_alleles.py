@@ -0,0 +1,43 @@
+import pickle
+import numpy as np
+from pyphylon.alleles import HeaderAlleleMap, hash_headers
+
+
+def test_header_allele_map_lookup():
+    headers = ['fig|798300.3.peg.%d' % i for i in range(200)] + ['fig|798300.3.peg.5']
+    alleles = ['Test_C%dA0' % (i // 3) for i in range(200)] + ['Test_C99A1'] # repeated header, last wins
+    expected = dict(zip(headers, alleles))
+    header_to_allele = HeaderAlleleMap(headers, alleles)
+    
+    assert len(header_to_allele) == len(expected) == 200
+    assert header_to_allele == expected and dict(header_to_allele.items()) == expected
+    assert header_to_allele['fig|798300.3.peg.5'] == 'Test_C99A1'
+    assert 'fig|798300.3.peg.0' in header_to_allele and not 'missing' in header_to_allele
+    assert header_to_allele.get('missing') is None and not 1 in header_to_allele
+    assert [x.decode() for x in header_to_allele.alleles] == sorted(set(alleles)) # unused Test_C1A0 dropped
+    
+    allele_ids = header_to_allele.get_ids(['fig|798300.3.peg.7', 'missing', b'fig|798300.3.peg.7'])
+    assert allele_ids[1] == -1 and allele_ids[0] == allele_ids[2]
+    assert header_to_allele.alleles[allele_ids[0]] == b'Test_C2A0'
+    assert pickle.loads(pickle.dumps(header_to_allele)) == expected
+
+
+def test_header_allele_map_with_entries():
+    header_to_allele = HeaderAlleleMap(['a', 'b'], ['Test_C0A0', 'Test_C1A0'])
+    updated = header_to_allele.with_entries(['b', 'c'], ['Test_C0A0', 'Test_C2A0'])
+    assert updated == {'a':'Test_C0A0', 'b':'Test_C0A0', 'c':'Test_C2A0'}
+    assert list(updated.alleles) == [b'Test_C0A0', b'Test_C2A0']
+    assert header_to_allele == {'a':'Test_C0A0', 'b':'Test_C1A0'} # unchanged
+    assert len(HeaderAlleleMap()) == 0 and list(HeaderAlleleMap().get_ids(['a'])) == [-1]
+
+
+def test_header_allele_map_word_boundaries():
+    headers = ['', 'a', 'abcdefg', 'abcdefgh', 'abcdefghi', 'abcdefghijklmnop', 'abcdefghijklmnopq', 'abé']
+    alleles = ['Test_C%dA0' % i for i in range(len(headers))]
+    header_to_allele = HeaderAlleleMap(reversed(headers), reversed(alleles)) # iterables are streamed
+    assert header_to_allele == dict(zip(headers, alleles))
+    assert [header_to_allele[x] for x in headers] == alleles # single lookups hash in pure Python
+    assert header_to_allele.get_many(headers + ['abcdefgh\t', 'abcdefg\0']) == alleles + [None, None]
+    assert list(header_to_allele.get_ids([x.encode() for x in headers])) == list(range(len(headers)))
+    assert list(hash_headers(headers)) == [hash_headers([x])[0] for x in headers]
+    assert HeaderAlleleMap.from_items(zip(headers, alleles)) == header_to_allele
@@ -0,0 +1,43 @@
+import os
+import numpy as np
+from pyphylon.cdhit import read_clstr
+
+CLSTR = 'pyphylon/test/data/cd-hit-results/test_files.clstr'
+
+
+def test_read_clstr_matches_line_parser():
+    clstr = read_clstr(CLSTR)
+    cluster_num = None; members = []
+    with open(CLSTR, 'r') as f:
+        for line in f:
+            if line[0] == '>':
+                cluster_num = int(line.split()[-1])
+            else:
+                data = line.split()
+                members.append((cluster_num, int(data[0]), data[2][1:-3], line.strip().endswith('*')))
+    assert len(clstr['header']) == len(members)
+    assert list(zip(clstr['cluster'].tolist(), clstr['member'].tolist(), clstr['header'].tolist(), 
+                    clstr['is_representative'].tolist())) == members
+    assert np.isnan(clstr['identity'][clstr['is_representative']]).all()
+    assert (clstr['identity'][~clstr['is_representative']] > 0).all()
+
+
+def test_read_clstr_formats_and_cache(tmp_path):
+    clstr_file = str(tmp_path / 'test.clstr')
+    with open(clstr_file, 'w') as f:
+        f.write('>Cluster 0\n0\t1200nt, >seq1... *\n1\t1150nt, >seq2... at +/97.50%\n')
+        f.write('>Cluster 3\n0\t90aa, >seq3... *\n1\t88aa, >seq4... at 1:88:3:90/95.45%\n')
+    clstr = read_clstr(clstr_file, cache=True)
+    assert clstr['cluster'].tolist() == [0, 0, 3, 3]
+    assert clstr['header'].tolist() == ['seq1', 'seq2', 'seq3', 'seq4']
+    assert clstr['length'].tolist() == [1200, 1150, 90, 88]
+    assert clstr['identity'][[1,3]].tolist() == [97.5, 95.45]
+    assert os.path.exists(clstr_file + '.npz')
+
+    cached = read_clstr(clstr_file)
+    for column in clstr:
+        np.testing.assert_array_equal(cached[column], clstr[column])
+
+    empty_file = str(tmp_path / 'empty.clstr')
+    open(empty_file, 'w').close()
+    assert len(read_clstr(empty_file)['header']) == 0
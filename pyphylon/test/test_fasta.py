@@ -0,0 +1,97 @@
+import pytest
+import numpy as np
+from pyphylon.fasta import iter_fasta, sort_fasta, read_fasta_index, fetch_sequences, is_fasta_index_current, ContigStore
+from pyphylon.pangenome import load_sequences_from_fasta, reverse_complement
+
+FAA = 'pyphylon/test/data/bakta/798300.3/798300.3.faa'
+
+
+def test_iter_fasta_records(tmp_path):
+    fasta = tmp_path / 'test.fna'
+    fasta.write_bytes(b'>seq1 first record\r\nACGT\r\nAC\r\n>empty\n>seq2\nGG\n\nTT')
+    records = list(iter_fasta(str(fasta), decode=True))
+    assert records == [('seq1 first record', 'ACGTAC'), ('seq2', 'GGTT')]
+
+    records = list(iter_fasta(str(fasta), skip_empty=False, short_headers=True))
+    assert records == [(b'seq1', b'ACGTAC'), (b'empty', b''), (b'seq2', b'GGTT')]
+
+    headers = list(iter_fasta(str(fasta), headers_only=True, short_headers=True, decode=True))
+    assert headers == [('seq1', None), ('seq2', None)]
+
+    records = list(iter_fasta(str(fasta), skip_empty=False, short_headers=True, decode=True, keep_lines=True))
+    assert records == [('seq1', ['ACGT', 'AC']), ('empty', []), ('seq2', ['GG', 'TT'])]
+
+
+def test_iter_fasta_empty_file(tmp_path):
+    fasta = tmp_path / 'empty.faa'
+    fasta.write_bytes(b'')
+    assert list(iter_fasta(str(fasta))) == []
+
+
+def test_iter_fasta_matches_line_parser():
+    header_to_seq = {}
+    with open(FAA, 'r') as f:
+        header = ''; seq_blocks = []
+        for line in f:
+            if line[0] == '>':
+                if len(seq_blocks) > 0:
+                    header_to_seq[header] = ''.join(seq_blocks)
+                header = line[1:].strip(); seq_blocks = []
+            else:
+                seq_blocks.append(line.strip())
+        if len(seq_blocks) > 0:
+            header_to_seq[header] = ''.join(seq_blocks)
+    assert load_sequences_from_fasta(FAA) == header_to_seq
+
+
+@pytest.mark.parametrize('max_memory', [10**9, 50]) # single in-memory run, many merged runs
+def test_sort_fasta(tmp_path, max_memory):
+    fasta = tmp_path / 'nr.faa'
+    fasta.write_bytes(b'>Test_C10A0\nMKV\n>Test_C2A1\nMA\nKV\n>misc\nMM\n>Test_C2A0\nMKKV\n>Test_C2A10\nM\n')
+    sort_fasta(str(fasta), str(fasta), max_memory=max_memory)
+    headers = [x for x, _ in iter_fasta(str(fasta), decode=True)]
+    assert headers == ['Test_C2A0', 'Test_C2A1', 'Test_C2A10', 'Test_C10A0', 'misc']
+    assert sorted(x.name for x in tmp_path.iterdir()) == ['nr.faa', 'nr.faa.fai']
+
+    fasta_index = read_fasta_index(str(fasta))
+    assert list(fasta_index) == headers
+    seqs = dict(fetch_sequences(str(fasta), ['misc', 'Test_C2A1'], fasta_index))
+    assert seqs == {'misc': 'MM', 'Test_C2A1': 'MAKV'}
+    
+    assert is_fasta_index_current(str(fasta))
+    fasta.write_bytes(fasta.read_bytes().replace(b'MKKV', b'MKV')) # rewritten after indexing
+    assert not is_fasta_index_current(str(fasta))
+
+
+def test_contig_store_extract(tmp_path):
+    fasta = tmp_path / 'contigs.fna'
+    fasta.write_bytes(b'>contig_1 desc\nACGTTGCA\nNNac\n>contig_2\nGGGCCCAT\n')
+    contigs = ContigStore(str(fasta))
+    assert contigs.names == ['contig_1', 'contig_2'] and 'contig_2' in contigs
+    assert contigs.get('contig_1') == 'ACGTTGCANNac'
+    
+    intervals = [(0, 0, 4, False), (0, 8, 12, True), (1, -3, 3, True), (1, 5, 20, False), (1, 6, 2, False)]
+    contig_ids, starts, stops, reverse = zip(*intervals)
+    seqs = contigs.extract(contig_ids, starts, stops, reverse=reverse)
+    expected = []
+    for contig_id, start, stop, is_reverse in intervals:
+        seq = contigs.get(contigs.names[contig_id])[max(0,start):stop]
+        expected.append(reverse_complement(seq) if is_reverse else seq)
+    assert seqs == expected == ['ACGT', 'gtNN', 'CCC', 'CAT', '']
+    assert contigs.extract([], [], [], reverse=[]) == []
+
+
+def test_contig_store_contains(tmp_path):
+    rng = np.random.default_rng(0)
+    contig_seqs = [''.join(rng.choice(list('ACGT'), size=n)) for n in [300, 120]]
+    contig_seqs[1] = contig_seqs[1][:50] + 'N' + contig_seqs[1][51:]
+    fasta = tmp_path / 'contigs.fna'
+    fasta.write_text(''.join('>contig_' + str(i) + '\n' + x + '\n' for i, x in enumerate(contig_seqs)))
+    contigs = ContigStore(str(fasta))
+    
+    seqs = [contig_seqs[0][10:63], reverse_complement(contig_seqs[0][200:240]), contig_seqs[1][:32], 
+            contig_seqs[1][40:60], contig_seqs[0][-20:] + contig_seqs[1][:20], 'A' * 53, '']
+    expected = [any(x in y or x in reverse_complement(y) for y in contig_seqs) for x in seqs]
+    assert expected == [True, True, True, True, False, False, True]
+    assert list(contigs.contains(seqs)) == expected
+    assert list(contigs.contains(seqs, both_strands=False)) == [True, False, True, True, False, False, True]
@@ -1,6 +1,7 @@
 import pytest
 import pandas as pd
 import numpy as np
+import scipy.sparse
 from pyphylon.models import *
 from sklearn.datasets import load_digits
 
@@ -25,6 +26,68 @@ def test_nmf(test_data) -> None:
     assert nmf_w[2].shape == (df.shape[0],2)
     assert nmf_h[2].shape == (2,df.shape[1])
 
+def test_nmf_parallel(test_data) -> None:
+    df = test_data
+    ranks = [4, 2, 3]
+    nmf_w, nmf_h = run_nmf(df, ranks=ranks, max_iter=500)
+    par_w, par_h = run_nmf(df, ranks=ranks, max_iter=500, n_jobs=2, blas_threads=1)
+
+    assert list(par_w) == list(par_h) == ranks
+    for rank in ranks:
+        assert np.allclose(nmf_w[rank], par_w[rank])
+        assert np.allclose(nmf_h[rank], par_h[rank])
+
+def test_nmf_sparse_input(test_data) -> None:
+    df = test_data
+    sparse = df.astype(pd.SparseDtype("float", 0))
+    nmf_w, nmf_h = run_nmf(df, ranks=[3], max_iter=500)
+    sparse_w, sparse_h = run_nmf(sparse, ranks=[3], max_iter=500)
+    assert np.allclose(nmf_w[3] @ nmf_h[3], sparse_w[3] @ sparse_h[3], atol=1e-3)
+    assert nmf_w[3].dtype == np.float64 and sparse_w[3].dtype == np.float32 # dense input keeps its dtype
+    f32_w, f32_h = run_nmf(df, ranks=[3], max_iter=500, dtype='float32')
+    assert f32_w[3].dtype == np.float32
+
+def test_nmf_warm_start(test_data) -> None:
+    df = test_data
+    ranks = [5, 2, 3]
+    nmf_w, nmf_h = run_nmf(df, ranks=ranks, max_iter=1000)
+    warm_w, warm_h = run_nmf(df, ranks=ranks, max_iter=1000, warm_start=True)
+
+    assert list(warm_w) == list(warm_h) == ranks
+    X = df.values.astype(float)
+    for rank in ranks:
+        assert warm_w[rank].shape == nmf_w[rank].shape and warm_h[rank].shape == nmf_h[rank].shape
+        cold_error = np.linalg.norm(X - nmf_w[rank] @ nmf_h[rank])
+        warm_error = np.linalg.norm(X - warm_w[rank] @ warm_h[rank])
+        assert warm_error <= 1.1 * cold_error
+
+    with pytest.raises(ValueError):
+        run_nmf(df, ranks=ranks, warm_start=True, n_jobs=2)
+
+def test_nmf_minibatch(test_data, tmp_path) -> None:
+    from pyphylon.pangenome import save_feature_table
+    df = test_data
+    X = df.values.astype(float)
+    nmf_w, nmf_h = run_nmf(df, ranks=[3], max_iter=1000)
+    mb_w, mb_h = run_nmf(df, ranks=[3], max_iter=50, engine='minibatch', batch_size=256)
+    assert mb_w[3].shape == nmf_w[3].shape and mb_h[3].shape == nmf_h[3].shape
+    cold_error = np.linalg.norm(X - nmf_w[3] @ nmf_h[3])
+    assert np.linalg.norm(X - mb_w[3] @ mb_h[3]) <= 1.1 * cold_error
+
+    table_dir = str(tmp_path / 'digits.table')
+    save_feature_table(df.rename(columns=str), table_dir)
+    table_w, table_h = run_nmf(table_dir, ranks=[3], max_iter=50, engine='minibatch', batch_size=256)
+    assert np.allclose(table_w[3], mb_w[3]) and np.allclose(table_h[3], mb_h[3])
+    model = NmfModel(table_dir, ranks=[3], max_iter=50, engine='minibatch', batch_size=256)
+    assert np.allclose(model.W_dict[3], table_w[3]) # native tables are streamed, not loaded
+    with pytest.raises(ValueError):
+        NmfModel(-scipy.sparse.csc_matrix(X), ranks=[3], engine='minibatch')
+
+    with pytest.raises(ValueError):
+        run_nmf(df, ranks=[3], engine='minibatch', warm_start=True)
+    with pytest.raises(ValueError):
+        run_nmf(table_dir, ranks=[3])
+
 def test_normalization_and_binarization(test_data) -> None:
     df = test_data
     nmf_w, nmf_h = run_nmf(df, ranks = range(2, int(min(df.shape)*.1)))
@@ -1,5 +1,6 @@
 import pytest
 from pyphylon.pangenome import *
+from pyphylon.pangenome import __hash_fasta_genomes__
 import pandas as pd
 import numpy as np
 import os
@@ -82,6 +83,80 @@ def test_heaps_law_functions(P_MATRIX) -> None:
     assert output.lambda_.mean() < 1
 
 
+def test_fit_heaps_batch() -> None:
+    rng = np.random.default_rng(0)
+    x = np.arange(1, 51)
+    params = [(0.3, 1000), (0.5, 200), (-0.2, 50)]
+    curves = np.array([kappa * x**lambda_ * rng.normal(1, 0.001, len(x)) for lambda_, kappa in params])
+    df_pan_core = pd.DataFrame(index=['Iter1', 'Iter2', 'Iter3'], data=np.hstack([curves, curves[::-1]]),
+                               columns=['Pan' + str(i) for i in x] + ['Core' + str(i) for i in x])
+    df_fits = fit_heaps_batch(df_pan_core, sections=['pan', 'core'], n_bootstrap=50, seed=0)
+    assert list(df_fits.index.get_level_values(0)) == ['pan'] * 3 + ['core'] * 3
+    assert np.allclose(df_fits.loc['pan', ['lambda_', 'kappa']].values, params, rtol=0.01)
+    assert np.allclose(df_fits.loc['core', ['lambda_', 'kappa']].values, params[::-1], rtol=0.01)
+    assert (df_fits.lambda_low <= df_fits.lambda_).all() and (df_fits.lambda_ <= df_fits.lambda_high).all()
+    assert np.allclose(fit_heaps_by_iteration(df_pan_core, 'pan').values, df_fits.loc['pan', ['lambda_', 'kappa']])
+    
+    for lambda_, kappa in params:
+        popt = fit_heaps(pd.Series(kappa * x**lambda_))
+        assert np.allclose(popt, [lambda_, kappa])
+
+
+def test_save_load_feature_table(tmp_path) -> None:
+    rng = np.random.default_rng(0)
+    dense = np.where(rng.random((40, 12)) < 0.3, 1, np.nan)
+    dense[5] = np.nan # feature absent from all genomes
+    df = pd.DataFrame(dense, index=['Test_C' + str(i) for i in range(40)], 
+                      columns=[str(i) + '.3' for i in range(12)]).astype(pd.SparseDtype('int64', np.nan))
+    
+    table_dir = str(tmp_path / 'test_strain_by_gene.table')
+    save_feature_table(df, table_dir)
+    df_loaded = load_feature_table(table_dir)
+    assert df_loaded.equals(df)
+    
+    genomes = ['7.3', '2.3']; features = ['Test_C30', 'Test_C5', 'Test_C1']
+    df_subset = load_feature_table(table_dir, genomes=genomes, features=features)
+    assert list(df_subset.index) == features and list(df_subset.columns) == genomes
+    assert df_subset.astype(float).equals(df.astype(float).loc[features, genomes])
+    features = ['Test_C3', 'Test_C1', 'Test_C3'] # repeated labels are repeated, same as .loc
+    df_subset = load_feature_table(table_dir, features=features)
+    assert df_subset.astype(float).equals(df.astype(float).loc[features])
+    with pytest.raises(KeyError):
+        load_feature_table(table_dir, genomes=['missing'])
+    
+    for table in [df, table_dir]: # in memory and memory-mapped
+        blocks = list(iter_feature_table_blocks(table, chunk_genomes=5, dtype='float64'))
+        assert [len(genomes) for genomes, _ in blocks] == [5, 5, 2]
+        assert np.array_equal(np.hstack([csc.toarray() for _, csc in blocks]), np.nan_to_num(dense))
+    
+    csv_file = str(tmp_path / 'test_strain_by_gene.csv.gz')
+    save_feature_table_csv(df, csv_file, chunk_genomes=5)
+    df_long = pd.read_csv(csv_file)
+    assert list(df_long.columns) == ['feature', 'genome', 'value'] and len(df_long) == np.nansum(dense)
+    df_csv = load_feature_table(csv_file)
+    assert not 'Test_C5' in df_csv.index # no present entries to record
+    assert df_csv.astype(float).reindex(index=df.index, columns=df.columns).equals(df.astype(float))
+
+
+def test_estimate_pan_core_size_exact() -> None:
+    from scipy.stats import hypergeom
+    rng = np.random.default_rng(0)
+    dense = (rng.random((200, 30)) < rng.random((200, 1))**2).astype('int8')
+    P = pd.DataFrame(dense).astype(pd.SparseDtype("int8", 0))
+    df_exact = estimate_pan_core_size(P, exact=True, max_block=100)
+    assert list(df_exact.index) == ['Mean', 'Var'] and df_exact.shape[1] == 4 * 30
+
+    freqs = dense.sum(axis=1)[None,:]; k = np.arange(1, 31)[:,None]
+    tail = lambda t: hypergeom.sf(t - 1, 30, freqs, k).sum(axis=1)
+    assert np.allclose(df_exact.loc['Mean', 'Pan1':'Pan30'], tail(1))
+    assert np.allclose(df_exact.loc['Mean', 'Core1':'Core30'], tail(np.ceil(k * 0.987)))
+    
+    np.random.seed(0)
+    df_sim = estimate_pan_core_size(P, num_iter=500, log_batch=1000)
+    assert np.allclose(df_sim.mean(), df_exact.loc['Mean'], atol=1)
+    assert (df_sim.loc[:, 'Pan30'] == (dense.sum(axis=1) > 0).sum()).all()
+
+
 @pytest.mark.parametrize('P_MATRIX',[(P_MATRIX)])
 def test_submatrix_calculation(P_MATRIX) -> None:
     P_submatrices = get_gene_frequency_submatrices(P_MATRIX, breakpoints=[0, 25, 50, 75, 100])
@@ -95,4 +170,306 @@ def test_submatrix_calculation(P_MATRIX) -> None:
                 if prev_item:
                     assert item2.shape[0] > prev_item.shape[0]
                 assert item2.shape[1] == P_MATRIX.shape[1]
-                assert item2.equals(P_MATRIX.loc[item2.index])
\ No newline at end of file
+                assert item2.equals(P_MATRIX.loc[item2.index])
+
+    P_masks = get_gene_frequency_submatrices(P_MATRIX, breakpoints=[0, 25, 50, 75, 100], return_masks=True)
+    for key1, item1 in P_masks.items():
+        for key2, mask in item1.items():
+            assert mask.shape == (P_MATRIX.shape[0],)
+            assert P_MATRIX[mask].equals(P_submatrices[key1][key2]) if key1 < key2 else not mask.any()
+
+    P = pd.DataFrame(np.eye(4, dtype=int)) # frequencies follow in-place edits unless cached
+    assert get_gene_frequency_submatrices(P, [0, 50, 100], return_masks=True)[0][50].all()
+    P.iloc[:,:] = 1
+    assert get_gene_frequency_submatrices(P, [0, 50, 100], return_masks=True)[50][100].all()
+
+def test_consolidate_seqs_parallel(tmp_path) -> None:
+    PATHS = ['pyphylon/test/data/bakta/' + x + '/' + x + '.faa' for x in GENOMES_TO_TEST]
+    outputs = {}
+    for mode, n_jobs in [('serial', 1), ('parallel', 2)]:
+        nr_out = str(tmp_path / (mode + '_nr.faa'))
+        shared_out = str(tmp_path / (mode + '_redundant_headers.tsv'))
+        missing_out = str(tmp_path / (mode + '_missing_headers.txt'))
+        seq_hashes, missing = consolidate_seqs(
+            PATHS, nr_out, shared_out, missing_out, n_jobs=n_jobs, shard_size=1)
+        outputs[mode] = (seq_hashes, missing, [Path(x).read_text() for x in [nr_out, shared_out, missing_out]])
+
+    assert list(outputs['serial'][0].items()) == list(outputs['parallel'][0].items())
+    assert outputs['serial'][1] == outputs['parallel'][1]
+    assert outputs['serial'][2] == outputs['parallel'][2]
+
+
+def test_build_genetic_feature_matrices(tmp_path):
+    PATHS = ['pyphylon/test/data/bakta/' + x + '/' + x + '.faa' for x in GENOMES_TO_TEST]
+    clstr = 'pyphylon/test/data/cd-hit-results/test_files.clstr'
+    consolidate_seqs(PATHS, str(tmp_path / 'nr.faa'), str(tmp_path / 'shared.tsv'))
+    header_to_allele = rename_genes_and_alleles(clstr, str(tmp_path / 'nr.faa'), 
+        str(tmp_path / 'renamed.faa'), str(tmp_path / 'names.tsv'), 
+        shared_headers_file=str(tmp_path / 'shared.tsv'))
+    allele_matrix, gene_matrix, allele_order, gene_order, genome_order = build_genetic_feature_matrices(
+        clstr, PATHS, shared_header_file=str(tmp_path / 'shared.tsv'), header_to_allele=header_to_allele)
+    assert allele_matrix.dtype == np.int8 and gene_matrix.dtype == np.int8
+    assert allele_matrix.shape == (len(allele_order), 3)
+    assert gene_matrix.shape == (len(gene_order), 3)
+    assert genome_order == sorted(GENOMES_TO_TEST)
+
+    df_alleles, df_genes = build_genetic_feature_tables(
+        clstr, PATHS, shared_header_file=str(tmp_path / 'shared.tsv'), header_to_allele=header_to_allele)
+    genes_from_alleles = df_alleles.fillna(0).groupby(
+        [x.rsplit('A', 1)[0] for x in df_alleles.index]).max()
+    assert (genes_from_alleles.loc[df_genes.index].values == df_genes.fillna(0).values).all()
+    assert (df_alleles.fillna(0).values == allele_matrix.toarray()).all()
+
+
+@pytest.mark.skipif(shutil.which('cd-hit') is None or shutil.which('cd-hit-2d') is None, 
+                    reason='requires CD-Hit')
+def test_update_cds_pangenome(tmp_path):
+    PATHS = ['pyphylon/test/data/bakta/' + x + '/' + x + '.faa' for x in GENOMES_TO_TEST]
+    cdhit_args = {'-n': 5, '-c':0.8, '-aL':0.8, '-T': 0, '-M': 0}
+    build_cds_pangenome(PATHS[:1], str(tmp_path), name='test_files', 
+                        cdhit_args=cdhit_args, save_csv=False)
+    df_alleles, df_genes, header_to_allele = update_cds_pangenome(
+        str(tmp_path), PATHS[1:], name='test_files', cdhit_args=cdhit_args, save_csv=False)
+
+    genome_order = GENOMES_TO_TEST[:1] + sorted(GENOMES_TO_TEST[1:]) # new genomes appended
+    assert list(df_alleles.columns) == genome_order
+    assert list(df_genes.columns) == genome_order
+    assert df_alleles.shape[0] == len(set(df_alleles.index))
+    df_saved = pd.read_pickle(str(tmp_path / 'test_files_strain_by_allele.pickle.gz'))
+    assert df_saved.shape == df_alleles.shape
+
+
+def __fake_clusters__(fasta):
+    ''' Groups sequences by their first 4 residues, in place of CD-Hit '''
+    clusters = {}
+    for header, seq in iter_fasta(fasta, short_headers=True, decode=True):
+        clusters.setdefault(seq[:4], []).append((header, seq))
+    return clusters
+
+
+def __write_fake_clstr__(clstr_file, clusters):
+    with open(clstr_file, 'w') as f:
+        for c, members in enumerate(clusters):
+            f.write('>Cluster ' + str(c) + '\n')
+            for m, (header, seq) in enumerate(members):
+                f.write(str(m) + '\t' + str(len(seq)) + 'aa, >' + header + '... ' + ('*' if m == 0 else 'at 90.00%') + '\n')
+
+
+def __fake_cdhit__(fasta_file, cdhit_out, cdhit_args={}):
+    shutil.copyfile(fasta_file, cdhit_out)
+    __write_fake_clstr__(cdhit_out + '.clstr', __fake_clusters__(fasta_file).values())
+
+
+def __fake_cdhit_2d__(db_fasta, query_fasta, cdhit_out, cdhit_args={}):
+    queries = __fake_clusters__(query_fasta)
+    clusters = [members + queries.pop(key, []) for key, members in __fake_clusters__(db_fasta).items()]
+    __write_fake_clstr__(cdhit_out + '.clstr', clusters)
+    with open(cdhit_out, 'w') as f: # query sequences without a cluster
+        for members in queries.values():
+            for header, seq in members:
+                f.write('>' + header + '\n' + seq + '\n')
+
+
+def test_update_cds_pangenome_fake_clusters(tmp_path, monkeypatch):
+    import pyphylon.pangenome
+    monkeypatch.setattr(pyphylon.pangenome, 'cluster_with_cdhit', __fake_cdhit__)
+    PATHS = ['pyphylon/test/data/bakta/' + x + '/' + x + '.faa' for x in GENOMES_TO_TEST]
+    (tmp_path / 'full').mkdir(); (tmp_path / 'update').mkdir()
+    df_full_alleles, df_full_genes, _ = build_cds_pangenome(PATHS, str(tmp_path / 'full'), save_csv=False)
+    build_cds_pangenome(PATHS[:1], str(tmp_path / 'update'), save_csv=False)
+    update_dir = tmp_path / 'update' / 'Test_update'
+
+    def failing_cdhit_2d(*args):
+        raise RuntimeError('cd-hit-2d failed')
+    monkeypatch.setattr(pyphylon.pangenome, 'cluster_with_cdhit_2d', failing_cdhit_2d)
+    with pytest.raises(RuntimeError):
+        update_cds_pangenome(str(tmp_path / 'update'), PATHS[1:], save_csv=False)
+    assert not update_dir.exists() # intermediate files are removed on failure
+    
+    monkeypatch.setattr(pyphylon.pangenome, 'cluster_with_cdhit_2d', __fake_cdhit_2d__)
+    df_alleles, df_genes, _ = update_cds_pangenome(str(tmp_path / 'update'), PATHS[1:], save_csv=False)
+    assert not update_dir.exists()
+    for df, df_full in [(df_alleles, df_full_alleles), (df_genes, df_full_genes)]:
+        assert list(df.index) == sorted(df.index, key=breakdown_feature_name) # C2 before C10
+        assert list(df.columns) == GENOMES_TO_TEST[:1] + sorted(GENOMES_TO_TEST[1:]) # new genomes appended
+        assert df.sum().equals(df_full.sum()[df.columns]) # same clusters, numbered differently
+        assert df.shape == df_full.shape
+
+
+def test_consolidate_seqs_seq_store(tmp_path):
+    from pyphylon.seqstore import SequenceStore
+    PATHS = ['pyphylon/test/data/bakta/' + x + '/' + x + '.faa' for x in GENOMES_TO_TEST]
+    expected, expected_missing = consolidate_seqs(
+        PATHS, str(tmp_path / 'nr.faa'), str(tmp_path / 'shared.tsv'))
+    expected_seqs = load_sequences_from_fasta(str(tmp_path / 'nr.faa'))
+
+    with SequenceStore(str(tmp_path / 'store.sqlite')) as seq_store:
+        for run in range(2): # first run fills the store, second run reads from it
+            nr_seqs, missing = consolidate_seqs(PATHS, str(tmp_path / 'nr_store.faa'), 
+                str(tmp_path / 'shared_store.tsv'), seq_store=seq_store)
+            assert list(nr_seqs.items()) == list(expected.items())
+            assert missing == expected_missing
+            assert load_sequences_from_fasta(str(tmp_path / 'nr_store.faa')) == expected_seqs
+            assert all(seq_store.is_current(x) for x in PATHS)
+        assert len(seq_store) == len(expected)
+
+        with open(str(tmp_path / 'nr_store.clstr'), 'w') as f_clstr: # one cluster per sequence
+            for i, headers in enumerate(nr_seqs.values()):
+                f_clstr.write('>Cluster ' + str(i) + '\n0\t100aa, >' + headers[0] + '... *\n')
+        other = tmp_path / 'other.faa' # another build in the same store, reusing a header and a sequence
+        first_header = next(iter(nr_seqs.values()))[0]
+        other.write_text('>' + first_header + '\nMWWWW\n>other_only\n' + expected_seqs[first_header] + '\n')
+        seq_store.add_source(str(other), *__hash_fasta_genomes__([str(other)])[0])
+        
+        header_to_allele = rename_genes_and_alleles(str(tmp_path / 'nr_store.clstr'), str(tmp_path / 'nr_store.faa'), 
+            str(tmp_path / 'renamed.faa'), str(tmp_path / 'names.tsv'), 
+            shared_headers_file=str(tmp_path / 'shared_store.tsv'), seq_store=seq_store, genome_paths=PATHS)
+        assert load_header_to_allele(seq_store=seq_store) == header_to_allele
+
+
+def test_seq_store_repeated_headers(tmp_path):
+    from pyphylon.seqstore import SequenceStore
+    from pyphylon.pangenome import __hash_sequence__
+    sources = [str(tmp_path / 'a.faa'), str(tmp_path / 'b.faa')] # same locus tag, different sequences
+    (tmp_path / 'a.faa').write_text('>locus_1\nMKV\n')
+    (tmp_path / 'b.faa').write_text('>locus_1\nMWW\n')
+    with SequenceStore(str(tmp_path / 'store.sqlite')) as seq_store:
+        for source in sources[::-1]:
+            seq_store.add_source(source, *__hash_fasta_genomes__([source])[0])
+        for order, seq in [(sources, b'MKV'), (sources[::-1], b'MWW')]: # first source in build order
+            seq_store.set_alleles('Test_C', {'locus_1': 'Test_C0A0'}, order)
+            digests = seq_store.db.execute('SELECT digest FROM alleles WHERE label = ?', ('Test_C',)).fetchall()
+            assert [bytes(x[0]) for x in digests] == [__hash_sequence__(seq)]
+
+
+def test_build_upstream_pangenome_parallel(tmp_path):
+    PATHS = ['pyphylon/test/data/bakta/' + x + '/' + x + '.faa' for x in GENOMES_TO_TEST]
+    nr_seqs, _ = consolidate_seqs(PATHS, str(tmp_path / 'nr.faa'), str(tmp_path / 'shared.tsv'))
+    with open(str(tmp_path / 'nr.clstr'), 'w') as f_clstr: # one cluster per sequence
+        for i, headers in enumerate(nr_seqs.values()):
+            f_clstr.write('>Cluster ' + str(i) + '\n0\t100aa, >' + headers[0] + '... *\n')
+    rename_genes_and_alleles(str(tmp_path / 'nr.clstr'), str(tmp_path / 'nr.faa'), str(tmp_path / 'nr.faa'),
+        str(tmp_path / 'allele_names.tsv'), shared_headers_file=str(tmp_path / 'shared.tsv'))
+
+    genome_data = []
+    for genome in GENOMES_TO_TEST:
+        for ext in ['.gff3', '.fna']:
+            shutil.copyfile('pyphylon/test/data/bakta/' + genome + '/' + genome + ext, str(tmp_path / (genome + ext)))
+        genome_data.append((str(tmp_path / (genome + '.gff3')), str(tmp_path / (genome + '.fna'))))
+
+    outputs = {}
+    for n_jobs in [1, 2]:
+        output_dir = tmp_path / ('out' + str(n_jobs))
+        output_dir.mkdir()
+        df_upstream = build_upstream_pangenome(genome_data, str(tmp_path / 'allele_names.tsv'), 
+            str(output_dir), max_overlap=20, save_csv=False, n_jobs=n_jobs, save_table=(n_jobs == 1))
+        assert (output_dir / 'Test_strain_by_upstream.table').is_dir() == (n_jobs == 1)
+        genome_upstream = [(tmp_path / 'derived' / (x + '_upstream.fna')).read_text() for x in GENOMES_TO_TEST]
+        outputs[n_jobs] = (df_upstream, genome_upstream, (output_dir / 'Test_nr_upstream.fna').read_text())
+    assert outputs[1][0].shape[0] > 0
+    pd.testing.assert_frame_equal(outputs[1][0], outputs[2][0])
+    assert outputs[1][1:] == outputs[2][1:]
+
+
+def test_extract_genome_features(tmp_path):
+    genome = GENOMES_TO_TEST[0]
+    genome_gff = 'pyphylon/test/data/bakta/' + genome + '/' + genome + '.gff3'
+    genome_fna = 'pyphylon/test/data/bakta/' + genome + '/' + genome + '.fna'
+    separate = {'coding': str(tmp_path / 'coding.fna'), 'upstream': str(tmp_path / 'upstream.fna'),
+                'downstream': str(tmp_path / 'downstream.fna'), 'noncoding': str(tmp_path / 'noncoding.fna')}
+    extract_coding_fna(genome_gff, genome_fna, separate['coding'])
+    extract_upstream_sequences(genome_gff, genome_fna, separate['upstream'], max_overlap=20)
+    extract_downstream_sequences(genome_gff, genome_fna, separate['downstream'], max_overlap=20)
+    extract_noncoding(genome_gff, genome_fna, separate['noncoding'], flanking=(10,10), 
+                      allowed_features=['tRNA', 'rRNA', 'ncRNA'])
+
+    fused = {x: str(tmp_path / ('fused_' + x + '.fna')) for x in separate}
+    feature_counts = extract_genome_features(genome_gff, genome_fna, coding_out=fused['coding'], 
+        upstream_out=fused['upstream'], downstream_out=fused['downstream'], noncoding_out=fused['noncoding'],
+        max_overlap=20, noncoding_flanking=(10,10), noncoding_features=['tRNA', 'rRNA', 'ncRNA'])
+    for x in separate:
+        assert feature_counts[x] > 0
+        assert Path(fused[x]).read_text() == Path(separate[x]).read_text()
+
+
+def test_validate_gene_table():
+    alleles = ['Test_C0A0', 'Test_C0A1', 'Test_C1A0', 'Test_C2A0']
+    genomes = ['g1', 'g2', 'g3']
+    allele_matrix = np.array([[1, 0, 0], [0, 1, 0], [1, 1, 1], [0, 0, 1]])
+    gene_matrix = np.array([[1, 1, 0], [1, 1, 1], [0, 0, 1]])
+    df_alleles = pd.DataFrame(allele_matrix, index=alleles, columns=genomes).replace(0, np.nan)
+    df_alleles = df_alleles.astype(pd.SparseDtype('float', np.nan))
+    df_genes = pd.DataFrame(gene_matrix, index=['Test_C0', 'Test_C1', 'Test_C2'], columns=genomes)
+    
+    assert (validate_gene_table(df_genes, df_alleles) == 0).all()
+    assert (validate_gene_table_dense(df_genes, df_alleles.sparse.to_dense()) == 0).all()
+
+    df_genes.loc['Test_C0', 'g3'] = 1 # gene without alleles
+    inconsistencies = validate_gene_table(df_genes.drop('Test_C2'), df_alleles) # alleles without gene
+    assert inconsistencies.to_dict() == {'g1': 0, 'g2': 0, 'g3': 2}
+
+
+def test_validate_table_against_fasta(tmp_path, capsys):
+    (tmp_path / 'nr.faa').write_text('>Test_C0A0\nMKV\n>Test_C0A1\nMKL\n>Test_C1A0\nMAAG\n')
+    (tmp_path / 'g1.faa').write_text('>g1_1\nMKV\n>g1_2\nMAAG\n')
+    (tmp_path / 'g2.faa').write_text('>g2_1\nMKL\n>g2_2\nMKV\n>g2_3\nMWWW\n')
+    df_alleles = pd.DataFrame([[1, 1], [np.nan, 1], [1, 1]], columns=['g1', 'g2'],
+                              index=['Test_C0A0', 'Test_C0A1', 'Test_C1A0'])
+    genome_paths = [str(tmp_path / 'g2.faa'), str(tmp_path / 'g1.faa')]
+    for n_jobs in [1, 2]:
+        df_validation = validate_allele_table(df_alleles, genome_paths, str(tmp_path / 'nr.faa'), 
+                                              n_jobs=n_jobs, return_table=True)
+        assert df_validation.to_dict('index') == {
+            'g1': {'table_only': 0, 'genome_only': 0, 'missing': 0, 'consistent': True},
+            'g2': {'table_only': 1, 'genome_only': 0, 'missing': 1, 'consistent': False}}
+    
+    capsys.readouterr()
+    assert validate_allele_table(df_alleles, genome_paths, str(tmp_path / 'nr.faa')) is None
+    out = capsys.readouterr().out # inconsistent genomes are printed by default
+    assert 'g2 \t Table only: 1 \t Genome only: 0' in out and not 'g1 \t' in out
+
+
+@pytest.mark.parametrize('index_file', [None, 'annotations.sqlite'])
+def test_extract_annotations(tmp_path, index_file):
+    gff_lines = ['##gff-version 3',
+                 'contig_1\tBakta\tCDS\t1\t90\t.\t+\t0\tID=g_1;product=DNA gyrase subunit A',
+                 'contig_1\tBakta\tCDS\t100\t190\t.\t+\t0\tID=g_2;product=DNA gyrase subunit B',
+                 'contig_1\tBakta\tCDS\t200\t290\t.\t-\t0\tID=g_3;product=DNA%20gyrase subunit A',
+                 'contig_1\tBakta\ttRNA\t300\t370\t.\t+\t.\tID=g_4;product=tRNA-Ala']
+    (tmp_path / 'g.gff3').write_text('\n'.join(gff_lines) + '\n')
+    (tmp_path / 'allele_names.tsv').write_text(
+        'Test_C0A0\tg_1\tg_3\nTest_C0A1\tg_2\nTest_C0A2\tg_3\nTest_C1A0\tg_4\tg_5\n')
+    index_file = None if index_file is None else str(tmp_path / index_file)
+    
+    extract_annotations([str(tmp_path / 'g.gff3')], str(tmp_path / 'allele_names.tsv'), 
+                        str(tmp_path / 'alleles.tsv'), collapse_alleles=False, index_file=index_file)
+    assert (tmp_path / 'alleles.tsv').read_text().splitlines() == [
+        'Test_C0A0\tDNA gyrase subunit A', 'Test_C0A1\tDNA gyrase subunit B', 
+        'Test_C0A2\tDNA gyrase subunit A', 'Test_C1A0\ttRNA-Ala\tg_5']
+    
+    extract_annotations([str(tmp_path / 'g.gff3')], str(tmp_path / 'allele_names.tsv'), 
+                        str(tmp_path / 'genes.tsv'), allowed_features=['CDS'], index_file=index_file)
+    assert (tmp_path / 'genes.tsv').read_text().splitlines() == [
+        'Test_C0\tDNA gyrase subunit A', 'Test_C0A1\tDNA gyrase subunit B', 'Test_C1\tg_4\tg_5']
+
+
+def test_generate_annotations(tmp_path):
+    annotation_file = tmp_path / 'annotations.tsv'
+    annotation_file.write_text('Test_C0\tgyrA\nTest_C0A2\tgyrA\tgyrB\nTest_C1\ttRNA-Ala\n')
+    features = ['Test_C0', 'Test_C0A1', 'Test_C0A2', 'Test_C1U0', 'Test_C2', 'Test_C2A0']
+    annotations = generate_annotations(features, [str(annotation_file)])
+    assert annotations.to_dict() == {'Test_C0': 'gyrA', 'Test_C0A1': 'gyrA', 'Test_C0A2': 'gyrA;gyrB', 
+        'Test_C1U0': 'tRNA-Ala', 'Test_C2': np.nan, 'Test_C2A0': np.nan} 
+    assert (tmp_path / 'annotations.tsv.idx.npz').exists()
+    
+    annotation_file.write_text('Test_C2\tparC\nTest_C0\tgyrA2\n') # stale index is rebuilt
+    annotations = generate_annotations(features, [str(annotation_file)])
+    assert list(annotations.values) == ['gyrA2', 'gyrA2', 'gyrA2', np.nan, 'parC', 'parC']
+    assert list(index_annotations(str(annotation_file))['features']) == [b'Test_C0', b'Test_C2']
+    
+    other_file = tmp_path / 'other.tsv' # index kept in memory if not cached or unable to save
+    other_file.write_text('Test_C1\ttRNA-Ala\n')
+    assert generate_annotations(['Test_C1'], [str(other_file)], cache=False).to_dict() == {'Test_C1': 'tRNA-Ala'}
+    assert not (tmp_path / 'other.tsv.idx.npz').exists()
+    (tmp_path / 'other.tsv.idx.npz').mkdir()
+    assert generate_annotations(['Test_C1'], [str(other_file)]).to_dict() == {'Test_C1': 'tRNA-Ala'}
@@ -60,6 +60,72 @@ def test_binary_sparse() -> None:
         result = _check_and_convert_binary_sparse(df)
 
 
+def test_get_row_sums() -> None:
+    from pyphylon.util import _get_row_sums, _ROW_SUM_CACHE
+    df = pd.DataFrame({
+        'a': [1, np.nan, 0, 2],
+        'b': [1, 1, np.nan, 0]
+    })
+    sparse = df.astype(pd.SparseDtype("float", np.nan))
+    assert list(_get_row_sums(df)) == list(_get_row_sums(sparse)) == [2, 1, 0, 2]
+    
+    row_sums = _get_row_sums(sparse, cache=True)
+    assert _get_row_sums(sparse, cache=True) is row_sums # memoized per table
+    sparse['c'] = pd.arrays.SparseArray([0, 1, 0, 0], fill_value=0)
+    assert list(_get_row_sums(sparse, cache=True)) == [2, 2, 0, 2] # shape changed
+    sparse['c'] = pd.arrays.SparseArray([1, 1, 0, 0], fill_value=0)
+    assert list(_get_row_sums(sparse)) == [3, 2, 0, 2] # not cached by default
+    
+    key = id(sparse)
+    del sparse
+    assert not key in _ROW_SUM_CACHE
+
+
+def test_to_solver_input() -> None:
+    import scipy.sparse
+    from pyphylon.util import _to_solver_input
+    df = pd.DataFrame({
+        'a': [1, 0, 0, 1],
+        'b': [0, 1, 0, 0]
+    }, dtype='int8')
+    sparse = df.astype(pd.SparseDtype("int8", 0))
+
+    X, memory = _to_solver_input(sparse)
+    assert scipy.sparse.isspmatrix_csr(X) and X.dtype == np.float32
+    assert np.array_equal(X.toarray(), df.values)
+    assert memory['format'] == 'csr' and memory['dense_float64_nbytes'] == 64
+    assert memory['saved_nbytes'] == 64 - memory['nbytes']
+
+    X, memory = _to_solver_input(sparse, dtype='int8', accept_sparse=False)
+    assert isinstance(X, np.ndarray) and X.dtype == np.int8 and np.array_equal(X, df.values)
+    assert memory['format'] == 'dense' and memory['nbytes'] == 8
+
+    X, memory = _to_solver_input(df)
+    assert isinstance(X, np.ndarray) and X.dtype == np.float32 and memory['nbytes'] == 32
+
+
+def test_kmeans_1d_thresholds() -> None:
+    import itertools
+    from pyphylon.util import _kmeans_1d_thresholds
+    rng = np.random.default_rng(0)
+    X = np.round(rng.random((12, 30))**2, 2) # ties included
+    X[:, 0] = 0.5; X[:, 1] = 0.1; X[6:, 1] = 0.2 # fewer than 3 distinct values
+    thresholds = _kmeans_1d_thresholds(X, n_clusters=3)
+    assert thresholds[0] == 0.5 and thresholds[1] == 0.2
+    
+    for j in range(2, X.shape[1]): # top cluster of some optimal partition, by brute force
+        x = np.sort(X[:, j]); sse = lambda y: ((y - y.mean())**2).sum()
+        splits = [i for i in range(1, len(x)) if x[i] > x[i-1]]
+        costs = {(a, b): sse(x[:a]) + sse(x[a:b]) + sse(x[b:]) for a, b in itertools.combinations(splits, 2)}
+        optimal = min(costs.values())
+        assert any(np.isclose(x[b], thresholds[j]) for (a, b), cost in costs.items() if np.isclose(cost, optimal))
+    
+    for value in [np.nan, np.inf]: # rejected rather than giving a NaN threshold
+        X_bad = X.copy(); X_bad[3, 4] = value
+        with pytest.raises(ValueError):
+            _kmeans_1d_thresholds(X_bad, n_clusters=3)
+
+
 def test_get_normalization_diagonals() -> None:
     from pyphylon.util import _get_normalization_diagonals
     
@@ -77,6 +77,172 @@ def _convert_sparse(df: pd.DataFrame, dtype='int8'):
     
     return df
 
+def _iter_stored_entries(df: pd.DataFrame):
+    # Yield (row positions, values) of the present entries of each column, reading only
+    # the stored entries of sparse columns with NaN or 0 as absent
+    for col in df.columns:
+        values = df[col].array
+        if isinstance(values, pd.arrays.SparseArray) and (pd.isna(values.fill_value) or values.fill_value == 0):
+            rows = values.sp_index.indices; vals = values.sp_values # only stored entries
+        else:
+            vals = np.asarray(values, dtype='float64'); rows = np.arange(len(vals))
+        vals = np.nan_to_num(np.asarray(vals, dtype='float64'))
+        is_present = vals != 0
+        yield rows[is_present], vals[is_present]
+
+def _to_scipy_sparse(df: pd.DataFrame, dtype='int8'):
+    # Convert a feature x genome table (sparse or dense, with NaN or 0 as absent) to scipy CSC
+    import scipy.sparse
+    indices = []; indptr = [0]; data = []
+    for rows, vals in _iter_stored_entries(df):
+        indices.append(rows); data.append(vals)
+        indptr.append(indptr[-1] + len(rows))
+    indices = np.concatenate(indices) if len(indices) > 0 else np.zeros(0, dtype='int64')
+    data = np.concatenate(data) if len(data) > 0 else np.zeros(0)
+    return scipy.sparse.csc_matrix((data.astype(dtype), indices, np.array(indptr)), shape=df.shape)
+
+_ROW_SUM_CACHE = {} # id(table) -> (shape, row sums), dropped when the table is garbage collected
+
+def _get_row_sums(df: pd.DataFrame, cache=False):
+    # Sum each row of a feature x genome table (e.g. gene frequencies) from its stored entries,
+    # without densifying. With cache=True, sums are memoized per table and shape, so only use
+    # it for tables that are not modified in place between calls
+    import weakref
+    key = id(df)
+    if cache and key in _ROW_SUM_CACHE and _ROW_SUM_CACHE[key][0] == df.shape:
+        return _ROW_SUM_CACHE[key][1]
+    row_sums = np.zeros(df.shape[0])
+    for rows, vals in _iter_stored_entries(df):
+        row_sums += np.bincount(rows, weights=vals, minlength=df.shape[0])
+    if cache:
+        row_sums.flags.writeable = False # shared by all callers
+        if not key in _ROW_SUM_CACHE:
+            weakref.finalize(df, _ROW_SUM_CACHE.pop, key, None)
+        _ROW_SUM_CACHE[key] = (df.shape, row_sums)
+    return row_sums
+
+# Solver inputs #
+
+def _to_solver_input(data, dtype='float32', accept_sparse=True):
+    # Convert a table (pandas, sparse pandas, numpy or scipy) to the input handed to a solver:
+    # scipy CSR for sparse tables if the solver accepts it, otherwise a dense array of dtype,
+    # filled from stored entries so sparse tables are never densified as float64.
+    # Returns the input and a record of its memory compared to a dense float64 copy
+    import scipy.sparse
+    is_sparse_frame = isinstance(data, pd.DataFrame) and data.shape[1] > 0 and \
+        all(isinstance(data[col].array, pd.arrays.SparseArray) for col in data.columns)
+    if scipy.sparse.issparse(data):
+        X = data.tocsr().astype(dtype, copy=False) if accept_sparse else data.toarray().astype(dtype, copy=False)
+    elif is_sparse_frame and accept_sparse:
+        X = _to_scipy_sparse(data, dtype=dtype).tocsr()
+    elif is_sparse_frame:
+        X = np.zeros(data.shape, dtype=dtype)
+        for j, (rows, vals) in enumerate(_iter_stored_entries(data)):
+            X[rows, j] = vals
+    elif isinstance(data, pd.DataFrame):
+        X = data.to_numpy(dtype=dtype)
+    else:
+        X = np.asarray(data, dtype=dtype)
+
+    if scipy.sparse.issparse(X):
+        nbytes = X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    else:
+        nbytes = X.nbytes
+    dense_nbytes = 8 * int(np.prod(X.shape))
+    memory = {'format': 'csr' if scipy.sparse.issparse(X) else 'dense', 'dtype': str(X.dtype),
+              'nbytes': nbytes, 'dense_float64_nbytes': dense_nbytes, 'saved_nbytes': dense_nbytes - nbytes}
+    return X, memory
+
+# NMF fitting #
+
+def _fit_nmf_rank(data, rank, max_iter, blas_threads=None, W_init=None, H_init=None, tol=1e-4):
+    # Fit NMF at a single rank with a fixed seed, so results do not depend on scheduling.
+    # Starts from W_init/H_init if provided, otherwise from NNDSVD.
+    # Kept here rather than in models so worker processes avoid importing UMAP/HDBSCAN
+    from sklearn.decomposition import NMF
+    from threadpoolctl import threadpool_limits
+    model = NMF(
+        n_components=rank,
+        init='nndsvd' if W_init is None else 'custom',
+        max_iter=max_iter,
+        tol=tol,
+        random_state=42
+    )
+    with threadpool_limits(limits=blas_threads):
+        if W_init is None:
+            W = model.fit_transform(data)
+        else:
+            W = model.fit_transform(data, W=W_init.astype(data.dtype), H=H_init.astype(data.dtype))
+    H = model.components_
+    return W, H
+
+def _fit_minibatch_nmf_rank(iter_blocks, rank, max_iter, tol=1e-4):
+    # Fit NMF at a single rank by streaming blocks of genomes (genome x feature blocks of P.T
+    # from iter_blocks()) through MiniBatchNMF, one pass per epoch. Each block is scored with
+    # the current components before it is fitted, and fitting stops once this epoch cost
+    # improves by less than tol. Only the components and one block are held in memory.
+    # Returns W (feature x rank) and H (rank x genome), oriented as in _fit_nmf_rank
+    from sklearn.decomposition import MiniBatchNMF
+    model = MiniBatchNMF(n_components=rank, init='nndsvda', random_state=42)
+    previous_cost = None
+    for epoch in range(max_iter):
+        cost = 0
+        for block in iter_blocks():
+            if epoch > 0:
+                cost += _nmf_block_cost(block, model.transform(block), model.components_)
+            model.partial_fit(block)
+        if epoch > 1 and previous_cost - cost < tol * previous_cost:
+            break
+        previous_cost = cost
+    W = model.components_.T.copy()
+    H = np.hstack([model.transform(block).T for block in iter_blocks()])
+    return W, H
+
+def _nmf_block_cost(X, W, H):
+    # Squared Frobenius norm of X - WH (X dense or sparse) without forming WH
+    squared_sum = X.multiply(X).sum() if hasattr(X, 'multiply') else np.square(X).sum()
+    return squared_sum - 2 * (W * (X @ H.T)).sum() + ((W.T @ W) * (H @ H.T)).sum()
+
+def _nndsvd_from_svd(U, S, V, eps=1e-6):
+    # NNDSVD factors (Boutsidis & Gallopoulos 2008) for every singular triplet of a
+    # truncated SVD, as in sklearn's init='nndsvd'. The first k columns of W and rows
+    # of H are the NNDSVD initialization at rank k, so one SVD serves all ranks
+    W = np.zeros_like(U); H = np.zeros_like(V)
+    W[:, 0] = np.sqrt(S[0]) * np.abs(U[:, 0])
+    H[0, :] = np.sqrt(S[0]) * np.abs(V[0, :])
+    for j in range(1, len(S)):
+        x, y = U[:, j], V[j, :]
+        x_p, y_p = np.maximum(x, 0), np.maximum(y, 0)
+        x_n, y_n = np.abs(np.minimum(x, 0)), np.abs(np.minimum(y, 0))
+        x_p_nrm, y_p_nrm = np.linalg.norm(x_p), np.linalg.norm(y_p)
+        x_n_nrm, y_n_nrm = np.linalg.norm(x_n), np.linalg.norm(y_n)
+        m_p, m_n = x_p_nrm * y_p_nrm, x_n_nrm * y_n_nrm
+        if m_p > m_n:
+            u, v, sigma = x_p / x_p_nrm, y_p / y_p_nrm, m_p
+        else:
+            u, v, sigma = x_n / x_n_nrm, y_n / y_n_nrm, m_n
+        lbd = np.sqrt(S[j] * sigma)
+        W[:, j] = lbd * u; H[j, :] = lbd * v
+    W[W < eps] = 0; H[H < eps] = 0
+    return W, H
+
+def _nmf_violation(X, W, H):
+    # L1 norm of the projected gradient of 0.5 * ||X - WH||^2, the convergence measure
+    # of sklearn's coordinate descent solver (relative to its value at the start)
+    grad_W = W @ (H @ H.T) - X @ H.T
+    grad_H = (W.T @ W) @ H - W.T @ X
+    projected = lambda grad, factor: np.where(factor > 0, grad, np.minimum(grad, 0))
+    return np.abs(projected(grad_W, W)).sum() + np.abs(projected(grad_H, H)).sum()
+
+def _extend_nmf_factors(X, W, H, W_new, H_new):
+    # Append components to an NMF solution, each rescaled to best fit the residual
+    # X - WH in least squares (computed without forming the residual)
+    fit = (W_new.T @ X @ H_new.T).diagonal() - ((W_new.T @ W) * (H @ H_new.T).T).sum(axis=1)
+    size = (W_new**2).sum(axis=0) * (H_new**2).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where((fit > 0) & (size > 0), fit / size, 1) # keep NNDSVD scale if no fit
+    return np.hstack([W, W_new * np.sqrt(scale)]), np.vstack([H, H_new * np.sqrt(scale)[:, None]])
+
 # NMF normalization #
 
 def _get_normalization_diagonals(W):
@@ -88,3 +254,87 @@ def _get_normalization_diagonals(W):
     D2 = np.diag(recipricol_vals)
     
     return D1, D2
+
+# NMF binarization #
+
+def _kmeans_1d_thresholds(X, n_clusters=3):
+    # Exact 1-D k-means of every column of X at once, returning the smallest value of each
+    # column's top (highest mean) cluster, so X >= thresholds gives the top cluster masks.
+    # Optimal clusters are contiguous runs of the sorted values that never split ties, found
+    # by dynamic programming over split points. Columns with fewer than n_clusters distinct
+    # values use their maximum, as KMeans then only puts the maximum in its top cluster.
+    # Raises ValueError on NaN or infinite values, same as sklearn's KMeans
+    x = np.sort(np.asarray(X, dtype='float64').T, axis=1) # one sorted row per column
+    if not np.isfinite(x).all():
+        raise ValueError("Input contains NaN or infinite values")
+    m, n = x.shape
+    if n == 0:
+        return np.full(m, np.nan)
+    S1 = np.hstack([np.zeros((m, 1)), np.cumsum(x, axis=1)]) # prefix sums of values and squares
+    S2 = np.hstack([np.zeros((m, 1)), np.cumsum(x**2, axis=1)])
+    is_split = np.zeros((m, n + 1), dtype=bool) # split points between distinct values
+    is_split[:, 1:n] = x[:, 1:] > x[:, :-1]
+
+    # Best cost of each prefix [0, a) in 1, 2, ..., n_clusters - 1 clusters, skipping prefixes
+    # that cannot be followed by an optimal top cluster in the last step
+    top = (S2[:, [n]] - S2[:, :n]) - (S1[:, [n]] - S1[:, :n])**2 / (n - np.arange(n)) # cost of [a, n)
+    cost = np.where(is_split, S2 - S1**2 / np.maximum(np.arange(n + 1), 1), np.inf)
+    for i in range(n_clusters - 2):
+        cost = np.where(is_split, _kmeans_1d_layer(cost, S1, S2, top if i == n_clusters - 3 else None), np.inf)
+
+    # The top cluster starts at the split minimizing the total cost
+    total = cost[:, :n] + top
+    start = np.argmin(total, axis=1)
+    has_clusters = np.isfinite(total[np.arange(m), start])
+    return np.where(has_clusters, x[np.arange(m), start], x[:, -1])
+
+def _kmeans_1d_layer(prev, S1, S2, top=None):
+    # One dynamic programming step of 1-D k-means for all columns (rows of prev) at once: the
+    # best cost of each prefix [0, b) is the min over splits a < b of prev[a] + sse(a, b). The
+    # optimal split is monotone in b, so b is solved by divide and conquer, one level at a time.
+    # If this is the last step before the top cluster, top[b] is the cost of [b, n). Prefix costs
+    # never decrease with b and top never increases, so ranges of b whose lower bound exceeds
+    # the best total found so far are skipped (left as inf)
+    m, n = prev.shape[0], prev.shape[1] - 1
+    best = np.full(m, np.inf) # best total cost found so far
+    lower = np.zeros(m) # lower bound on prefix costs in each task (cost left of b_lo)
+    cost = np.full((m, n + 1), np.inf)
+    offset = (n + 1) * np.arange(m) # flat position of each column
+    # sse(a, b) = S2[b] - S2[a] - (S1[b] - S1[a])**2 / (b - a), with S2[b] added after the min
+    flat_prev, flat_S1 = (prev - S2).ravel(), S1.ravel()
+    col = np.arange(m); b_lo = np.ones(m, dtype='int64'); b_hi = np.full(m, n)
+    a_lo = np.ones(m, dtype='int64'); a_hi = np.full(m, n - 1)
+    while len(col) > 0:
+        if not top is None:
+            bound = lower + top[col, np.minimum(b_hi, n - 1)]
+            is_open = bound <= best[col] + 1e-9 * np.abs(best[col]) + 1e-12 # margin for rounding
+            col, b_lo, b_hi, a_lo, a_hi, lower = [x[is_open] for x in (col, b_lo, b_hi, a_lo, a_hi, lower)]
+        mid = (b_lo + b_hi) // 2
+        count = np.maximum(np.minimum(a_hi, mid - 1) - a_lo + 1, 0)
+        opt = a_lo.copy()
+        solved = np.flatnonzero(count > 0)
+        if len(solved) > 0:
+            counts = count[solved]; n_candidates = counts.sum()
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            step = np.arange(n_candidates) - np.repeat(starts, counts) # position within each task
+            pos = np.repeat(offset[col[solved]] + a_lo[solved], counts) + step
+            b_pos = offset[col[solved]] + mid[solved]
+            values = flat_prev[pos] - (np.repeat(flat_S1[b_pos], counts) - flat_S1[pos])**2 / \
+                (np.repeat(mid[solved] - a_lo[solved], counts) - step)
+            mins = np.minimum.reduceat(values, starts)
+            first = np.minimum.reduceat(np.where(values == np.repeat(mins, counts), step, n_candidates), starts)
+            cost[col[solved], mid[solved]] = mins + S2[col[solved], mid[solved]]
+            opt[solved] = a_lo[solved] + first # leftmost optimal split
+            if not top is None:
+                partition = solved[mid[solved] < n] # top cluster is not empty
+                totals = cost[col[partition], mid[partition]] + top[col[partition], mid[partition]]
+                np.minimum.at(best, col[partition], totals)
+        mid_cost = cost[col, mid]
+
+        # Solve b below mid with splits up to opt, and b above mid with splits from opt
+        left = mid - 1 >= b_lo; right = mid + 1 <= b_hi
+        col = np.concatenate([col[left], col[right]])
+        b_lo, b_hi = np.concatenate([b_lo[left], mid[right] + 1]), np.concatenate([mid[left] - 1, b_hi[right]])
+        a_lo, a_hi = np.concatenate([a_lo[left], opt[right]]), np.concatenate([opt[left], a_hi[right]])
+        lower = np.concatenate([lower[left], np.where(np.isfinite(mid_cost), mid_cost, 0)[right]])
+    return cost
@@ -2,13 +2,15 @@ import sys
 import pandas as pd
 from collections import defaultdict
 
+# CLSTR files are parsed here rather than with pyphylon.cdhit.read_clstr, since the
+# combine_cd_hit rule runs in the snakemake image, where pyphylon is not installed
 def main(argv):
     input_file = argv[1]
     output_file = argv[2]
     metadata_file = argv[3]
 
     metadata = pd.read_csv(metadata_file, dtype = 'object').set_index('genome_id')
-    
+
     new_P_matrix = defaultdict(dict)
     with open(input_file, 'r') as f:
         for line in f:
@@ -16,7 +18,7 @@ def main(argv):
             with  open(line.strip(), 'r') as infile:
                 cluster = ''
                 present = False
-                
+
                 for l in infile:
                     if l[0] == '>':
                         if cluster != '':
@@ -28,13 +30,13 @@ def main(argv):
                             cluster = l.split('>')[1].split('...')[0].split('A')[0]
                         if input_name in l:
                             present = True
-                
+
                 if cluster != '':
                     new_P_matrix[cluster][input_name] = int(present)
 
     new_P_matrix = pd.DataFrame(new_P_matrix).T
     new_P_matrix.to_csv(output_file)
-            
+
 
 if __name__ == "__main__":
-   main(sys.argv)
\ No newline at end of file
+   main(sys.argv)